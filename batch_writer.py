@@ -0,0 +1,97 @@
+"""
+Background Batch Writer
+Queue + worker thread that hands accumulated items to a flush function in
+batches, so request handlers enqueue DB work and return immediately.
+
+Usage:
+    writer = BatchWriter("rutx11-db", flush_fn, interval=1.0)
+    writer.submit(item)          # starts the thread on first use
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+FLUSH_FAILURES = REGISTRY.counter("batch_writer_flush_failures_total", "Failed batch flush attempts", labels=("writer",))
+DROPPED_ITEMS = REGISTRY.counter("batch_writer_dropped_items_total", "Items dropped after a failed retry", labels=("writer",))
+
+
+class BatchWriter:
+    """
+    Drains submitted items every `interval` seconds (or as soon as
+    `max_batch` are waiting) and calls flush(items) on its own thread.
+    flush signals failure by raising. A failed batch is retried once after
+    `retry_delay` seconds, then logged, counted and dropped.
+    """
+
+    def __init__(self, name: str, flush: Callable[[List[Any]], None], interval: float = 1.0, max_batch: int = 5000,
+                 retry_delay: float = 2.0):
+        self.name = name
+        self.interval = interval
+        self.max_batch = max_batch
+        self.retry_delay = retry_delay
+        self._flush = flush
+        self._failures = FLUSH_FAILURES.labels(name)
+        self._dropped = DROPPED_ITEMS.labels(name)
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.stats: Dict[str, Any] = {"submitted": 0, "flushed": 0, "batches": 0, "failed": 0, "retried": 0, "last_flush": None}
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, item: Any) -> None:
+        if self._thread is None:
+            self.start()
+        self._queue.put(item)
+        self.stats["submitted"] += 1
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                first = self._queue.get()
+            except Exception:
+                continue
+            # Let a burst accumulate, then take everything that is waiting
+            deadline = time.monotonic() + self.interval
+            while self._queue.qsize() < self.max_batch and time.monotonic() < deadline:
+                time.sleep(min(0.05, self.interval))
+            items = [first]
+            while len(items) < self.max_batch:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._flush_with_retry(items)
+
+    def _flush_with_retry(self, items: List[Any]) -> None:
+        for attempt in (1, 2):
+            try:
+                self._flush(items)
+                self.stats["flushed"] += len(items)
+                self.stats["batches"] += 1
+                self.stats["last_flush"] = time.time()
+                return
+            except Exception as e:
+                self._failures.inc()
+                if attempt == 1:
+                    self.stats["retried"] += len(items)
+                    logger.warning("[%s] Batch flush failed (%d items), retrying: %s", self.name, len(items), e)
+                    time.sleep(self.retry_delay)
+                    continue
+                self.stats["failed"] += len(items)
+                self._dropped.inc(len(items))
+                logger.error("[%s] Batch flush failed again, dropped %d items: %s", self.name, len(items), e)
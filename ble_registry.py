@@ -0,0 +1,133 @@
+"""
+BLE Definitions Registry
+Hot-reloadable set of known beacons for the broker.
+
+A BleDefinitions object is immutable once built: the definitions, the MAC
+lookup index (alternative spellings -> full MAC) and the regex used to find
+known MACs inside raw FMC003 element hex. A reload builds a new object and
+swaps one reference, so a caller that takes `registry.current` once (e.g.
+per packet) sees a single consistent version throughout.
+
+Index keys for each full MAC (12 hex chars, lowercase):
+    the MAC itself, its byte-reversed form (little-endian AVL payloads),
+    and its first / last 8 hex chars when no other beacon shares them
+    (FMC003 truncates MACs).
+"""
+
+import re
+import threading
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+
+MATCH_MEMO_MAX = 10000     # remembered fuzzy-match results per version
+
+
+def normalize_mac(mac: str) -> str:
+    return mac.lower().replace(":", "").replace("-", "")
+
+
+def reverse_mac(mac: str) -> str:
+    return "".join(reversed([mac[i:i + 2] for i in range(0, len(mac), 2)]))
+
+
+class BleDefinitions:
+    """Read-only mapping {mac: definition} plus derived lookup structures."""
+
+    def __init__(self, definitions: Mapping[str, Mapping[str, Any]], version: Optional[str] = None):
+        self.version = version
+        defs = {normalize_mac(mac): MappingProxyType(dict(info)) for mac, info in definitions.items()}
+        self._defs: Mapping[str, Mapping[str, Any]] = MappingProxyType(defs)
+
+        index: Dict[str, str] = {}
+        partial: Dict[str, List[str]] = {}
+        for mac in defs:
+            index[mac] = mac
+            index.setdefault(reverse_mac(mac), mac)
+            for part in (mac[:8], mac[-8:]):
+                partial.setdefault(part, []).append(mac)
+        for part, macs in partial.items():
+            if len(set(macs)) == 1:
+                index.setdefault(part, macs[0])
+        self.index: Mapping[str, str] = MappingProxyType(index)
+
+        # Longest first so a full MAC wins over any MAC that is its prefix
+        macs = sorted(defs, key=len, reverse=True)
+        self._hex_re = re.compile("|".join(re.escape(m) for m in macs)) if macs else None
+
+        # Memo of fuzzy match results for this version (see match_known_beacon)
+        self._memo: Dict[str, Optional[str]] = {}
+        self._memo_lock = threading.Lock()
+
+    # Mapping API (read-only)
+    def __contains__(self, mac: object) -> bool:
+        return mac in self._defs
+
+    def __getitem__(self, mac: str) -> Mapping[str, Any]:
+        return self._defs[mac]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._defs)
+
+    def __len__(self) -> int:
+        return len(self._defs)
+
+    def get(self, mac: str, default: Any = None) -> Any:
+        return self._defs.get(mac, default)
+
+    def keys(self):
+        return self._defs.keys()
+
+    def items(self):
+        return self._defs.items()
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {mac: dict(info) for mac, info in self._defs.items()}
+
+    def lookup(self, mac: str) -> Optional[str]:
+        """Full MAC for an exact / reversed / unique 8-char spelling, else None"""
+        return self.index.get(mac)
+
+    def find_in_hex(self, data_hex: str) -> List[Tuple[str, int]]:
+        """Known MACs appearing in a hex string: [(mac, first_position), ...] in order of appearance"""
+        if self._hex_re is None:
+            return []
+        found: Dict[str, int] = {}
+        for m in self._hex_re.finditer(data_hex):
+            found.setdefault(m.group(0), m.start())
+        return list(found.items())
+
+    def memo_get(self, raw_mac: str) -> Tuple[bool, Optional[str]]:
+        try:
+            return True, self._memo[raw_mac]
+        except KeyError:
+            return False, None
+
+    def memo_put(self, raw_mac: str, result: Optional[str]) -> None:
+        with self._memo_lock:
+            if len(self._memo) >= MATCH_MEMO_MAX:
+                self._memo.clear()
+            self._memo[raw_mac] = result
+
+
+class DefinitionsRegistry:
+    """Holds the current BleDefinitions; reloads swap it atomically."""
+
+    def __init__(self, builtin: Mapping[str, Mapping[str, Any]]):
+        self._builtin = {normalize_mac(mac): dict(info) for mac, info in builtin.items()}
+        self._swap_lock = threading.Lock()
+        self.current = BleDefinitions(self._builtin, version=None)
+        self.reloads = 0
+
+    @property
+    def version(self) -> Optional[str]:
+        return self.current.version
+
+    def swap(self, definitions: Mapping[str, Mapping[str, Any]], version: Optional[str]) -> BleDefinitions:
+        """Install built-in definitions overlaid with `definitions` as the new current version"""
+        merged = dict(self._builtin)
+        merged.update({normalize_mac(mac): info for mac, info in definitions.items()})
+        new = BleDefinitions(merged, version)
+        with self._swap_lock:
+            self.current = new
+            self.reloads += 1
+        return new
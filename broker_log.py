@@ -0,0 +1,154 @@
+"""
+Broker Logging
+Category loggers, per-category levels, sampled hot-path messages and a
+queue-backed background writer for the Teltonika broker.
+
+- Categories are child loggers of "broker" (broker.tcp, broker.codec,
+  broker.ble, ...), each with its own level:
+      BROKER_LOG_LEVEL=INFO                       default for every category
+      BROKER_LOG_LEVELS=codec=DEBUG,tcp=WARNING   per-category overrides
+- Messages use %-style args, so nothing is formatted unless the record is
+  emitted; callers guard anything expensive (hex dumps, key lists) with
+  isEnabledFor().
+- Sampler lets 1 in N events per key (e.g. per IMEI) through, for
+  messages that would otherwise fire on every packet. It keeps at most
+  SAMPLE_MAX_KEYS keys, least recently hit evicted first (keys include
+  MACs, and randomized BLE MACs never repeat).
+- Handlers sit behind a QueueHandler: the calling thread only enqueues
+  the record; formatting and I/O happen on a QueueListener thread.
+- BROKER_LOG_FORMAT=json writes one JSON object per line, including any
+  extra={...} fields passed with the record.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+ROOT = "broker"
+CATEGORIES = ("main", "tcp", "codec", "match", "ble", "db", "zone", "rutx11", "worker", "http")
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+DATE_FORMAT = "%H:%M:%S"
+
+SAMPLE_EVERY = max(1, int(os.environ.get("BROKER_LOG_SAMPLE_EVERY", "100")))
+SAMPLE_MAX_KEYS = 10000
+
+# LogRecord attributes that are not user fields (for the JSON formatter)
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def get_logger(category: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT}.{category}")
+
+
+class Sampler:
+    """
+    1-in-N gate per key. hit(key) returns 0 to skip, otherwise how many
+    events the emitted message stands for (1 for the first event of a key,
+    then N). An evicted key starts over at its first event.
+    """
+
+    def __init__(self, every: int = SAMPLE_EVERY, max_keys: int = SAMPLE_MAX_KEYS):
+        self.every = every
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._counts: "OrderedDict[Hashable, int]" = OrderedDict()    # least recently hit first
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def hit(self, key: Hashable) -> int:
+        with self._lock:
+            n = self._counts.get(key, 0) + 1
+            if n == 1:
+                while len(self._counts) >= self.max_keys:
+                    self._counts.popitem(last=False)
+            else:
+                self._counts.move_to_end(key)
+            if n == 1 or n > self.every:
+                self._counts[key] = 1
+                return n - 1 if n > 1 else 1
+            self._counts[key] = n
+            return 0
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "category": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueue the record untouched. The stock prepare() formats the message on
+    the calling thread; here that waits for the listener thread. Log args
+    must therefore not be mutated after the call (pass values, not live
+    containers).
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def _parse_levels(spec: str) -> Dict[str, int]:
+    levels = {}
+    for part in spec.split(","):
+        if "=" not in part:
+            continue
+        name, level = part.split("=", 1)
+        value = logging.getLevelName(level.strip().upper())
+        if isinstance(value, int):
+            levels[name.strip()] = value
+    return levels
+
+
+def configure(level: Optional[str] = None, levels: Optional[str] = None, fmt: Optional[str] = None) -> None:
+    """Install the queue handler on the root logger (once per process) and apply category levels"""
+    global _listener
+    level = (level or os.environ.get("BROKER_LOG_LEVEL", "INFO")).upper()
+    levels = levels if levels is not None else os.environ.get("BROKER_LOG_LEVELS", "")
+    fmt = (fmt or os.environ.get("BROKER_LOG_FORMAT", "text")).lower()
+
+    # Non-broker loggers (batch_writer, werkzeug, ...) follow the root level;
+    # broker categories inherit "broker" unless overridden
+    root = logging.getLogger()
+    root.setLevel(level)
+    logging.getLogger(ROOT).setLevel(level)
+    overrides = _parse_levels(levels)
+    for category in CATEGORIES:
+        get_logger(category).setLevel(overrides.pop(category, logging.NOTSET))
+    for category, value in overrides.items():
+        get_logger(category).setLevel(value)
+
+    if _listener is not None:
+        return
+    stream = logging.StreamHandler()
+    if fmt == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter(TEXT_FORMAT, DATE_FORMAT))
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -0,0 +1,289 @@
+"""
+Broker In-Memory State Records
+Compact __slots__ records for the Teltonika broker's live state:
+trackers, BLE positions and BLE pairings.
+
+Timestamps are stored as time.monotonic() floats and only rendered to
+ISO-8601 (local wall clock) when serialized.
+"""
+
+import copy
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+# Wall-clock time at monotonic zero, fixed at import so a given monotonic
+# stamp always renders to the same string.
+_MONO_EPOCH = time.time() - time.monotonic()
+
+
+def mono_now() -> float:
+    return time.monotonic()
+
+
+def mono_to_datetime(mono: Optional[float]) -> Optional[datetime]:
+    """Convert a monotonic timestamp to a naive local datetime."""
+    if mono is None:
+        return None
+    return datetime.fromtimestamp(_MONO_EPOCH + mono)
+
+
+def mono_to_iso(mono: Optional[float]) -> Optional[str]:
+    dt = mono_to_datetime(mono)
+    return dt.isoformat() if dt else None
+
+
+def mono_to_epoch(mono: Optional[float]) -> Optional[float]:
+    """Monotonic timestamp -> unix seconds (survives a restart, unlike monotonic)."""
+    return None if mono is None else _MONO_EPOCH + mono
+
+
+def epoch_to_mono(ts: Optional[float]) -> Optional[float]:
+    return None if ts is None else ts - _MONO_EPOCH
+
+
+def wall_to_mono(value: Any) -> Optional[float]:
+    """Convert a naive local datetime / ISO string (e.g. from SQL) to monotonic time."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    return value.timestamp() - _MONO_EPOCH
+
+
+def utc_to_mono(value: Any) -> Optional[float]:
+    """Convert a naive UTC datetime / ISO string (AVL record timestamp) to monotonic time."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp() - _MONO_EPOCH
+
+
+class EventClock:
+    """
+    Event-time watermark of one tracker.
+
+    order() releases one packet's records in event-time order. The watermark
+    is the newest event time released so far; a record more than
+    max_lateness seconds behind it is flagged late (too old to feed the
+    pairing state machine, still fine for history). Records are not held
+    back across packets, so the live view never waits for a later packet.
+    """
+
+    def __init__(self, max_lateness: float):
+        self.max_lateness = max_lateness
+        self.watermark: Optional[float] = None
+
+    def _release(self, ts: float, item: Any) -> Tuple[float, Any, bool]:
+        late = self.watermark is not None and ts < self.watermark - self.max_lateness
+        if not late and (self.watermark is None or ts > self.watermark):
+            self.watermark = ts
+        return ts, item, late
+
+    def order(self, items: Iterable[Tuple[float, Any]]) -> List[Tuple[float, Any, bool]]:
+        """(ts, item) pairs of one packet -> (ts, item, late), oldest first"""
+        return [self._release(ts, item) for ts, item in sorted(items, key=lambda pair: pair[0])]
+
+
+class TrackerState:
+    """Live state of one Teltonika tracker (keyed by IMEI)."""
+
+    __slots__ = ("imei", "label", "lat", "lng", "speed", "last_update", "beacons", "zone", "event_time")
+
+    def __init__(self, imei: str, label: Optional[str] = None):
+        self.imei = imei
+        self.label = label or imei
+        self.lat: float = 0
+        self.lng: float = 0
+        self.speed: float = 0
+        self.last_update: Optional[str] = None   # device record timestamp (ISO, UTC)
+        self.beacons: List[Dict[str, Any]] = []
+        self.zone: Optional[str] = None          # geofence zone_id
+        self.event_time: Optional[float] = None  # monotonic event time of last_update
+
+    def copy(self):
+        return copy.copy(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "label": self.label,
+            "lat": self.lat,
+            "lng": self.lng,
+            "speed": self.speed,
+            "last_update": self.last_update,
+            "beacons": self.beacons,
+            "zone": self.zone,
+        }
+
+
+class BleState:
+    """Last known position and telemetry of one BLE beacon (keyed by MAC)."""
+
+    __slots__ = (
+        "mac", "lat", "lng", "tracker_imei", "tracker_label", "last_seen",
+        "is_paired", "pairing_duration", "battery", "rssi", "magnet_status",
+        "name", "category", "source", "zone", "uncertainty_m",
+        "rssi_smoothed", "distance_m",
+    )
+
+    def __init__(
+        self,
+        mac: str,
+        lat: Optional[float] = None,
+        lng: Optional[float] = None,
+        tracker_imei: Optional[str] = None,
+        tracker_label: Optional[str] = None,
+        last_seen: Optional[float] = None,
+        is_paired: bool = False,
+        pairing_duration: int = 0,
+        battery: Any = None,
+        rssi: Any = None,
+        magnet_status: Any = None,
+        name: Optional[str] = None,
+        category: Optional[str] = None,
+        source: Optional[str] = None,
+    ):
+        self.mac = mac
+        self.lat = lat
+        self.lng = lng
+        self.tracker_imei = tracker_imei
+        self.tracker_label = tracker_label
+        self.last_seen = last_seen                # monotonic
+        self.is_paired = is_paired
+        self.pairing_duration = pairing_duration
+        self.battery = battery
+        self.rssi = rssi
+        self.magnet_status = magnet_status
+        self.name = name
+        self.category = category
+        self.source = source
+        self.zone: Optional[str] = None           # geofence zone_id
+        self.uncertainty_m: Optional[float] = None  # multilateration error radius
+        self.rssi_smoothed: Optional[float] = None  # Kalman-filtered rssi (rssi_filter)
+        self.distance_m: Optional[float] = None     # estimated from rssi_smoothed
+
+    @property
+    def last_update(self) -> Optional[str]:
+        return mono_to_iso(self.last_seen)
+
+    def copy(self):
+        return copy.copy(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        last_update = self.last_update
+        return {
+            "mac": self.mac,
+            "lat": self.lat,
+            "lng": self.lng,
+            "tracker_imei": self.tracker_imei,
+            "tracker_label": self.tracker_label,
+            "last_update": last_update,
+            "last_seen": last_update,
+            "is_paired": self.is_paired,
+            "pairing_duration": self.pairing_duration,
+            "battery": self.battery,
+            "rssi": self.rssi,
+            "magnet_status": self.magnet_status,
+            "name": self.name,
+            "category": self.category,
+            "source": self.source,
+            "zone": self.zone,
+            "uncertainty_m": self.uncertainty_m,
+            "rssi_smoothed": self.rssi_smoothed,
+            "distance_m": self.distance_m,
+        }
+
+
+class PairingState:
+    """Which tracker is currently carrying a beacon and since when."""
+
+    __slots__ = ("tracker_imei", "start_time")
+
+    def __init__(self, tracker_imei: str, start_time: float):
+        self.tracker_imei = tracker_imei
+        self.start_time = start_time              # monotonic
+
+    def copy(self):
+        return copy.copy(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"tracker_imei": self.tracker_imei, "start_time": mono_to_iso(self.start_time)}
+
+
+class LockStripes:
+    """
+    Fixed pool of locks; a key always maps to the same stripe.
+
+    Lock ordering (deadlock-free as long as every caller follows it):
+      tracker stripes -> BLE stripes -> leaf locks (index),
+      and within one pool, ascending stripe index (hold() / hold_all()).
+    lock_factory can supply instrumented locks (metrics.TimedLock).
+    """
+
+    def __init__(self, count: int, lock_factory: Callable[[], Any] = threading.Lock):
+        self._locks = [lock_factory() for _ in range(count)]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    def index(self, key: Any) -> int:
+        return hash(key) % len(self._locks)
+
+    def lock_for(self, key: Any) -> threading.Lock:
+        return self._locks[self.index(key)]
+
+    @contextmanager
+    def hold(self, keys):
+        """Hold the stripes of several keys, acquired in ascending stripe order."""
+        locks = [self._locks[i] for i in sorted({self.index(k) for k in keys})]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    @contextmanager
+    def hold_all(self):
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(self._locks):
+                lock.release()
+
+
+class StateSnapshot:
+    """Copy of the broker state (each record copied under its stripe), safe to read without locks."""
+
+    __slots__ = ("version", "trackers", "ble_positions", "tracker_beacons")
+
+    def __init__(
+        self,
+        version: int,
+        trackers: Dict[str, TrackerState],
+        ble_positions: Dict[str, BleState],
+        tracker_beacons: Dict[str, frozenset],
+    ):
+        self.version = version
+        self.trackers = trackers
+        self.ble_positions = ble_positions
+        self.tracker_beacons = tracker_beacons
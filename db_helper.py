@@ -3,22 +3,55 @@ SQL Server Database Helper for BLE Position Tracking
 Provides functions to store and retrieve BLE positions from SQL Server
 """
 
-import pyodbc
+import importlib.util
+import threading
+import time
 from datetime import datetime
 from typing import Dict, List, Any, Optional
 
+from geo import haversine_m
+from metrics import REGISTRY, timed
+
 # SQL Server connection settings
 SQL_SERVER = r"localhost\SQL2025"
 SQL_DATABASE = "2Plus_AssetTracking"
 SQL_USER = "sa"
 SQL_PASSWORD = "P@ssword0"
 
+LOGIN_TIMEOUT_SEC = 5          # per connect attempt
+CONNECT_RETRY_MIN_SEC = 1      # back-off after a failed connect, doubling...
+CONNECT_RETRY_MAX_SEC = 30     # ...up to this
+
+# pyodbc is imported on first connect, so importing this module is cheap and
+# works on machines without the driver (see driver_available()).
+pyodbc = None
+
 # Connection pool (simple)
 _connection = None
+_next_connect_at = 0.0
+_connect_backoff = 0.0
+
+
+def driver_available() -> bool:
+    """True if pyodbc is installed (checked without importing it)"""
+    return pyodbc is not None or importlib.util.find_spec("pyodbc") is not None
+
+
+def _driver():
+    global pyodbc
+    if pyodbc is None:
+        import pyodbc as driver
+        pyodbc = driver
+    return pyodbc
+
 
 def get_connection():
-    """Get SQL Server connection (with simple pooling)"""
-    global _connection
+    """
+    Get SQL Server connection (with simple pooling).
+    After a failed connect, calls fail fast until the back-off expires instead
+    of each waiting out the login timeout while SQL Server is down.
+    """
+    global _connection, _next_connect_at, _connect_backoff
     try:
         if _connection is not None:
             # Test if connection is still valid
@@ -28,7 +61,11 @@ def get_connection():
             return _connection
     except:
         _connection = None
-    
+
+    now = time.monotonic()
+    if now < _next_connect_at:
+        raise ConnectionError(f"SQL Server unavailable, next connect attempt in {_next_connect_at - now:.0f}s")
+
     conn_str = (
         f"DRIVER={{ODBC Driver 17 for SQL Server}};"
         f"SERVER={SQL_SERVER};"
@@ -37,38 +74,185 @@ def get_connection():
         f"PWD={SQL_PASSWORD};"
         f"TrustServerCertificate=yes;"
     )
-    _connection = pyodbc.connect(conn_str, autocommit=False)
+    try:
+        _connection = _driver().connect(conn_str, autocommit=False, timeout=LOGIN_TIMEOUT_SEC)
+    except Exception:
+        _connect_backoff = min(CONNECT_RETRY_MAX_SEC, max(CONNECT_RETRY_MIN_SEC, _connect_backoff * 2))
+        _next_connect_at = time.monotonic() + _connect_backoff
+        raise
+    _connect_backoff = 0.0
+    _next_connect_at = 0.0
     print(f"[DB] Connected to {SQL_DATABASE}")
     return _connection
 
 
+def wait_for_connection(timeout: Optional[float] = None) -> bool:
+    """Block until SQL Server accepts a connection (retrying with back-off); False on timeout"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        try:
+            get_connection()
+            return True
+        except Exception as e:
+            print(f"[DB ERROR] wait_for_connection: {e}")
+        wait = max(CONNECT_RETRY_MIN_SEC, _next_connect_at - time.monotonic())
+        if deadline is not None:
+            if time.monotonic() + wait > deadline:
+                return False
+        time.sleep(wait)
+
+
+# Per-function latency and in-flight count. Calls share one pyodbc connection
+# without a lock and run concurrently, so in-flight counts calls executing at
+# the same moment (several threads on one connection), not a queue.
+_DB_SECONDS = REGISTRY.histogram("db_call_duration_seconds", "db_helper call latency", labels=("function",))
+_DB_IN_FLIGHT = REGISTRY.gauge("db_calls_in_flight", "db_helper calls currently executing", labels=("function",))
+
+
+def _timed(fn):
+    return timed(_DB_SECONDS.labels(fn.__name__), _DB_IN_FLIGHT.labels(fn.__name__))(fn)
+
+
+@_timed
+def _load_ble_definitions() -> Dict[str, Dict[str, Any]]:
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT mac, name, category, ble_type, serial_number, asset_id, notes
+        FROM BLE_Definitions
+    """)
+
+    definitions = {}
+    for row in cursor.fetchall():
+        mac = row[0].lower() if row[0] else ""
+        definitions[mac] = {
+            "name": row[1],
+            "category": row[2],
+            "type": row[3],
+            "sn": row[4],
+            "asset_id": row[5],
+            "notes": row[6],
+        }
+    return definitions
+
+
 def get_ble_definitions() -> Dict[str, Dict[str, Any]]:
     """Get all known BLE definitions from database"""
+    try:
+        return _load_ble_definitions()
+    except Exception as e:
+        print(f"[DB ERROR] get_ble_definitions: {e}")
+        return {}
+
+
+def get_ble_definitions_snapshot() -> Optional[tuple]:
+    """
+    (version stamp, definitions) for a registry reload; None on a DB error,
+    so the caller keeps its current copy instead of swapping in an empty one.
+    The stamp is read first: a change landing in between is picked up again
+    on the next stamp poll.
+    """
+    try:
+        version = get_ble_definitions_version()
+        return version, _load_ble_definitions()
+    except Exception as e:
+        print(f"[DB ERROR] get_ble_definitions_snapshot: {e}")
+        return None
+
+
+# ── BLE definitions cache ────────────────────────────────────────────────────
+# Definitions change a few times a month but are read on every /data call.
+# Writers bump the System_Config change stamp; readers compare it (one cheap
+# single-row SELECT every DEFS_STAMP_CHECK_SEC) and only reload on change.
+DEFS_VERSION_KEY = "ble_definitions_version"
+DEFS_STAMP_CHECK_SEC = 10     # how often to compare the change stamp
+DEFS_CACHE_TTL_SEC = 900      # hard reload even if the stamp never moves
+
+_defs_lock = threading.Lock()
+_defs_cache: Dict[str, Any] = {"definitions": None, "version": None, "loaded_at": 0.0, "checked_at": 0.0}
+
+
+@_timed
+def get_ble_definitions_version() -> Optional[str]:
+    """
+    Current BLE definitions change stamp from System_Config ("0" if never
+    bumped). None if the row holds NULL: callers treat that as "changed".
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT config_value FROM System_Config WHERE config_key = ?", DEFS_VERSION_KEY)
+    row = cursor.fetchone()
+    return row[0] if row else "0"
+
+
+@_timed
+def bump_ble_definitions_version() -> bool:
+    """Advance the shared change stamp so every process reloads its definitions"""
     try:
         conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("""
-            SELECT mac, name, category, ble_type, serial_number, asset_id, notes
-            FROM BLE_Definitions
-        """)
-        
-        definitions = {}
-        for row in cursor.fetchall():
-            mac = row[0].lower() if row[0] else ""
-            definitions[mac] = {
-                "name": row[1],
-                "category": row[2],
-                "type": row[3],
-                "sn": row[4],
-                "asset_id": row[5],
-                "notes": row[6],
-            }
-        return definitions
+            MERGE System_Config AS target
+            USING (VALUES (?)) AS source (config_key)
+            ON target.config_key = source.config_key
+            WHEN MATCHED THEN UPDATE SET
+                config_value = CAST(COALESCE(TRY_CAST(target.config_value AS BIGINT), 0) + 1 AS VARCHAR(500)),
+                updated_at = GETDATE()
+            WHEN NOT MATCHED THEN INSERT (config_key, config_value, description)
+                VALUES (source.config_key, '1', 'Bumped whenever BLE_Definitions changes');
+        """, DEFS_VERSION_KEY)
+        conn.commit()
+        invalidate_ble_definitions_cache()
+        return True
     except Exception as e:
-        print(f"[DB ERROR] get_ble_definitions: {e}")
-        return {}
+        print(f"[DB ERROR] bump_ble_definitions_version: {e}")
+        return False
+
+
+def invalidate_ble_definitions_cache() -> None:
+    """Force the next get_ble_definitions_cached() call to reload from SQL"""
+    with _defs_lock:
+        _defs_cache["checked_at"] = 0.0
+        _defs_cache["version"] = None
+
 
+def get_ble_definitions_cached() -> Dict[str, Dict[str, Any]]:
+    """
+    Cached get_ble_definitions().
+
+    Returns the in-memory copy while the System_Config stamp is unchanged and
+    the copy is younger than DEFS_CACHE_TTL_SEC. On a DB error the last good
+    copy is kept. Callers must treat the returned dict as read-only.
+    """
+    with _defs_lock:
+        now = time.monotonic()
+        cached = _defs_cache["definitions"]
+        if cached is not None and now - _defs_cache["checked_at"] < DEFS_STAMP_CHECK_SEC:
+            return cached
+
+        try:
+            version = get_ble_definitions_version()
+        except Exception as e:
+            print(f"[DB ERROR] get_ble_definitions_version: {e}")
+            version = None
+
+        fresh = now - _defs_cache["loaded_at"] < DEFS_CACHE_TTL_SEC
+        if cached is not None and fresh and version is not None and version == _defs_cache["version"]:
+            _defs_cache["checked_at"] = now
+            return cached
+
+        try:
+            definitions = _load_ble_definitions()
+        except Exception as e:
+            print(f"[DB ERROR] get_ble_definitions_cached: {e}")
+            _defs_cache["checked_at"] = now
+            return cached if cached is not None else {}
+
+        _defs_cache.update(definitions=definitions, version=version, loaded_at=now, checked_at=now)
+        return definitions
 
+
+@_timed
 def get_ble_position(mac: str) -> Optional[Dict[str, Any]]:
     """Get current position of a BLE by MAC address"""
     try:
@@ -101,6 +285,7 @@ def get_ble_position(mac: str) -> Optional[Dict[str, Any]]:
         return None
 
 
+@_timed
 def get_all_ble_from_diagnostics_view() -> Dict[str, Dict[str, Any]]:
     """
     Get aggregated BLE state per MAC from vw_BLE_Diagnostics (if it exists in 2Plus_AssetTracking).
@@ -143,6 +328,7 @@ def get_all_ble_from_diagnostics_view() -> Dict[str, Dict[str, Any]]:
         return {}
 
 
+@_timed
 def get_all_ble_positions() -> Dict[str, Dict[str, Any]]:
     """Get all BLE positions from database"""
     try:
@@ -188,6 +374,7 @@ def get_all_ble_positions() -> Dict[str, Dict[str, Any]]:
         return {}
 
 
+@_timed
 def update_ble_position(
     mac: str,
     lat: float,
@@ -259,7 +446,7 @@ def update_ble_position(
         
         # Log movement if requested and position changed
         if log_movement and old_lat is not None and old_lng is not None:
-            distance = _calculate_distance(old_lat, old_lng, lat, lng)
+            distance = haversine_m(old_lat, old_lng, lat, lng)
             if distance > 10:  # Only log if moved more than 10 meters
                 cursor.execute("""
                     INSERT INTO BLE_Movement_Log 
@@ -279,6 +466,7 @@ def update_ble_position(
         return False
 
 
+@_timed
 def update_ble_heartbeat(
     mac: str,
     battery_percent=None,
@@ -322,6 +510,108 @@ def update_ble_heartbeat(
         return False
 
 
+@_timed
+def upsert_ble_positions(positions: List[Dict[str, Any]]) -> int:
+    """
+    Batched update_ble_position() without movement logging: one MERGE per row
+    sent with executemany, one commit. Each item: mac, lat, lng, tracker_id,
+    tracker_label, is_paired, pairing_duration_sec, battery_percent, rssi and
+    optionally magnet_status.
+    Returns the number of positions sent (0 on error).
+    """
+    if not positions:
+        return 0
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.fast_executemany = True
+        cursor.executemany("""
+            MERGE BLE_Positions AS target
+            USING (VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?))
+                AS source (mac, lat, lng, last_tracker_id, last_tracker_label,
+                           is_paired, pairing_duration_sec, battery_percent, rssi,
+                           magnet_status)
+            ON target.mac = source.mac
+            WHEN MATCHED THEN UPDATE SET
+                lat = source.lat, lng = source.lng,
+                last_tracker_id = source.last_tracker_id,
+                last_tracker_label = source.last_tracker_label,
+                last_update = GETDATE(),
+                is_paired = source.is_paired,
+                pairing_duration_sec = source.pairing_duration_sec,
+                battery_percent = COALESCE(source.battery_percent, target.battery_percent),
+                rssi = COALESCE(source.rssi, target.rssi),
+                magnet_status = COALESCE(source.magnet_status, target.magnet_status)
+            WHEN NOT MATCHED THEN INSERT
+                (mac, lat, lng, last_tracker_id, last_tracker_label, is_paired,
+                 pairing_duration_sec, battery_percent, rssi, magnet_status)
+                VALUES (source.mac, source.lat, source.lng, source.last_tracker_id,
+                        source.last_tracker_label, source.is_paired,
+                        source.pairing_duration_sec, source.battery_percent, source.rssi,
+                        source.magnet_status);
+        """, [
+            (p["mac"].lower(), p["lat"], p["lng"], str(p.get("tracker_id") or ""), p.get("tracker_label"),
+             bool(p.get("is_paired")), int(p.get("pairing_duration_sec") or 0),
+             p.get("battery_percent"), p.get("rssi"), p.get("magnet_status"))
+            for p in positions
+        ])
+        conn.commit()
+        return len(positions)
+    except Exception as e:
+        print(f"[DB ERROR] upsert_ble_positions: {e}")
+        return 0
+
+
+@_timed
+def update_ble_heartbeats(heartbeats: List[Dict[str, Any]]) -> int:
+    """
+    Batched update_ble_heartbeat(): one executemany + one commit for many MACs.
+    Each item: mac, battery_percent, rssi, last_seen_navixy, tracker_id, tracker_label.
+    Returns the number of heartbeats sent (0 on error).
+    """
+    if not heartbeats:
+        return 0
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.fast_executemany = True
+
+        params = []
+        for hb in heartbeats:
+            last_seen_dt = None
+            if hb.get("last_seen_navixy"):
+                try:
+                    last_seen_dt = datetime.strptime(str(hb["last_seen_navixy"])[:19], "%Y-%m-%d %H:%M:%S")
+                except Exception:
+                    pass
+            tracker_id = hb.get("tracker_id")
+            params.append((
+                hb.get("battery_percent"),
+                str(tracker_id) if tracker_id else None,
+                hb.get("tracker_label"),
+                hb.get("rssi"),
+                last_seen_dt,
+                hb["mac"].lower(),
+            ))
+
+        cursor.executemany("""
+            UPDATE BLE_Positions
+            SET last_update        = GETDATE(),
+                battery_percent    = COALESCE(?, battery_percent),
+                last_tracker_id    = COALESCE(?, last_tracker_id),
+                last_tracker_label = COALESCE(?, last_tracker_label),
+                rssi               = COALESCE(?, rssi),
+                last_seen          = COALESCE(?, last_seen)
+            WHERE mac = ?
+        """, params)
+        conn.commit()
+        return len(params)
+    except Exception as e:
+        print(f"[DB ERROR] update_ble_heartbeats: {e}")
+        return 0
+
+
+@_timed
 def log_pairing(
     mac: str,
     tracker_id,  # Can be int or str (IMEI)
@@ -339,7 +629,7 @@ def log_pairing(
         cursor = conn.cursor()
         
         duration = int((pairing_end - pairing_start).total_seconds())
-        distance = _calculate_distance(start_lat, start_lng, end_lat, end_lng)
+        distance = haversine_m(start_lat, start_lng, end_lat, end_lng)
         
         cursor.execute("""
             INSERT INTO BLE_Pairing_History
@@ -356,6 +646,36 @@ def log_pairing(
         return False
 
 
+@_timed
+def log_zone_events(events: List[Dict[str, Any]]) -> int:
+    """
+    Insert geofence enter/exit events in one batch.
+    Each item: entity_type, entity_id, zone_id, zone_name, zone_kind, event_type, lat, lng, event_time.
+    Returns the number of events written (0 on error).
+    """
+    if not events:
+        return 0
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.fast_executemany = True
+        cursor.executemany("""
+            INSERT INTO Zone_Events
+            (entity_type, entity_id, zone_id, zone_name, zone_kind, event_type, lat, lng, event_time)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (e["entity_type"], str(e["entity_id"]), e["zone_id"], e.get("zone_name"), e.get("zone_kind"),
+             e["event_type"], e.get("lat"), e.get("lng"), e["event_time"])
+            for e in events
+        ])
+        conn.commit()
+        return len(events)
+    except Exception as e:
+        print(f"[DB ERROR] log_zone_events: {e}")
+        return 0
+
+
+@_timed
 def update_tracker(
     tracker_id: int,
     label: str,
@@ -395,6 +715,7 @@ def update_tracker(
         return False
 
 
+@_timed
 def get_config(key: str, default: str = None) -> str:
     """Get a configuration value"""
     try:
@@ -408,21 +729,7 @@ def get_config(key: str, default: str = None) -> str:
         return default
 
 
-def _calculate_distance(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
-    """Calculate distance between two points in meters using Haversine formula"""
-    from math import radians, cos, sin, asin, sqrt
-    
-    lat1, lng1, lat2, lng2 = map(radians, [lat1, lng1, lat2, lng2])
-    dlat = lat2 - lat1
-    dlng = lng2 - lng1
-    
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlng/2)**2
-    c = 2 * asin(sqrt(a))
-    r = 6371000  # Radius of Earth in meters
-    
-    return c * r
-
-
+@_timed
 def insert_tracker_live_data(
     timestamp: datetime,
     imei: str,
@@ -452,6 +759,111 @@ def insert_tracker_live_data(
         return False
 
 
+@_timed
+def insert_tracker_live_data_batch(rows: List[Dict[str, Any]]) -> int:
+    """
+    Batched insert_tracker_live_data(): one executemany + one commit per packet.
+    Each row: timestamp, imei, beacon_mac, lat, lng, speed, battery, rssi, raw_log_line.
+    Returns the number of rows written (0 on error).
+    """
+    if not rows:
+        return 0
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.fast_executemany = True
+        cursor.executemany("""
+            INSERT INTO Tracker_Teltonika_Live_Antigravity 
+            (timestamp, imei, beacon_mac, lat, lng, speed, battery, rssi, raw_log_line)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (r["timestamp"], r["imei"], r.get("beacon_mac"), r.get("lat"), r.get("lng"), r.get("speed"),
+             r.get("battery"), r.get("rssi"), r.get("raw_log_line"))
+            for r in rows
+        ])
+        conn.commit()
+        return len(rows)
+    except Exception as e:
+        print(f"[DB ERROR] insert_tracker_live_data_batch: {e}")
+        return 0
+
+
+# BLE_Scans columns <- scan dict keys (defaults for missing keys)
+_SCAN_COLUMNS = [
+    ("mac", None),
+    ("lat", None),
+    ("lng", None),
+    ("tracker_imei", None),
+    ("tracker_label", None),
+    ("rssi", None),
+    ("battery_percent", None),
+    ("distance_meters", 0),
+    ("magnet_status", None),
+    ("is_known_beacon", 1),
+    ("scan_time", None),
+]
+
+# Scan logging counters (shared by every ingest path)
+scan_log_stats: Dict[str, Any] = {"batches": 0, "rows": 0, "failed_batches": 0, "failed_rows": 0, "last_error": None}
+_scan_log_stats_lock = threading.Lock()
+
+
+def _scan_row(scan: Dict[str, Any]) -> tuple:
+    row = []
+    for column, default in _SCAN_COLUMNS:
+        value = scan.get(column, default)
+        if column == "mac" and value:
+            value = value.lower()
+        elif column == "magnet_status" and value is not None:
+            value = str(value)
+        elif column == "is_known_beacon":
+            value = 1 if value else 0
+        elif column == "scan_time" and value is None:
+            value = datetime.now()
+        row.append(value)
+    return tuple(row)
+
+
+@_timed
+def log_ble_scans(scans: List[Dict[str, Any]]) -> int:
+    """
+    Bulk insert raw BLE detections into BLE_Scans (one executemany + one commit).
+    Each scan: mac, lat, lng, tracker_imei, tracker_label, rssi, battery_percent,
+    distance_meters, magnet_status, is_known_beacon, scan_time (defaults: see _SCAN_COLUMNS).
+    Returns the number of rows written (0 on error; see scan_log_stats).
+    """
+    if not scans:
+        return 0
+    try:
+        rows = [_scan_row(scan) for scan in scans]
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.fast_executemany = True
+        cursor.executemany(f"""
+            INSERT INTO BLE_Scans
+            ({", ".join(column for column, _ in _SCAN_COLUMNS)})
+            VALUES ({", ".join("?" for _ in _SCAN_COLUMNS)})
+        """, rows)
+        conn.commit()
+        with _scan_log_stats_lock:
+            scan_log_stats["batches"] += 1
+            scan_log_stats["rows"] += len(rows)
+        return len(rows)
+    except Exception as e:
+        with _scan_log_stats_lock:
+            scan_log_stats["failed_batches"] += 1
+            scan_log_stats["failed_rows"] += len(scans)
+            scan_log_stats["last_error"] = str(e)
+        print(f"[DB ERROR] log_ble_scans: {e}")
+        return 0
+
+
+def log_ble_scan(**scan: Any) -> bool:
+    """Log a single scan (see log_ble_scans)"""
+    return log_ble_scans([scan]) == 1
+
+
+@_timed
 def get_rutx11_scanners() -> Dict[str, Dict[str, Any]]:
     """Get all registered RUTX11 scanners from System_Config."""
     scanners = {}
@@ -0,0 +1,152 @@
+"""
+Fast JSON serialization for the Flask APIs
+Uses orjson when installed, stdlib json otherwise. Both paths render
+datetime/date as ISO-8601, Decimal and UUID as strings and dataclasses as
+objects (as Flask's default provider does), and can splice pre-serialized
+Fragments.
+
+Usage:
+    app.json = FastJSONProvider(app)       # every jsonify() goes through here
+    rows = [row_cache.get(row["imei"], row) for row in rows]
+"""
+
+import dataclasses
+import decimal
+import json
+import re
+import threading
+import uuid
+from datetime import date, datetime
+from typing import Any, Dict, Hashable, Optional
+
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+    HAVE_ORJSON = True
+except ImportError:
+    orjson = None
+    HAVE_ORJSON = False
+
+_ORJSON_OPTS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY) if HAVE_ORJSON else 0
+_ORJSON_NATIVE_FRAGMENT = HAVE_ORJSON and hasattr(orjson, "Fragment")
+
+# Placeholder for fragments when the backend can't embed raw bytes itself
+_FRAG_TOKEN = f"__frag_{uuid.uuid4().hex}_"
+_FRAG_RE = re.compile(rb'"' + _FRAG_TOKEN.encode() + rb'(\d+)"')
+
+
+class Fragment:
+    """Already-serialized JSON value, written into the output verbatim."""
+
+    __slots__ = ("raw",)
+
+    def __init__(self, raw: bytes):
+        self.raw = raw
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, (decimal.Decimal, uuid.UUID)):
+        return str(obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, (bytes, bytearray)):
+        return obj.hex()
+    if hasattr(obj, "to_dict"):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize obj to compact UTF-8 JSON bytes."""
+    fragments = []
+
+    def default(o: Any) -> Any:
+        if isinstance(o, Fragment):
+            if _ORJSON_NATIVE_FRAGMENT:
+                return orjson.Fragment(o.raw)
+            fragments.append(o.raw)
+            return f"{_FRAG_TOKEN}{len(fragments) - 1}"
+        return _default(o)
+
+    if HAVE_ORJSON:
+        out = orjson.dumps(obj, default=default, option=_ORJSON_OPTS)
+    else:
+        out = json.dumps(obj, default=default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+    if fragments:
+        out = _FRAG_RE.sub(lambda m: fragments[int(m.group(1))], out)
+    return out
+
+
+def loads(data: Any) -> Any:
+    if HAVE_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FragmentCache:
+    """
+    Per-entity cache of serialized JSON.
+
+    get(key, obj) returns a Fragment; obj is only re-serialized when it differs
+    from the object cached for key (or when `stamp` changes, if given). Dict
+    comparison runs in C and is much cheaper than encoding, so unchanged
+    tracker rows / beacon entries cost one == per response.
+    Objects passed in must not be mutated afterwards.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[Hashable, tuple] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, obj: Any, stamp: Optional[Hashable] = None) -> Fragment:
+        check = obj if stamp is None else stamp
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == check:
+            self.hits += 1
+            return entry[1]
+        fragment = Fragment(dumps(obj))
+        with self._lock:
+            self._entries[key] = (check, fragment)
+        self.misses += 1
+        return fragment
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def retain(self, keys) -> None:
+        """Drop entries whose key is not in keys (entities that disappeared)."""
+        keep = set(keys)
+        with self._lock:
+            for key in [k for k in self._entries if k not in keep]:
+                del self._entries[key]
+
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON provider backed by dumps()/loads() above."""
+
+    mimetype = "application/json"
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return dumps(obj).decode("utf-8")
+
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        return loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        """jsonify(): one positional value, several (as a list), or keyword args (as a dict)"""
+        if args and kwargs:
+            raise TypeError("app.json.response() takes either args or kwargs, not both")
+        if len(args) == 1:
+            obj = args[0]
+        else:
+            obj = args or kwargs or None
+        return self._app.response_class(dumps(obj), mimetype=self.mimetype)
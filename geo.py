@@ -0,0 +1,89 @@
+"""
+Geo Distance Helpers
+Shared distance math for the broker, db_helper and analytics scripts.
+
+- distance_m(): scalar fast path. Equirectangular approximation for short
+  hops (error well under 0.1% below EQUIRECT_MAX_M at LLBG's latitude),
+  haversine beyond that.
+- haversine_many() / distances_from() / path_length_m(): NumPy-batched
+  haversine over arrays of points (pure-Python fallback without NumPy).
+"""
+
+from math import atan2, cos, radians, sin, sqrt
+from typing import List, Sequence
+
+try:
+    import numpy as np
+    HAVE_NUMPY = True
+except ImportError:
+    np = None
+    HAVE_NUMPY = False
+
+EARTH_RADIUS_M = 6371000.0
+EQUIRECT_MAX_M = 5000.0     # above this the scalar fast path falls back to haversine
+BATCH_MIN_POINTS = 8        # below this a Python loop beats NumPy call overhead
+
+
+def haversine_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance in meters"""
+    phi1 = radians(lat1)
+    phi2 = radians(lat2)
+    a = sin((phi2 - phi1) / 2) ** 2 + cos(phi1) * cos(phi2) * sin(radians(lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * atan2(sqrt(a), sqrt(1 - a))
+
+
+def equirect_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Equirectangular approximation in meters (accurate for short distances)"""
+    x = radians(lng2 - lng1) * cos(radians((lat1 + lat2) / 2))
+    y = radians(lat2 - lat1)
+    return EARTH_RADIUS_M * sqrt(x * x + y * y)
+
+
+def distance_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Scalar fast path: equirectangular at apron scale, haversine for long hops"""
+    d = equirect_m(lat1, lng1, lat2, lng2)
+    if d > EQUIRECT_MAX_M:
+        return haversine_m(lat1, lng1, lat2, lng2)
+    return d
+
+
+def haversine_many(lats1, lngs1, lats2, lngs2):
+    """Element-wise haversine over broadcastable arrays; returns an ndarray of meters"""
+    phi1 = np.radians(np.asarray(lats1, dtype=np.float64))
+    phi2 = np.radians(np.asarray(lats2, dtype=np.float64))
+    dphi = phi2 - phi1
+    dlmb = np.radians(np.asarray(lngs2, dtype=np.float64) - np.asarray(lngs1, dtype=np.float64))
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def distances_from(lat: float, lng: float, lats: Sequence[float], lngs: Sequence[float]) -> List[float]:
+    """Distances in meters from one point to many (one batched call)"""
+    n = len(lats)
+    if n == 0:
+        return []
+    if not HAVE_NUMPY or n < BATCH_MIN_POINTS:
+        return [distance_m(la, ln, lat, lng) for la, ln in zip(lats, lngs)]
+    return haversine_many(lats, lngs, lat, lng).tolist()
+
+
+def segment_lengths_m(lats: Sequence[float], lngs: Sequence[float]) -> List[float]:
+    """Length of each consecutive segment of a path, in meters"""
+    if len(lats) < 2:
+        return []
+    if not HAVE_NUMPY:
+        return [haversine_m(lats[i], lngs[i], lats[i + 1], lngs[i + 1]) for i in range(len(lats) - 1)]
+    la = np.asarray(lats, dtype=np.float64)
+    ln = np.asarray(lngs, dtype=np.float64)
+    return haversine_many(la[:-1], ln[:-1], la[1:], ln[1:]).tolist()
+
+
+def path_length_m(lats: Sequence[float], lngs: Sequence[float]) -> float:
+    """Total length of a path (e.g. a trip or movement log) in meters"""
+    if len(lats) < 2:
+        return 0.0
+    if not HAVE_NUMPY:
+        return sum(segment_lengths_m(lats, lngs))
+    la = np.asarray(lats, dtype=np.float64)
+    ln = np.asarray(lngs, dtype=np.float64)
+    return float(haversine_many(la[:-1], ln[:-1], la[1:], ln[1:]).sum())
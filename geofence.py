@@ -0,0 +1,193 @@
+"""
+Geofence Engine
+Stand / gate / maintenance-area polygons for LLBG and a bucketed
+point-in-polygon index to tag live positions with the zone they are in.
+
+Zones are the Polygon / MultiPolygon features of the GeoJSON layer files
+(Point features such as the APDC reference points are ignored). Feature
+properties used:
+    id / zone_id / name    zone identifier (falls back to "<file>#<n>", also
+                           when the id is already taken - logged as a warning)
+    name                   display name
+    kind / zone_type / type  "stand", "gate", "maintenance", ... (default "zone")
+
+Lookup: zones are bucketed into a uniform grid by bounding box, so a point
+only tests the few polygons whose box covers its cell - cost depends on
+local zone density, not on the total number of zones.
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Grid cell for zone buckets (~110 m N-S): a stand polygon spans 1-4 cells
+ZONE_CELL_DEG = 0.001
+
+Ring = List[Tuple[float, float]]     # [(lng, lat), ...] as in GeoJSON
+
+logger = logging.getLogger(__name__)
+
+
+def _point_in_ring(lng: float, lat: float, ring: Ring) -> bool:
+    """Even-odd ray casting test"""
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        xi, yi = ring[i]
+        xj, yj = ring[j]
+        if (yi > lat) != (yj > lat) and lng < (xj - xi) * (lat - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def _ring_area(ring: Ring) -> float:
+    """Planar shoelace area in square degrees (only used to rank nested zones)"""
+    area = 0.0
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        area += (ring[j][0] + ring[i][0]) * (ring[j][1] - ring[i][1])
+        j = i
+    return abs(area) / 2
+
+
+class Zone:
+    """One geofence: a (multi)polygon with holes, in GeoJSON lng/lat order."""
+
+    __slots__ = ("zone_id", "name", "kind", "polygons", "bbox", "area")
+
+    def __init__(self, zone_id: str, name: str, kind: str, polygons: List[List[Ring]]):
+        self.zone_id = zone_id
+        self.name = name
+        self.kind = kind
+        self.polygons = polygons             # [[outer, hole, ...], ...]
+        lngs = [p[0] for poly in polygons for p in poly[0]]
+        lats = [p[1] for poly in polygons for p in poly[0]]
+        self.bbox = (min(lngs), min(lats), max(lngs), max(lats))
+        self.area = sum(_ring_area(poly[0]) - sum(_ring_area(h) for h in poly[1:]) for poly in polygons)
+
+    def contains(self, lat: float, lng: float) -> bool:
+        min_lng, min_lat, max_lng, max_lat = self.bbox
+        if not (min_lat <= lat <= max_lat and min_lng <= lng <= max_lng):
+            return False
+        for poly in self.polygons:
+            if _point_in_ring(lng, lat, poly[0]) and not any(_point_in_ring(lng, lat, h) for h in poly[1:]):
+                return True
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"zone_id": self.zone_id, "name": self.name, "kind": self.kind}
+
+
+class GeofenceIndex:
+    """Immutable grid-bucketed index over a set of zones."""
+
+    def __init__(self, zones: Sequence[Zone] = (), cell_deg: float = ZONE_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.zones: Dict[str, Zone] = {z.zone_id: z for z in zones}
+        self._buckets: Dict[Tuple[int, int], List[Zone]] = {}
+        for zone in self.zones.values():
+            min_lng, min_lat, max_lng, max_lat = zone.bbox
+            r0, c0 = self._cell(min_lat, min_lng)
+            r1, c1 = self._cell(max_lat, max_lng)
+            for r in range(r0, r1 + 1):
+                for c in range(c0, c1 + 1):
+                    self._buckets.setdefault((r, c), []).append(zone)
+        # Smallest first, so a stand wins over the apron that contains it
+        for bucket in self._buckets.values():
+            bucket.sort(key=lambda z: z.area)
+
+    def __len__(self) -> int:
+        return len(self.zones)
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def zones_at(self, lat: Optional[float], lng: Optional[float]) -> List[Zone]:
+        """All zones containing the point, smallest first"""
+        if lat is None or lng is None:
+            return []
+        return [z for z in self._buckets.get(self._cell(lat, lng), ()) if z.contains(lat, lng)]
+
+    def zone_at(self, lat: Optional[float], lng: Optional[float]) -> Optional[Zone]:
+        """Innermost zone containing the point (None outside every zone)"""
+        if lat is None or lng is None:
+            return None
+        for zone in self._buckets.get(self._cell(lat, lng), ()):
+            if zone.contains(lat, lng):
+                return zone
+        return None
+
+
+def _zone_from_feature(feature: Dict[str, Any], fallback_id: str) -> Optional[Zone]:
+    geom = feature.get("geometry") or {}
+    gtype = geom.get("type")
+    coords = geom.get("coordinates") or []
+    if gtype == "Polygon":
+        raw = [coords]
+    elif gtype == "MultiPolygon":
+        raw = coords
+    else:
+        return None
+    polygons = [[[(float(p[0]), float(p[1])) for p in ring] for ring in poly] for poly in raw if poly and poly[0]]
+    if not polygons:
+        return None
+    props = feature.get("properties") or {}
+    zone_id = str(props.get("id") or props.get("zone_id") or props.get("name") or fallback_id)
+    name = str(props.get("name") or zone_id)
+    kind = str(props.get("kind") or props.get("zone_type") or props.get("type") or "zone").lower()
+    return Zone(zone_id, name, kind, polygons)
+
+
+def load_zones(paths: Iterable[str]) -> List[Zone]:
+    """Read polygon zones from GeoJSON FeatureCollections; missing files are skipped"""
+    zones: List[Zone] = []
+    taken = set()
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        features = data.get("features", []) if isinstance(data, dict) else []
+        base = os.path.basename(path)
+        for n, feature in enumerate(features):
+            zone = _zone_from_feature(feature, f"{base}#{n}")
+            if zone is None:
+                continue
+            if zone.zone_id in taken:
+                logger.warning("[ZONE] Duplicate zone id %r in %s feature %d; using %s#%d", zone.zone_id, base, n, base, n)
+                zone.zone_id = f"{base}#{n}"
+            taken.add(zone.zone_id)
+            zones.append(zone)
+    return zones
+
+
+class ZoneTracker:
+    """
+    Current zone per entity (tracker IMEI / BLE MAC) and the enter/exit
+    transitions produced by each update. Leaf lock, like the spatial grids.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current: Dict[str, Optional[str]] = {}
+
+    def current(self, key: str) -> Optional[str]:
+        return self._current.get(key)
+
+    def seed(self, key: str, zone_id: Optional[str]) -> None:
+        """Set key's zone without producing a transition (restored / hydrated state)"""
+        with self._lock:
+            self._current[key] = zone_id
+
+    def update(self, key: str, zone_id: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+        """Record key's zone; returns (exited_zone, entered_zone), both None if unchanged"""
+        with self._lock:
+            old = self._current.get(key)
+            if old == zone_id:
+                return None, None
+            self._current[key] = zone_id
+        return old, zone_id
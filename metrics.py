@@ -0,0 +1,258 @@
+"""
+Process Metrics (Prometheus text format)
+Counters, gauges and fixed-bucket histograms for the broker and the API
+server, rendered by their /metrics endpoints.
+
+Hot-path cost is a few attribute updates: every metric (and every label
+child) is created once at setup, histogram buckets are preallocated lists,
+and observe() is a bisect plus two adds - nothing is allocated per event.
+Updates are not locked; under the GIL a rare lost increment when two
+threads race is acceptable for monitoring.
+
+Usage:
+    PACKETS = REGISTRY.counter("teltonika_packets_total", "CODEC8 packets received")
+    PACKETS.inc()
+
+    DB_SECONDS = REGISTRY.histogram("db_call_duration_seconds", "...", labels=("function",))
+    hist = DB_SECONDS.labels("update_tracker")    # resolve once, keep the child
+    t0 = time.perf_counter(); ...; hist.observe(time.perf_counter() - t0)
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Seconds: 100 us .. 10 s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Bytes: 1 KB .. 16 MB
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n: float = 1) -> None:
+        self.value += n
+
+
+class Gauge:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, v: float) -> None:
+        self.value = v
+
+    def inc(self, n: float = 1) -> None:
+        self.value += n
+
+    def dec(self, n: float = 1) -> None:
+        self.value -= n
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)    # last slot = above the top bound
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float) -> None:
+        self.counts[bisect_left(self.bounds, v)] += 1
+        self.sum += v
+        self.count += 1
+
+
+class Family:
+    """One named metric: a single unlabeled child, or children keyed by label values."""
+
+    def __init__(self, kind: str, name: str, doc: str, labels: Sequence[str], factory: Callable[[], object]):
+        self.kind = kind
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self._factory = factory
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.label_names:
+            self._children[()] = factory()
+
+    def labels(self, *values: str):
+        """Child for these label values (created on first use - resolve once, outside hot loops)"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._factory())
+        return child
+
+    # Unlabeled families act as their only child
+    def inc(self, n: float = 1) -> None:
+        self._children[()].inc(n)
+
+    def dec(self, n: float = 1) -> None:
+        self._children[()].dec(n)
+
+    def set(self, v: float) -> None:
+        self._children[()].set(v)
+
+    def observe(self, v: float) -> None:
+        self._children[()].observe(v)
+
+    def _label_str(self, key: Tuple[str, ...], extra: str = "") -> str:
+        parts = [f'{n}="{_escape(v)}"' for n, v in zip(self.label_names, key)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self, out: List[str]) -> None:
+        out.append(f"# HELP {self.name} {self.doc}")
+        out.append(f"# TYPE {self.name} {self.kind}")
+        for key, child in list(self._children.items()):
+            if self.kind == "histogram":
+                cumulative = 0
+                for bound, n in zip(child.bounds + (float("inf"),), list(child.counts)):
+                    cumulative += n
+                    le = 'le="' + _fmt(bound) + '"'
+                    out.append(f"{self.name}_bucket{self._label_str(key, le)} {cumulative}")
+                out.append(f"{self.name}_sum{self._label_str(key)} {_fmt(child.sum)}")
+                out.append(f"{self.name}_count{self._label_str(key)} {child.count}")
+            else:
+                out.append(f"{self.name}{self._label_str(key)} {_fmt(child.value)}")
+
+
+class _CallbackGauge:
+    """Gauge family whose samples are read at scrape time: fn() -> {label_value: value}"""
+
+    def __init__(self, name: str, doc: str, label: Optional[str], fn: Callable[[], Dict[str, float]]):
+        self.name = name
+        self.doc = doc
+        self.label = label
+        self.fn = fn
+
+    def render(self, out: List[str]) -> None:
+        try:
+            samples = self.fn()
+        except Exception:
+            return
+        out.append(f"# HELP {self.name} {self.doc}")
+        out.append(f"# TYPE {self.name} gauge")
+        if self.label is None:
+            out.append(f"{self.name} {_fmt(samples)}")
+            return
+        for value, v in samples.items():
+            out.append(f'{self.name}{{{self.label}="{_escape(value)}"}} {_fmt(v)}')
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families: Dict[str, object] = {}
+
+    def _register(self, name: str, make: Callable[[], object]):
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = make()
+            return family
+
+    def counter(self, name: str, doc: str, labels: Sequence[str] = ()) -> Family:
+        return self._register(name, lambda: Family("counter", name, doc, labels, Counter))
+
+    def gauge(self, name: str, doc: str, labels: Sequence[str] = ()) -> Family:
+        return self._register(name, lambda: Family("gauge", name, doc, labels, Gauge))
+
+    def histogram(self, name: str, doc: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Family:
+        return self._register(name, lambda: Family("histogram", name, doc, labels, lambda: Histogram(buckets)))
+
+    def gauge_callback(self, name: str, doc: str, fn: Callable[[], object], label: Optional[str] = None) -> None:
+        """Gauge computed on scrape: fn() returns a number, or {label_value: number} if label is set"""
+        self._register(name, lambda: _CallbackGauge(name, doc, label, fn))
+
+    def render(self) -> str:
+        out: List[str] = []
+        with self._lock:
+            families = list(self._families.values())
+        for family in families:
+            family.render(out)
+        out.append("")
+        return "\n".join(out)
+
+
+REGISTRY = Registry()
+
+PROCESS_START = REGISTRY.gauge("process_start_time_seconds", "Start time of the process since unix epoch")
+PROCESS_START.set(time.time())
+
+
+def timed(hist: Histogram, inflight: Optional[Gauge] = None):
+    """Decorator: observe each call's duration (and count calls in flight) on pre-resolved children"""
+    def wrap(fn):
+        def inner(*args, **kwargs):
+            if inflight is not None:
+                inflight.inc()
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                hist.observe(time.perf_counter() - t0)
+                if inflight is not None:
+                    inflight.dec()
+        inner.__name__ = fn.__name__
+        inner.__doc__ = fn.__doc__
+        inner.__wrapped__ = fn
+        return inner
+    return wrap
+
+
+class TimedLock:
+    """threading.Lock that records wait and hold time into two histograms."""
+
+    __slots__ = ("_lock", "_wait", "_hold", "_acquired_at")
+
+    def __init__(self, wait: Histogram, hold: Histogram):
+        self._lock = threading.Lock()
+        self._wait = wait
+        self._hold = hold
+        self._acquired_at = 0.0
+
+    def acquire(self) -> bool:
+        t0 = time.perf_counter()
+        self._lock.acquire()
+        t1 = time.perf_counter()
+        self._acquired_at = t1          # only the holder writes this
+        self._wait.observe(t1 - t0)
+        return True
+
+    def release(self) -> None:
+        self._hold.observe(time.perf_counter() - self._acquired_at)
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc) -> None:
+        self.release()
@@ -0,0 +1,217 @@
+"""
+RSSI Multilateration for Fixed RUTX11 Scanners
+Keeps a sliding window of (scanner, RSSI, time) observations per beacon and,
+once per tick, estimates every beacon's position from all scanners that
+heard it:
+
+- RSSI -> range with the log-distance path-loss model
+  (range = 10 ** ((TX_POWER_DBM - rssi) / (10 * PATH_LOSS_EXPONENT))).
+- Initial fix: centroid of the scanners weighted by 1 / range^2.
+- Beacons heard by >= 3 scanners: a few weighted Gauss-Newton steps of
+  least-squares multilateration, batched over all beacons with NumPy.
+- Uncertainty radius: weighted RMS range residual (>= 3 scanners), else the
+  smallest estimated range.
+
+All math runs in a local east/north plane (meters) around the scanners, which
+is exact enough at apron scale.
+"""
+
+import math
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+    HAVE_NUMPY = True
+except ImportError:
+    np = None
+    HAVE_NUMPY = False
+
+from geo import EARTH_RADIUS_M
+
+WINDOW_SEC = 30.0            # observations older than this are dropped
+TX_POWER_DBM = -59.0         # RSSI at 1 m (Teltonika EYE beacons, default TX power)
+PATH_LOSS_EXPONENT = 2.5     # open apron with vehicles around
+MIN_RANGE_M = 1.0
+MAX_RANGE_M = 200.0
+MIN_UNCERTAINTY_M = 1.0
+GN_ITERATIONS = 5
+MAX_OBS_PER_BEACON = 256     # bound per-beacon memory regardless of post rate
+
+
+def rssi_to_range_m(rssi: float) -> float:
+    d = 10 ** ((TX_POWER_DBM - float(rssi)) / (10 * PATH_LOSS_EXPONENT))
+    return min(MAX_RANGE_M, max(MIN_RANGE_M, d))
+
+
+class Fix:
+    """Estimated beacon position from one tick."""
+
+    __slots__ = ("mac", "lat", "lng", "uncertainty_m", "scanners")
+
+    def __init__(self, mac: str, lat: float, lng: float, uncertainty_m: float, scanners: List[str]):
+        self.mac = mac
+        self.lat = lat
+        self.lng = lng
+        self.uncertainty_m = uncertainty_m
+        self.scanners = scanners
+
+
+class MultilaterationEngine:
+    """
+    observe() is called from the webhook (cheap append); tick() runs the
+    batched solve for every beacon from a periodic thread.
+    """
+
+    def __init__(self, window_sec: float = WINDOW_SEC):
+        self.window_sec = window_sec
+        self._lock = threading.Lock()
+        self._obs: Dict[str, Deque[Tuple[str, float, float]]] = {}
+        self._scanners: Dict[str, Tuple[float, float]] = {}
+        self.fixes: Dict[str, Fix] = {}
+
+    def set_scanner(self, scanner_id: str, lat: Optional[float], lng: Optional[float]) -> None:
+        if lat is not None and lng is not None:
+            with self._lock:
+                self._scanners[scanner_id] = (float(lat), float(lng))
+
+    def observe(self, mac: str, scanner_id: str, rssi: Optional[float], t: float) -> None:
+        if rssi is None:
+            return
+        try:
+            rssi = float(rssi)
+        except (TypeError, ValueError):
+            return
+        with self._lock:
+            obs = self._obs.get(mac)
+            if obs is None:
+                obs = self._obs[mac] = deque(maxlen=MAX_OBS_PER_BEACON)
+            obs.append((scanner_id, rssi, t))
+
+    def has_fix(self, mac: str) -> bool:
+        """True if the last tick placed mac using two or more scanners"""
+        fix = self.fixes.get(mac)
+        return fix is not None and len(fix.scanners) >= 2
+
+    def _collect(self, now: float) -> List[Tuple[str, List[Tuple[str, float, float, float]]]]:
+        """Per beacon: [(scanner_id, lat, lng, mean_rssi), ...] over the window"""
+        cutoff = now - self.window_sec
+        out = []
+        with self._lock:
+            for mac in list(self._obs):
+                obs = self._obs[mac]
+                while obs and obs[0][2] < cutoff:
+                    obs.popleft()
+                if not obs:
+                    del self._obs[mac]
+                    continue
+                sums: Dict[str, List[float]] = {}
+                for scanner_id, rssi, _ in obs:
+                    acc = sums.setdefault(scanner_id, [0.0, 0])
+                    acc[0] += rssi
+                    acc[1] += 1
+                heard = [
+                    (sid, self._scanners[sid][0], self._scanners[sid][1], total / n)
+                    for sid, (total, n) in sums.items()
+                    if sid in self._scanners
+                ]
+                if heard:
+                    out.append((mac, heard))
+        return out
+
+    def tick(self, now: float) -> Dict[str, Fix]:
+        """Solve every beacon with observations in the window; returns and stores the fixes"""
+        beacons = self._collect(now)
+        if not beacons:
+            self.fixes = {}
+            return {}
+        fixes = _solve_numpy(beacons) if HAVE_NUMPY else _solve_python(beacons)
+        self.fixes = fixes
+        return fixes
+
+
+def _origin(beacons) -> Tuple[float, float, float]:
+    lats = [s[1] for _, heard in beacons for s in heard]
+    lngs = [s[2] for _, heard in beacons for s in heard]
+    lat0 = sum(lats) / len(lats)
+    lng0 = sum(lngs) / len(lngs)
+    return lat0, lng0, math.cos(math.radians(lat0))
+
+
+def _solve_python(beacons) -> Dict[str, Fix]:
+    """Weighted centroid only (no NumPy)"""
+    lat0, lng0, coslat = _origin(beacons)
+    k = math.pi / 180 * EARTH_RADIUS_M
+    fixes = {}
+    for mac, heard in beacons:
+        ranges = [rssi_to_range_m(s[3]) for s in heard]
+        weights = [1 / (r * r) for r in ranges]
+        wsum = sum(weights)
+        x = sum(w * (s[2] - lng0) * k * coslat for w, s in zip(weights, heard)) / wsum
+        y = sum(w * (s[1] - lat0) * k for w, s in zip(weights, heard)) / wsum
+        fixes[mac] = Fix(mac, lat0 + y / k, lng0 + x / (k * coslat),
+                         max(MIN_UNCERTAINTY_M, min(ranges)), [s[0] for s in heard])
+    return fixes
+
+
+def _solve_numpy(beacons) -> Dict[str, Fix]:
+    """Weighted centroid + batched Gauss-Newton over padded (beacon, scanner) arrays"""
+    lat0, lng0, coslat = _origin(beacons)
+    k = math.pi / 180 * EARTH_RADIUS_M
+    n_b = len(beacons)
+    n_s = max(len(heard) for _, heard in beacons)
+
+    sx = np.zeros((n_b, n_s))
+    sy = np.zeros((n_b, n_s))
+    rssi = np.full((n_b, n_s), TX_POWER_DBM)
+    mask = np.zeros((n_b, n_s), dtype=bool)
+    for i, (_, heard) in enumerate(beacons):
+        m = len(heard)
+        arr = np.asarray([(s[1], s[2], s[3]) for s in heard], dtype=np.float64)
+        sy[i, :m] = (arr[:, 0] - lat0) * k
+        sx[i, :m] = (arr[:, 1] - lng0) * k * coslat
+        rssi[i, :m] = arr[:, 2]
+        mask[i, :m] = True
+
+    ranges = np.clip(10 ** ((TX_POWER_DBM - rssi) / (10 * PATH_LOSS_EXPONENT)), MIN_RANGE_M, MAX_RANGE_M)
+    w = np.where(mask, 1.0 / ranges ** 2, 0.0)
+    wsum = w.sum(axis=1)
+    px = (w * sx).sum(axis=1) / wsum
+    py = (w * sy).sum(axis=1) / wsum
+
+    counts = mask.sum(axis=1)
+    solve = counts >= 3
+    if solve.any():
+        bx, by = px[solve], py[solve]
+        ssx, ssy, rr, ww = sx[solve], sy[solve], ranges[solve], w[solve]
+        for _ in range(GN_ITERATIONS):
+            dx = bx[:, None] - ssx
+            dy = by[:, None] - ssy
+            dist = np.maximum(np.hypot(dx, dy), 1e-6)
+            res = dist - rr
+            jx, jy = dx / dist, dy / dist
+            a11 = (ww * jx * jx).sum(axis=1) + 1e-9
+            a12 = (ww * jx * jy).sum(axis=1)
+            a22 = (ww * jy * jy).sum(axis=1) + 1e-9
+            g1 = (ww * jx * res).sum(axis=1)
+            g2 = (ww * jy * res).sum(axis=1)
+            det = a11 * a22 - a12 * a12
+            ok = np.abs(det) > 1e-12
+            step_x = np.where(ok, (a22 * g1 - a12 * g2) / np.where(ok, det, 1), 0.0)
+            step_y = np.where(ok, (a11 * g2 - a12 * g1) / np.where(ok, det, 1), 0.0)
+            bx = bx - step_x
+            by = by - step_y
+        px[solve], py[solve] = bx, by
+
+    dist = np.hypot(px[:, None] - sx, py[:, None] - sy)
+    rms = np.sqrt((w * (dist - ranges) ** 2).sum(axis=1) / wsum)
+    nearest = np.where(mask, ranges, np.inf).min(axis=1)
+    uncertainty = np.maximum(np.where(solve, rms, nearest), MIN_UNCERTAINTY_M)
+
+    lats = lat0 + py / k
+    lngs = lng0 + px / (k * coslat)
+    return {
+        mac: Fix(mac, float(lats[i]), float(lngs[i]), float(uncertainty[i]), [s[0] for s in heard])
+        for i, (mac, heard) in enumerate(beacons)
+    }
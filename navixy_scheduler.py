@@ -0,0 +1,190 @@
+"""
+Navixy API Rate Scheduler
+Token-bucket budget around the Navixy HTTP API so /data polling fits the
+account quota. Moving trackers get fresh state often, parked ones rarely.
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+# Per-endpoint quota: (refill rate in calls/sec, burst capacity)
+ENDPOINT_QUOTAS: Dict[str, Tuple[float, float]] = {
+    "tracker/list":          (0.2, 2),
+    "tracker/get_state":     (_env_float("NAVIXY_STATE_RATE", 4.0), 20),
+    "tracker/readings/list": (_env_float("NAVIXY_READINGS_RATE", 1.0), 10),
+}
+DEFAULT_QUOTA = (1.0, 5)
+
+# Account-wide ceiling shared by all endpoints
+GLOBAL_RATE_PER_SEC = _env_float("NAVIXY_RATE_PER_SEC", 5.0)
+GLOBAL_BURST = _env_float("NAVIXY_RATE_BURST", 25)
+
+# Poll intervals (seconds) per endpoint and Navixy movement_status
+POLL_INTERVALS: Dict[str, Dict[str, float]] = {
+    "tracker/list":          {"default": 60},
+    "tracker/get_state":     {"moving": 5, "stopped": 30, "parked": 120, "default": 30},
+    "tracker/readings/list": {"moving": 60, "stopped": 300, "parked": 900, "default": 300},
+}
+
+BACKOFF_BASE_SEC = 5      # first back-off after a rate error
+BACKOFF_MAX_SEC = 300     # never wait longer than 5 min
+
+# Rate errors arrive as HTTP 429, or as HTTP 200 with success=false and a
+# Navixy API error code in status.code. Navixy API docs, "Error codes":
+#   15 - Too many requests (rate limit exceeded)
+RATE_LIMIT_HTTP_STATUS = 429
+RATE_LIMIT_ERROR_CODES = {15}
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `rate` tokens/sec."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._stamp
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._stamp = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def refund(self, tokens: float = 1.0) -> None:
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + tokens)
+
+    @property
+    def tokens(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+
+class NavixyScheduler:
+    """
+    Decides which Navixy calls to make on each /data poll.
+
+    - Every call must get a token from its endpoint bucket AND the global bucket.
+    - A rate error (HTTP 429 or error code 15 in status.code) pauses that endpoint with
+      exponential back-off; a success resets the back-off.
+    - `is_due()` spaces per-tracker calls by movement_status so the budget
+      goes to vehicles that are actually moving.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._global = TokenBucket(GLOBAL_RATE_PER_SEC, GLOBAL_BURST)
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._blocked_until: Dict[str, float] = {}
+        self._backoff_sec: Dict[str, float] = {}
+        self._last_poll: Dict[Tuple[str, Any], float] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _bucket(self, endpoint: str) -> TokenBucket:
+        bucket = self._buckets.get(endpoint)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(endpoint)
+                if bucket is None:
+                    rate, capacity = ENDPOINT_QUOTAS.get(endpoint, DEFAULT_QUOTA)
+                    bucket = TokenBucket(rate, capacity)
+                    self._buckets[endpoint] = bucket
+        return bucket
+
+    def _stat(self, endpoint: str, key: str) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, {"calls": 0, "skipped": 0, "throttled": 0, "rate_errors": 0})
+            stats[key] += 1
+
+    def interval_for(self, endpoint: str, movement_status: Optional[str]) -> float:
+        intervals = POLL_INTERVALS.get(endpoint, {"default": 0})
+        return intervals.get(str(movement_status or "").lower(), intervals["default"])
+
+    def is_due(self, endpoint: str, key: Any, movement_status: Optional[str] = None) -> bool:
+        """True when the cached response for (endpoint, key) is older than its poll interval."""
+        last = self._last_poll.get((endpoint, key))
+        if last is None:
+            return True
+        return time.monotonic() - last >= self.interval_for(endpoint, movement_status)
+
+    def acquire(self, endpoint: str) -> bool:
+        """Take one token for `endpoint`; False if backing off or out of budget."""
+        if time.monotonic() < self._blocked_until.get(endpoint, 0):
+            self._stat(endpoint, "throttled")
+            return False
+        bucket = self._bucket(endpoint)
+        if not bucket.try_acquire():
+            self._stat(endpoint, "throttled")
+            return False
+        if not self._global.try_acquire():
+            bucket.refund()
+            self._stat(endpoint, "throttled")
+            return False
+        self._stat(endpoint, "calls")
+        return True
+
+    def mark_polled(self, endpoint: str, key: Any) -> None:
+        self._last_poll[(endpoint, key)] = time.monotonic()
+
+    def mark_skipped(self, endpoint: str) -> None:
+        self._stat(endpoint, "skipped")
+
+    def record_success(self, endpoint: str) -> None:
+        if endpoint in self._backoff_sec:
+            with self._lock:
+                self._backoff_sec.pop(endpoint, None)
+
+    def record_rate_limited(self, endpoint: str, retry_after: Optional[float] = None) -> float:
+        """Pause `endpoint`; honours Retry-After, otherwise doubles the previous back-off."""
+        with self._lock:
+            delay = min(BACKOFF_MAX_SEC, self._backoff_sec.get(endpoint, BACKOFF_BASE_SEC / 2) * 2)
+            self._backoff_sec[endpoint] = delay
+            if retry_after:
+                delay = min(BACKOFF_MAX_SEC, max(delay, float(retry_after)))
+            self._blocked_until[endpoint] = time.monotonic() + delay
+        self._stat(endpoint, "rate_errors")
+        return delay
+
+    def budget(self) -> Dict[str, Any]:
+        """Snapshot of remaining tokens, back-off state and call counters."""
+        now = time.monotonic()
+        endpoints = {}
+        for endpoint in sorted(set(ENDPOINT_QUOTAS) | set(self._buckets)):
+            bucket = self._bucket(endpoint)
+            endpoints[endpoint] = {
+                "tokens": round(bucket.tokens, 2),
+                "capacity": bucket.capacity,
+                "rate_per_sec": bucket.rate,
+                "backoff_remaining_sec": round(max(0.0, self._blocked_until.get(endpoint, 0) - now), 1),
+                **self._stats.get(endpoint, {}),
+            }
+        return {
+            "global": {
+                "tokens": round(self._global.tokens, 2),
+                "capacity": self._global.capacity,
+                "rate_per_sec": self._global.rate,
+            },
+            "endpoints": endpoints,
+            "poll_intervals": POLL_INTERVALS,
+        }
@@ -0,0 +1,212 @@
+"""
+Debug Profiling Endpoints
+Opt-in /debug routes for the broker and the API server, for finding where
+time goes in a running process without restarting it under a profiler:
+
+    GET /debug/profile?seconds=N[&hz=H]   sample every thread's stack for N
+                                          seconds; collapsed stacks
+                                          ("thread;frame;frame count"), ready
+                                          for flamegraph.pl / speedscope
+    GET /debug/threads                    current stack of every thread
+    GET /debug/cprofile?endpoint=E[&requests=K]
+                                          cProfile the next K requests to
+                                          Flask endpoint E
+    GET /debug/cprofile                   pstats report of the captures so far
+
+Registered only when DEBUG_ENDPOINTS=1 (see register_debug_routes), since
+they expose code paths and cost CPU while running.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from typing import Any, Dict, Optional
+
+DEBUG_ENDPOINTS = os.environ.get("DEBUG_ENDPOINTS", "0").lower() in ("1", "true", "yes")
+
+MAX_PROFILE_SECONDS = 120
+DEFAULT_HZ = 100
+MAX_HZ = 1000
+MAX_STACK_DEPTH = 128
+
+_sampling_lock = threading.Lock()     # one sampling run at a time
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds: float, hz: int = DEFAULT_HZ) -> Counter:
+    """Sample all threads' stacks for `seconds`; returns Counter{collapsed_stack: samples}"""
+    interval = 1.0 / hz
+    me = threading.get_ident()
+    stacks: Counter = Counter()
+    labels: Dict[Any, str] = {}       # code object -> label, formatted once
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            parts = []
+            while frame is not None and len(parts) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = _frame_label(code)
+                parts.append(label)
+                frame = frame.f_back
+            parts.append(names.get(ident, f"thread-{ident}"))
+            parts.reverse()
+            stacks[";".join(parts)] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def collapsed(stacks: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def thread_dump() -> str:
+    """Every live thread with its current stack, innermost frame last"""
+    frames = sys._current_frames()
+    out = []
+    for thread in sorted(threading.enumerate(), key=lambda t: t.name):
+        frame = frames.get(thread.ident)
+        out.append(f'Thread "{thread.name}" ident={thread.ident} daemon={thread.daemon}\n')
+        if frame is not None:
+            out.extend("  " + line for line in "".join(traceback.format_stack(frame)).splitlines(True))
+        out.append("\n")
+    return "".join(out)
+
+
+class EndpointProfiler:
+    """
+    On-demand cProfile of selected Flask endpoints. arm(endpoint, n) profiles
+    the next n requests to that endpoint (each on its own request thread) and
+    merges them into one pstats report. Only one request is profiled at a time
+    (Python 3.12+ allows a single active profiler): a concurrent request runs
+    unprofiled and leaves its slot for the next one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._capture_lock = threading.Lock()     # held while a capture is enabled
+        self._armed: Dict[str, int] = {}
+        self._stats: Dict[str, pstats.Stats] = {}
+        self._local = threading.local()
+
+    def arm(self, endpoint: str, requests: int) -> None:
+        with self._lock:
+            self._armed[endpoint] = requests
+            self._stats.pop(endpoint, None)
+
+    def start(self, endpoint: Optional[str]) -> None:
+        if not self._armed or endpoint is None:
+            return
+        if not self._capture_lock.acquire(blocking=False):
+            return
+        with self._lock:
+            left = self._armed.get(endpoint, 0)
+            if left <= 0:
+                self._capture_lock.release()
+                return
+            if left == 1:
+                del self._armed[endpoint]
+            else:
+                self._armed[endpoint] = left - 1
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:
+            # Another profiling tool (debugger, sys.setprofile user) is active: skip, keep the slot
+            with self._lock:
+                self._armed[endpoint] = self._armed.get(endpoint, 0) + 1
+            self._capture_lock.release()
+            return
+        self._local.current = (endpoint, prof)
+
+    def stop(self) -> None:
+        current = getattr(self._local, "current", None)
+        if current is None:
+            return
+        self._local.current = None
+        endpoint, prof = current
+        prof.disable()
+        self._capture_lock.release()
+        with self._lock:
+            stats = self._stats.get(endpoint)
+            if stats is None:
+                self._stats[endpoint] = pstats.Stats(prof)
+            else:
+                stats.add(prof)
+
+    def report(self, limit: int = 40) -> str:
+        with self._lock:
+            out = io.StringIO()
+            if self._armed:
+                out.write(f"armed: {dict(self._armed)}\n\n")
+            for endpoint, stats in self._stats.items():
+                out.write(f"=== {endpoint} ===\n")
+                stats.stream = out
+                stats.sort_stats("cumulative").print_stats(limit)
+            return out.getvalue() or "no captures yet\n"
+
+
+endpoint_profiler = EndpointProfiler()
+
+
+def register_debug_routes(app) -> bool:
+    """Add the /debug routes to a Flask app if DEBUG_ENDPOINTS is set; returns whether it did"""
+    if not DEBUG_ENDPOINTS:
+        return False
+    from flask import Response, request
+
+    @app.before_request
+    def _cprofile_start():
+        endpoint_profiler.start(request.endpoint)
+
+    @app.teardown_request
+    def _cprofile_stop(exc):
+        endpoint_profiler.stop()
+
+    @app.get("/debug/profile")
+    def debug_profile():
+        try:
+            seconds = min(float(request.args.get("seconds", "10")), MAX_PROFILE_SECONDS)
+            hz = min(max(int(request.args.get("hz", DEFAULT_HZ)), 1), MAX_HZ)
+        except ValueError:
+            return Response("seconds / hz must be numbers\n", status=400, mimetype="text/plain")
+        if not _sampling_lock.acquire(blocking=False):
+            return Response("a profile is already running\n", status=409, mimetype="text/plain")
+        try:
+            stacks = sample_stacks(seconds, hz)
+        finally:
+            _sampling_lock.release()
+        return Response(collapsed(stacks), mimetype="text/plain")
+
+    @app.get("/debug/threads")
+    def debug_threads():
+        return Response(thread_dump(), mimetype="text/plain")
+
+    @app.get("/debug/cprofile")
+    def debug_cprofile():
+        endpoint = request.args.get("endpoint")
+        if endpoint:
+            if endpoint not in app.view_functions:
+                return Response(f"unknown endpoint {endpoint!r}\n", status=404, mimetype="text/plain")
+            try:
+                requests = max(1, int(request.args.get("requests", "1")))
+            except ValueError:
+                return Response("requests must be an integer\n", status=400, mimetype="text/plain")
+            endpoint_profiler.arm(endpoint, requests)
+            return Response(f"profiling next {requests} request(s) to {endpoint}\n", mimetype="text/plain")
+        return Response(endpoint_profiler.report(), mimetype="text/plain")
+
+    return True
@@ -12,6 +12,8 @@ from datetime import datetime
 import os
 import sys
 
+from geo import path_length_m
+
 # Force unbuffered output
 sys.stdout.reconfigure(line_buffering=True)
 
@@ -145,6 +147,19 @@ def main():
     trip_data["summary"]["beacons_detected"] = list(trip_data["summary"]["beacons_detected"])
     trip_data["summary"]["total_ble_detections"] = len(trip_data["ble_detections"])
     trip_data["summary"]["duration_seconds"] = (datetime.now() - trip_start).total_seconds()
+
+    # Distance per tracker over its recorded path (one batched haversine per tracker)
+    paths = {}
+    for rec in trip_data["records"]:
+        if rec.get("lat") is None or rec.get("lng") is None:
+            continue
+        lats, lngs = paths.setdefault(rec.get("imei"), ([], []))
+        lats.append(rec["lat"])
+        lngs.append(rec["lng"])
+    trip_data["summary"]["distance_by_tracker"] = {
+        imei: round(path_length_m(lats, lngs), 1) for imei, (lats, lngs) in paths.items()
+    }
+    trip_data["summary"]["distance_traveled"] = round(sum(trip_data["summary"]["distance_by_tracker"].values()), 1)
     
     # Save to file
     with open(filepath, 'w', encoding='utf-8') as f:
@@ -156,6 +171,7 @@ def main():
     print("TRIP SUMMARY:")
     print(f"   Duration: {trip_data['summary']['duration_seconds']:.0f} seconds")
     print(f"   Total records: {trip_data['summary']['total_records']}")
+    print(f"   Distance traveled: {trip_data['summary']['distance_traveled']:.0f} m")
     print(f"   BLE detections: {trip_data['summary']['total_ble_detections']}")
     print(f"   Beacons seen: {len(trip_data['summary']['beacons_detected'])}")
     for mac in trip_data['summary']['beacons_detected']:
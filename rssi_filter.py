@@ -0,0 +1,102 @@
+"""
+Per-Link RSSI Filter
+1-D Kalman filter over RSSI for every (beacon, receiver) link, so the map and
+SQL get a steady signal value instead of raw +/-10 dB jitter.
+
+State lives in flat arrays (estimate, variance, last update time) indexed by
+a slot per link, not in per-beacon objects. Process noise grows with the time
+since the last sample, so a beacon that was silent for a while re-converges
+quickly.
+
+The bank is bounded: links idle for LINK_TTL_SEC are evicted, and past
+MAX_LINKS the least recently updated link goes (RUTX11 scanners report every
+MAC they hear, including randomized ones). Freed slots are reused.
+"""
+
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Hashable, List, Optional
+
+from multilateration import rssi_to_range_m
+
+PROCESS_NOISE_DB2_PER_SEC = 0.5   # how fast the true RSSI is allowed to drift
+MEASUREMENT_NOISE_DB2 = 16.0      # raw RSSI variance (~4 dB std)
+INITIAL_VARIANCE_DB2 = 16.0
+
+LINK_TTL_SEC = 3600.0             # forget a link after an hour without samples
+MAX_LINKS = 20000                 # hard cap on links held
+
+
+class RssiFilterBank:
+    """Kalman-filtered RSSI per link key (e.g. (mac, tracker_imei))."""
+
+    def __init__(self, q: float = PROCESS_NOISE_DB2_PER_SEC, r: float = MEASUREMENT_NOISE_DB2,
+                 ttl: float = LINK_TTL_SEC, max_links: int = MAX_LINKS):
+        self.q = q
+        self.r = r
+        self.ttl = ttl
+        self.max_links = max_links
+        self._lock = threading.Lock()
+        self._slots: "OrderedDict[Hashable, int]" = OrderedDict()    # least recently updated first
+        self._free: List[int] = []
+        self._x = array("d")      # filtered RSSI
+        self._p = array("d")      # estimate variance
+        self._t = array("d")      # time of last sample (monotonic)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def update(self, key: Hashable, rssi: Optional[float], t: float) -> Optional[float]:
+        """Feed one raw sample; returns the filtered RSSI (None if no sample yet)"""
+        try:
+            z = float(rssi) if rssi is not None else None
+        except (TypeError, ValueError):
+            z = None
+        with self._lock:
+            slot = self._slots.get(key)
+            if z is None:
+                return round(self._x[slot], 1) if slot is not None else None
+            if slot is None:
+                self._evict(t)
+                if self._free:
+                    slot = self._free.pop()
+                    self._x[slot] = z
+                    self._p[slot] = INITIAL_VARIANCE_DB2
+                    self._t[slot] = t
+                else:
+                    slot = len(self._x)
+                    self._x.append(z)
+                    self._p.append(INITIAL_VARIANCE_DB2)
+                    self._t.append(t)
+                self._slots[key] = slot
+                return round(z, 1)
+            self._slots.move_to_end(key)
+            dt = max(0.0, t - self._t[slot])
+            p = self._p[slot] + self.q * dt
+            k = p / (p + self.r)
+            x = self._x[slot] + k * (z - self._x[slot])
+            self._x[slot] = x
+            self._p[slot] = (1 - k) * p
+            self._t[slot] = max(t, self._t[slot])
+            return round(x, 1)
+
+    def _evict(self, now: float) -> None:
+        """Drop idle links from the LRU end, and the oldest ones while at the cap (lock held)"""
+        while self._slots:
+            key, slot = next(iter(self._slots.items()))
+            if len(self._slots) < self.max_links and now - self._t[slot] <= self.ttl:
+                break
+            del self._slots[key]
+            self._free.append(slot)
+
+    def value(self, key: Hashable) -> Optional[float]:
+        slot = self._slots.get(key)
+        return round(self._x[slot], 1) if slot is not None else None
+
+
+def estimate_distance_m(rssi: Optional[float]) -> Optional[float]:
+    """Estimated beacon distance from (smoothed) RSSI, meters"""
+    if rssi is None:
+        return None
+    return round(rssi_to_range_m(rssi), 1)
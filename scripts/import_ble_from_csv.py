@@ -1,22 +1,43 @@
 #!/usr/bin/env python3
 """
-Import BLE positions from your SQL export (CSV) into BLE_Positions.
-Use this so the broker has a start point until live data pops in.
+Bulk-import BLE positions or BLE definitions from a CSV / Parquet export.
+Use positions so the broker has a start point until live data pops in; use
+definitions to onboard an asset register (the broker picks new beacons up
+without a restart).
 
 Usage:
   python scripts/import_ble_from_csv.py path/to/export.csv
+  python scripts/import_ble_from_csv.py --table definitions assets.parquet
+  python scripts/import_ble_from_csv.py --dry-run --errors bad_rows.csv export.csv
 
-CSV columns (case-insensitive, order doesn't matter). Minimum: mac, lat, lng.
-  mac, lat, lng, last_update, battery_percent, last_tracker_label, name, category, ble_type, serial_number
+Columns (case-insensitive, order doesn't matter; aliases in FIELDS below).
+  positions   - minimum: mac, lat, lng
+                mac, lat, lng, last_update, battery_percent, last_tracker_label,
+                name, category, ble_type, serial_number
+  definitions - minimum: mac
+                mac, name, category, ble_type, serial_number, asset_id, notes
 
-Example CSV header:
+Example CSV header (positions):
   mac,lat,lng,last_update,battery_percent,last_tracker_label,name,category
   7cd9f407f95c,32.311962,34.932443,2026-02-19 14:25:19,85,Direct,Eybe2plus1,Towed Device
+
+How it loads: the header is resolved once, rows are streamed and validated,
+valid rows go into a #temp table with fast_executemany in batches of
+BATCH_ROWS, then one set-based MERGE applies them and everything commits
+together. If a MAC appears more than once, the last row wins. Rows that fail
+validation are reported (row number, mac, reason) and skipped; they do not
+abort the import.
+
+Parquet input needs pyarrow (pip install pyarrow).
 """
+import argparse
 import csv
-import sys
 import os
+import re
+import sys
+import time
 from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
 
 # Run from repo root so db_helper is importable
 _script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -25,105 +46,381 @@ if _root not in sys.path:
     sys.path.insert(0, _root)
 
 import db_helper
+from ble_registry import normalize_mac
+
+BATCH_ROWS = 5000          # rows per fast_executemany round trip
+MAX_ERRORS_SHOWN = 50      # per-row errors printed (all go to --errors)
+
+MAC_RE = re.compile(r"[0-9a-f]{12}")
+
+# Header aliases per field, resolved once per file
+FIELDS: Dict[str, Tuple[str, ...]] = {
+    "mac": ("mac", "mac_address", "macaddress"),
+    "lat": ("lat", "latitude"),
+    "lng": ("lng", "lon", "long", "longitude"),
+    "last_update": ("last_update", "lastupdate", "updated_at"),
+    "battery_percent": ("battery_percent", "battery", "batterypercent"),
+    "last_tracker_label": ("last_tracker_label", "tracker_label", "tracker"),
+    "name": ("name", "beacon_name"),
+    "category": ("category",),
+    "ble_type": ("ble_type", "type"),
+    "serial_number": ("serial_number", "sn", "serial"),
+    "asset_id": ("asset_id", "asset"),
+    "notes": ("notes", "note", "description"),
+}
+
+
+# ── value parsing (ValueError = row rejected) ───────────────────────────────
+
+def _value(row: Sequence[Any], i: Optional[int]) -> Any:
+    if i is None or i >= len(row):
+        return None
+    v = row[i]
+    if isinstance(v, str):
+        v = v.strip()
+        return v or None
+    return v
+
+
+def _mac(v: Any) -> str:
+    if v is None:
+        raise ValueError("missing mac")
+    mac = normalize_mac(str(v))
+    if not MAC_RE.fullmatch(mac):
+        raise ValueError(f"invalid mac {v!r}")
+    return mac
+
 
+def _coord(v: Any, field: str, limit: float) -> float:
+    if v is None:
+        raise ValueError(f"missing {field}")
+    try:
+        x = float(v)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid {field} {v!r}")
+    if not -limit <= x <= limit:
+        raise ValueError(f"{field} out of range: {x}")
+    return x
 
-def _parse_dt(s):
-    if not s or str(s).strip() == "":
+
+def _parse_dt(v: Any) -> Optional[datetime]:
+    if v is None:
         return None
-    s = str(s).strip()
+    if isinstance(v, datetime):
+        return v.replace(tzinfo=None)
+    s = str(v)
     for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y"):
         try:
             return datetime.strptime(s, fmt)
         except ValueError:
             continue
-    return None
+    raise ValueError(f"invalid last_update {s!r}")
 
 
-def _col(row, *names):
-    for n in names:
-        for k, v in row.items():
-            if k and k.strip().lower() == n.lower():
-                return v.strip() if v is not None else ""
-    return ""
+def _battery(v: Any) -> Optional[int]:
+    if v is None:
+        return None
+    try:
+        return int(float(v))
+    except (TypeError, ValueError):
+        return None     # as before: a bad battery value is dropped, not fatal
 
 
-def main():
-    if len(sys.argv) < 2:
-        print(__doc__)
-        print("Usage: python scripts/import_ble_from_csv.py <path/to/export.csv>")
-        sys.exit(1)
-    path = sys.argv[1]
-    if not os.path.isfile(path):
-        print(f"File not found: {path}")
-        sys.exit(1)
-
-    rows = []
+def _text(v: Any, field: str, max_len: int) -> Optional[str]:
+    if v is None:
+        return None
+    s = str(v)
+    if len(s) > max_len:
+        raise ValueError(f"{field} longer than {max_len} chars")
+    return s
+
+
+def _position_row(row: Sequence[Any], cols: Dict[str, Optional[int]]) -> tuple:
+    return (
+        _mac(_value(row, cols["mac"])),
+        _coord(_value(row, cols["lat"]), "lat", 90),
+        _coord(_value(row, cols["lng"]), "lng", 180),
+        _parse_dt(_value(row, cols["last_update"])),
+        _battery(_value(row, cols["battery_percent"])),
+        _text(_value(row, cols["last_tracker_label"]), "last_tracker_label", 100),
+        _text(_value(row, cols["name"]), "name", 100),
+        _text(_value(row, cols["category"]), "category", 50),
+        _text(_value(row, cols["ble_type"]), "ble_type", 50) or "eye_beacon",
+        _text(_value(row, cols["serial_number"]), "serial_number", 50),
+    )
+
+
+def _definition_row(row: Sequence[Any], cols: Dict[str, Optional[int]]) -> tuple:
+    return (
+        _mac(_value(row, cols["mac"])),
+        _text(_value(row, cols["name"]), "name", 100),
+        _text(_value(row, cols["category"]), "category", 50),
+        _text(_value(row, cols["ble_type"]), "ble_type", 50) or "eye_beacon",
+        _text(_value(row, cols["serial_number"]), "serial_number", 50),
+        _text(_value(row, cols["asset_id"]), "asset_id", 50),
+        _text(_value(row, cols["notes"]), "notes", 500),
+    )
+
+
+# ── target tables ───────────────────────────────────────────────────────────
+# columns: staged in this order after row_no; row: parser for one input row.
+# The MERGE takes the last staged row per MAC, so duplicates never collide.
+
+TABLES: Dict[str, Dict[str, Any]] = {
+    "positions": {
+        "target": "BLE_Positions",
+        "required": ("mac", "lat", "lng"),
+        "columns": ("mac", "lat", "lng", "last_update", "battery_percent", "last_tracker_label",
+                    "name", "category", "ble_type", "serial_number"),
+        "row": _position_row,
+        "staging": """
+            CREATE TABLE #ble_import (
+                row_no INT NOT NULL,
+                mac VARCHAR(20) NOT NULL,
+                lat FLOAT NOT NULL,
+                lng FLOAT NOT NULL,
+                last_update DATETIME NULL,
+                battery_percent INT NULL,
+                last_tracker_label VARCHAR(100) NULL,
+                name VARCHAR(100) NULL,
+                category VARCHAR(50) NULL,
+                ble_type VARCHAR(50) NULL,
+                serial_number VARCHAR(50) NULL
+            )
+        """,
+        "merge": """
+            MERGE BLE_Positions AS target
+            USING (
+                SELECT mac, lat, lng, last_update, battery_percent, last_tracker_label,
+                       name, category, ble_type, serial_number
+                FROM (
+                    SELECT *, ROW_NUMBER() OVER (PARTITION BY mac ORDER BY row_no DESC) AS rn
+                    FROM #ble_import
+                ) AS staged
+                WHERE rn = 1
+            ) AS source
+            ON target.mac = source.mac
+            WHEN MATCHED THEN UPDATE SET
+                lat = source.lat, lng = source.lng,
+                last_update = COALESCE(source.last_update, target.last_update),
+                battery_percent = COALESCE(source.battery_percent, target.battery_percent),
+                last_tracker_label = COALESCE(source.last_tracker_label, target.last_tracker_label),
+                name = COALESCE(source.name, target.name),
+                category = COALESCE(source.category, target.category),
+                ble_type = COALESCE(source.ble_type, target.ble_type),
+                serial_number = COALESCE(source.serial_number, target.serial_number)
+            WHEN NOT MATCHED THEN INSERT
+                (mac, lat, lng, last_update, battery_percent, last_tracker_label,
+                 name, category, ble_type, serial_number)
+                VALUES (source.mac, source.lat, source.lng, source.last_update, source.battery_percent,
+                        source.last_tracker_label, source.name, source.category, source.ble_type,
+                        source.serial_number)
+            OUTPUT $action;
+        """,
+    },
+    "definitions": {
+        "target": "BLE_Definitions",
+        "required": ("mac",),
+        "columns": ("mac", "name", "category", "ble_type", "serial_number", "asset_id", "notes"),
+        "row": _definition_row,
+        "staging": """
+            CREATE TABLE #ble_import (
+                row_no INT NOT NULL,
+                mac VARCHAR(20) NOT NULL,
+                name VARCHAR(100) NULL,
+                category VARCHAR(50) NULL,
+                ble_type VARCHAR(50) NULL,
+                serial_number VARCHAR(50) NULL,
+                asset_id VARCHAR(50) NULL,
+                notes VARCHAR(500) NULL
+            )
+        """,
+        "merge": """
+            MERGE BLE_Definitions AS target
+            USING (
+                SELECT mac, name, category, ble_type, serial_number, asset_id, notes
+                FROM (
+                    SELECT *, ROW_NUMBER() OVER (PARTITION BY mac ORDER BY row_no DESC) AS rn
+                    FROM #ble_import
+                ) AS staged
+                WHERE rn = 1
+            ) AS source
+            ON target.mac = source.mac
+            WHEN MATCHED THEN UPDATE SET
+                name = COALESCE(source.name, target.name),
+                category = COALESCE(source.category, target.category),
+                ble_type = COALESCE(source.ble_type, target.ble_type),
+                serial_number = COALESCE(source.serial_number, target.serial_number),
+                asset_id = COALESCE(source.asset_id, target.asset_id),
+                notes = COALESCE(source.notes, target.notes)
+            WHEN NOT MATCHED THEN INSERT
+                (mac, name, category, ble_type, serial_number, asset_id, notes)
+                VALUES (source.mac, source.name, source.category, source.ble_type,
+                        source.serial_number, source.asset_id, source.notes)
+            OUTPUT $action;
+        """,
+    },
+}
+
+
+# ── input ───────────────────────────────────────────────────────────────────
+
+def _csv_source(path: str) -> Iterator[Sequence[Any]]:
+    """Header first, then data rows"""
     with open(path, newline="", encoding="utf-8-sig") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            rows.append(row)
+        reader = csv.reader(f)
+        yield next(reader, [])
+        yield from reader
 
-    if not rows:
-        print("No rows in CSV.")
-        sys.exit(1)
 
-    conn = db_helper.get_connection()
-    cursor = conn.cursor()
-    updated = 0
-    inserted = 0
-    errors = []
-
-    for i, row in enumerate(rows):
-        mac = _col(row, "mac", "mac_address", "macaddress").lower().replace(":", "").replace("-", "")
-        if not mac:
-            errors.append(f"Row {i+2}: missing mac")
+def _parquet_source(path: str) -> Iterator[Sequence[Any]]:
+    """Header first, then data rows (read BATCH_ROWS at a time)"""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Parquet input needs pyarrow: pip install pyarrow")
+    pf = pq.ParquetFile(path)
+    yield pf.schema_arrow.names
+    for batch in pf.iter_batches(batch_size=BATCH_ROWS):
+        yield from zip(*(column.to_pylist() for column in batch.columns))
+
+
+def open_source(path: str) -> Iterator[Sequence[Any]]:
+    if path.lower().endswith((".parquet", ".pq")):
+        return _parquet_source(path)
+    return _csv_source(path)
+
+
+def resolve_header(header: Sequence[Any], required: Sequence[str]) -> Dict[str, Optional[int]]:
+    """{field: column index or None}; raises ValueError naming missing required columns"""
+    positions = {}
+    for i, name in enumerate(header):
+        if name is not None:
+            positions.setdefault(str(name).strip().lower(), i)
+    cols = {
+        field: next((positions[a] for a in aliases if a in positions), None)
+        for field, aliases in FIELDS.items()
+    }
+    missing = [field for field in required if cols[field] is None]
+    if missing:
+        raise ValueError(f"missing required column(s): {', '.join(missing)}")
+    return cols
+
+
+def parse_rows(source: Iterator[Sequence[Any]], spec: Dict[str, Any], cols: Dict[str, Optional[int]],
+               errors: List[Tuple[int, str, str]]) -> Iterator[tuple]:
+    """(row_no, *values) for every valid row; invalid rows are appended to errors"""
+    convert = spec["row"]
+    mac_col = cols["mac"]
+    for row_no, row in enumerate(source, start=2):     # row 1 is the header
+        if not any(v not in (None, "") for v in row):
             continue
         try:
-            lat = float(_col(row, "lat", "latitude") or 0)
-            lng = float(_col(row, "lng", "lng", "lon", "longitude") or 0)
-        except ValueError:
-            errors.append(f"Row {i+2} ({mac}): invalid lat/lng")
-            continue
-        last_update = _parse_dt(_col(row, "last_update", "last_update", "lastupdate", "updated_at"))
-        battery_raw = _col(row, "battery_percent", "battery", "battery_percent", "batterypercent")
-        battery_percent = None
-        if battery_raw != "":
-            try:
-                battery_percent = int(float(battery_raw))
-            except ValueError:
-                pass
-        last_tracker_label = _col(row, "last_tracker_label", "tracker_label", "tracker", "last_tracker_label") or None
-        name = _col(row, "name", "beacon_name") or None
-        category = _col(row, "category") or None
-        ble_type = _col(row, "ble_type", "type") or "eye_beacon"
-        serial_number = _col(row, "serial_number", "sn", "serial") or None
+            yield (row_no,) + convert(row, cols)
+        except ValueError as e:
+            errors.append((row_no, str(_value(row, mac_col) or ""), str(e)))
 
-        try:
-            cursor.execute("SELECT id FROM BLE_Positions WHERE mac = ?", mac)
-            if cursor.fetchone():
-                cursor.execute("""
-                    UPDATE BLE_Positions
-                    SET lat = ?, lng = ?, last_update = COALESCE(?, last_update), battery_percent = COALESCE(?, battery_percent),
-                        last_tracker_label = COALESCE(?, last_tracker_label), name = COALESCE(?, name),
-                        category = COALESCE(?, category), ble_type = COALESCE(?, ble_type), serial_number = COALESCE(?, serial_number)
-                    WHERE mac = ?
-                """, lat, lng, last_update, battery_percent, last_tracker_label, name, category, ble_type, serial_number, mac)
-                updated += 1
-            else:
-                cursor.execute("""
-                    INSERT INTO BLE_Positions (mac, lat, lng, last_update, battery_percent, last_tracker_label, name, category, ble_type, serial_number)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, mac, lat, lng, last_update, battery_percent, last_tracker_label, name, category, ble_type, serial_number)
-                inserted += 1
-        except Exception as e:
-            errors.append(f"Row {i+2} ({mac}): {e}")
-
-    if errors:
-        for e in errors:
-            print(f"  Error: {e}")
-    conn.commit()
-    print(f"Done: {inserted} inserted, {updated} updated.")
-    if inserted or updated:
+
+# ── load ────────────────────────────────────────────────────────────────────
+
+def import_rows(rows: Iterator[tuple], spec: Dict[str, Any]) -> Dict[str, int]:
+    """Stage rows in #ble_import, MERGE once, commit once. Returns staged / inserted / updated counts."""
+    conn = db_helper.get_connection()
+    cursor = conn.cursor()
+    cursor.fast_executemany = True
+    placeholders = ", ".join("?" * (len(spec["columns"]) + 1))
+    insert_sql = f"INSERT INTO #ble_import (row_no, {', '.join(spec['columns'])}) VALUES ({placeholders})"
+    try:
+        cursor.execute("IF OBJECT_ID('tempdb..#ble_import') IS NOT NULL DROP TABLE #ble_import")
+        cursor.execute(spec["staging"])
+        staged = 0
+        batch: List[tuple] = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= BATCH_ROWS:
+                cursor.executemany(insert_sql, batch)
+                staged += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(insert_sql, batch)
+            staged += len(batch)
+
+        inserted = updated = 0
+        if staged:
+            cursor.execute(spec["merge"])
+            for (action,) in cursor.fetchall():
+                if action == "INSERT":
+                    inserted += 1
+                elif action == "UPDATE":
+                    updated += 1
+        cursor.execute("DROP TABLE #ble_import")
+        conn.commit()
+        return {"staged": staged, "inserted": inserted, "updated": updated}
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _report_errors(errors: List[Tuple[int, str, str]], errors_path: Optional[str]) -> None:
+    for row_no, mac, message in errors[:MAX_ERRORS_SHOWN]:
+        print(f"  Error: Row {row_no}" + (f" ({mac})" if mac else "") + f": {message}")
+    if len(errors) > MAX_ERRORS_SHOWN:
+        print(f"  ... {len(errors) - MAX_ERRORS_SHOWN} more" + ("" if errors_path else " (use --errors to save all)"))
+    if errors_path:
+        with open(errors_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(("row", "mac", "error"))
+            writer.writerows(errors)
+        print(f"  {len(errors)} row error(s) written to {errors_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-import BLE positions or definitions from CSV / Parquet.")
+    parser.add_argument("path", help="CSV or Parquet (.parquet) file")
+    parser.add_argument("--table", choices=sorted(TABLES), default="positions", help="target table (default: positions)")
+    parser.add_argument("--errors", metavar="PATH", help="write every rejected row to this CSV")
+    parser.add_argument("--dry-run", action="store_true", help="validate only, do not touch the database")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.path):
+        print(f"File not found: {args.path}")
+        return 1
+    spec = TABLES[args.table]
+
+    source = open_source(args.path)
+    try:
+        cols = resolve_header(next(source, []), spec["required"])
+    except ValueError as e:
+        print(f"{args.path}: {e}")
+        return 1
+
+    errors: List[Tuple[int, str, str]] = []
+    rows = parse_rows(source, spec, cols, errors)
+    t0 = time.perf_counter()
+
+    if args.dry_run:
+        valid = sum(1 for _ in rows)
+        _report_errors(errors, args.errors)
+        print(f"Dry run: {valid} valid row(s), {len(errors)} rejected ({time.perf_counter() - t0:.1f}s).")
+        return 0 if not errors else 1
+
+    try:
+        result = import_rows(rows, spec)
+    except Exception as e:
+        print(f"[DB ERROR] import into {spec['target']}: {e}")
+        return 2
+    _report_errors(errors, args.errors)
+    elapsed = time.perf_counter() - t0
+    print(
+        f"Done: {result['inserted']} inserted, {result['updated']} updated in {spec['target']} "
+        f"({result['staged']} row(s) staged, {len(errors)} rejected, {elapsed:.1f}s)."
+    )
+
+    if args.table == "definitions" and (result["inserted"] or result["updated"]):
+        db_helper.invalidate_ble_definitions_cache()
+        if db_helper.bump_ble_definitions_version():
+            print("Definitions version bumped; running brokers and the API server reload them shortly.")
+    elif result["inserted"] or result["updated"]:
         print("Restart the broker so it loads this data from SQL.")
     return 0 if not errors else 1
 
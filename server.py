@@ -5,19 +5,27 @@ Provides /data endpoint for the static map UI.
 Now with SQL Server integration for BLE position persistence.
 """
 
+import atexit
 import os
+import threading
 import time
 from datetime import datetime, timezone, timedelta
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import requests
-from flask import Flask, jsonify, send_from_directory, request
+from flask import Flask, Response, g, jsonify, send_from_directory, request
 
-# Import database helper
+import metrics
+from fast_json import FastJSONProvider, FragmentCache
+from metrics import REGISTRY, SIZE_BUCKETS
+from navixy_scheduler import NavixyScheduler, RATE_LIMIT_ERROR_CODES, RATE_LIMIT_HTTP_STATUS
+from profiler import register_debug_routes
+
+# Import database helper (pyodbc is imported on first connect, not here)
 try:
     import db_helper
-    DB_ENABLED = True
-    print("[DB] SQL Server integration enabled")
+    DB_ENABLED = db_helper.driver_available()
+    print("[DB] SQL Server integration enabled" if DB_ENABLED else "[DB] SQL Server integration disabled: pyodbc not installed")
 except Exception as e:
     DB_ENABLED = False
     print(f"[DB] SQL Server integration disabled: {e}")
@@ -48,7 +56,51 @@ PAIRING_CONFIRM_SEC = 60    # need 60 s continuous detection to trust position
 DROP_CONFIRM_SEC    = 10    # tracker stopped 10 s → beacon dropped here
 DB_WRITE_INTERVAL   = 120   # throttle DB writes to at most once every 2 min
 
+# ── Navixy API budget ────────────────────────────────────────────────────────
+# Token-bucket scheduler decides which calls each /data poll may spend; skipped
+# calls are answered from the last successful response for that tracker.
+_scheduler = NavixyScheduler()
+_navixy_cache: Dict[Tuple[str, Any], Dict[str, Any]] = {}
+
+# ── Coalesced BLE heartbeats ─────────────────────────────────────────────────
+# Latest battery / RSSI / last_seen per mac, flushed to SQL as one batch every
+# HEARTBEAT_FLUSH_SEC by a background thread (and once more at exit). A beacon
+# is only queued when its Navixy last_seen has advanced, so write volume
+# follows real detections, not map viewers. A failed batch is re-queued.
+HEARTBEAT_FLUSH_SEC = 30
+_heartbeat_lock = threading.Lock()
+_heartbeat_pending: Dict[str, Dict[str, Any]] = {}
+_heartbeat_last_seen: Dict[str, str] = {}
+_heartbeat_last_flush = 0.0
+_heartbeat_flusher: Optional[threading.Thread] = None
+
+# ── Metrics (/metrics, Prometheus text format) ───────────────────────────────
+_NAVIXY_SECONDS = REGISTRY.histogram("navixy_api_duration_seconds", "Navixy API call latency", labels=("endpoint",))
+_NAVIXY_ERRORS = REGISTRY.counter("navixy_api_errors_total", "Navixy API calls that failed or were rate limited", labels=("endpoint",))
+_HTTP_SECONDS = REGISTRY.histogram("http_request_duration_seconds", "HTTP response build time", labels=("endpoint",))
+_HTTP_BYTES = REGISTRY.histogram("http_response_bytes", "HTTP response payload size", labels=("endpoint",), buckets=SIZE_BUCKETS)
+
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
+
+# Serialized /data rows per tracker_id, reused while the row is unchanged
+_row_fragments = FragmentCache()
+
+
+@app.before_request
+def _start_request_timer() -> None:
+    g.request_t0 = time.perf_counter()
+
+
+@app.after_request
+def _observe_request(response):  # type: ignore[override]
+    t0 = g.get("request_t0")
+    if t0 is not None and request.endpoint:
+        _HTTP_SECONDS.labels(request.endpoint).observe(time.perf_counter() - t0)
+        size = response.calculate_content_length()
+        if size is not None:
+            _HTTP_BYTES.labels(request.endpoint).observe(size)
+    return response
 
 
 @app.after_request
@@ -63,9 +115,66 @@ def _api_call(endpoint: str, payload: Dict[str, Any]) -> Dict[str, Any]:
     url = f"{API_BASE_URL}/{endpoint}"
     data = dict(payload)
     data["hash"] = API_HASH
-    response = requests.post(url, data=data, timeout=POLL_TIMEOUT_SECONDS)
+    t0 = time.perf_counter()
+    try:
+        response = requests.post(url, data=data, timeout=POLL_TIMEOUT_SECONDS)
+    except Exception:
+        _NAVIXY_ERRORS.labels(endpoint).inc()
+        raise
+    finally:
+        _NAVIXY_SECONDS.labels(endpoint).observe(time.perf_counter() - t0)
+    if response.status_code == RATE_LIMIT_HTTP_STATUS:
+        return _rate_limited(endpoint, response.headers.get("Retry-After"))
     response.raise_for_status()
-    return response.json()
+    body = response.json()
+    if body.get("success"):
+        _scheduler.record_success(endpoint)
+    elif _safe_get(body, "status", "code") in RATE_LIMIT_ERROR_CODES:
+        return _rate_limited(endpoint, None, body)
+    return body
+
+
+def _rate_limited(endpoint: str, retry_after: Any, body: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    try:
+        retry_sec = float(retry_after) if retry_after else None
+    except (TypeError, ValueError):
+        retry_sec = None
+    _NAVIXY_ERRORS.labels(endpoint).inc()
+    delay = _scheduler.record_rate_limited(endpoint, retry_sec)
+    print(f"[NAVIXY] {endpoint} rate limited - backing off {delay:.0f}s")
+    return body or {"success": False, "status": {"code": 15, "description": "Too many requests (rate limit exceeded)"}}
+
+
+def _scheduled_call(
+    endpoint: str,
+    payload: Dict[str, Any],
+    key: Any = None,
+    movement_status: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Budget-aware Navixy call.
+
+    Returns the cached response while it is still fresh for this tracker's
+    movement_status, or when the endpoint is out of tokens / backing off.
+    Returns None only when there is neither budget nor a cached response.
+    """
+    cache_key = (endpoint, key)
+    cached = _navixy_cache.get(cache_key)
+    if cached is not None and not _scheduler.is_due(endpoint, key, movement_status):
+        _scheduler.mark_skipped(endpoint)
+        return cached
+    if not _scheduler.acquire(endpoint):
+        return cached
+    resp = _api_call(endpoint, payload)
+    if resp.get("success"):
+        _navixy_cache[cache_key] = resp
+        _scheduler.mark_polled(endpoint, key)
+        return resp
+    return cached if cached is not None else resp
+
+
+def _cached_movement_status(tracker_id: Any) -> Optional[str]:
+    return _safe_get(_navixy_cache.get(("tracker/get_state", tracker_id)), "state", "movement_status")
 
 
 def _safe_get(state: Dict[str, Any], *keys: str) -> Any:
@@ -465,6 +574,82 @@ def _track_beacon_position(
         print(f"[BLE-TRACK] DB error for {mac}: {e}")
 
 
+def _queue_heartbeat(mac: str, beacon: Dict[str, Any], tracker_id: Any, tracker_label: str) -> None:
+    """Remember the newest heartbeat for mac; ignored if Navixy last_seen hasn't moved."""
+    last_seen = beacon.get("last_seen")
+    if not last_seen:
+        return
+    last_seen = str(last_seen)
+    _start_heartbeat_flusher()
+    with _heartbeat_lock:
+        if _heartbeat_last_seen.get(mac) == last_seen:
+            return
+        _heartbeat_last_seen[mac] = last_seen
+        prev = _heartbeat_pending.get(mac, {})
+        _heartbeat_pending[mac] = {
+            "mac":              mac,
+            "battery_percent":  beacon.get("battery") if beacon.get("battery") is not None else prev.get("battery_percent"),
+            "rssi":             beacon.get("rssi") if beacon.get("rssi") is not None else prev.get("rssi"),
+            "last_seen_navixy": last_seen,
+            "tracker_id":       tracker_id,
+            "tracker_label":    tracker_label,
+        }
+
+
+def _flush_heartbeats(force: bool = False) -> int:
+    """Write pending heartbeats as one batch, at most once per HEARTBEAT_FLUSH_SEC."""
+    global _heartbeat_last_flush
+    with _heartbeat_lock:
+        now = time.monotonic()
+        if not _heartbeat_pending or (not force and now - _heartbeat_last_flush < HEARTBEAT_FLUSH_SEC):
+            return 0
+        batch = list(_heartbeat_pending.values())
+        _heartbeat_pending.clear()
+        _heartbeat_last_flush = now
+    written = db_helper.update_ble_heartbeats(batch)
+    if written:
+        print(f"[BLE-HB] Flushed {written} heartbeat(s)")
+    else:
+        _requeue_heartbeats(batch)
+        print(f"[BLE-HB] Flush failed, re-queued {len(batch)} heartbeat(s)")
+    return written
+
+
+def _requeue_heartbeats(batch: List[Dict[str, Any]]) -> None:
+    """Put a failed batch back; entries queued since (newer last_seen) win, missing battery/rssi are filled in."""
+    with _heartbeat_lock:
+        for item in batch:
+            newer = _heartbeat_pending.get(item["mac"])
+            if newer is None:
+                _heartbeat_pending[item["mac"]] = item
+                continue
+            for key in ("battery_percent", "rssi"):
+                if newer.get(key) is None:
+                    newer[key] = item.get(key)
+
+
+def _heartbeat_flush_loop() -> None:
+    while True:
+        time.sleep(HEARTBEAT_FLUSH_SEC)
+        try:
+            _flush_heartbeats(force=True)
+        except Exception as e:
+            print(f"[BLE-HB] Flush error: {e}")
+
+
+def _start_heartbeat_flusher() -> None:
+    """Start the background flusher once (on the first queued heartbeat) and flush at exit."""
+    global _heartbeat_flusher
+    if _heartbeat_flusher is not None:
+        return
+    with _heartbeat_lock:
+        if _heartbeat_flusher is not None:
+            return
+        _heartbeat_flusher = threading.Thread(target=_heartbeat_flush_loop, daemon=True, name="heartbeat-flush")
+        _heartbeat_flusher.start()
+    atexit.register(_flush_heartbeats, True)
+
+
 @app.get("/")
 def index() -> Any:
     """Serve the main map page"""
@@ -484,6 +669,30 @@ def health() -> Any:
     return jsonify({"status": "ok", "db_enabled": DB_ENABLED})
 
 
+def _pending_heartbeats() -> int:
+    with _heartbeat_lock:
+        return len(_heartbeat_pending)
+
+
+REGISTRY.gauge_callback("db_write_queue_depth", "Items waiting for a background SQL writer",
+                        lambda: {"heartbeats": _pending_heartbeats()}, label="writer")
+
+
+@app.get("/metrics")
+def prometheus_metrics() -> Any:
+    return Response(REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+# /debug/profile, /debug/threads, /debug/cprofile (only with DEBUG_ENDPOINTS=1)
+register_debug_routes(app)
+
+
+@app.get("/navixy/budget")
+def navixy_budget() -> Any:
+    """Current Navixy API budget: tokens left, back-off and poll plan"""
+    return jsonify({"success": True, "budget": _scheduler.budget()})
+
+
 @app.get("/ble/positions")
 def ble_positions() -> Any:
     """Get all BLE positions from database"""
@@ -504,12 +713,27 @@ def ble_definitions_endpoint() -> Any:
         return jsonify({"success": False, "error": "Database not available", "definitions": {}})
 
     try:
-        definitions = db_helper.get_ble_definitions()
+        definitions = db_helper.get_ble_definitions_cached()
         return jsonify({"success": True, "definitions": definitions, "count": len(definitions)})
     except Exception as e:
         return jsonify({"success": False, "error": str(e), "definitions": {}})
 
 
+@app.route("/ble/definitions/reload", methods=["POST", "OPTIONS"])
+def ble_definitions_reload() -> Any:
+    """Drop cached BLE definitions and bump the shared change stamp (broker reloads too)"""
+    if request.method == "OPTIONS":
+        return "", 200
+
+    if not DB_ENABLED:
+        return jsonify({"success": False, "error": "Database not available"})
+
+    db_helper.invalidate_ble_definitions_cache()
+    bumped = db_helper.bump_ble_definitions_version()
+    definitions = db_helper.get_ble_definitions_cached()
+    return jsonify({"success": bumped, "count": len(definitions)})
+
+
 @app.route("/ble/position", methods=["POST", "OPTIONS"])
 def update_ble_position() -> Any:
     """Update BLE position (called by client when pairing confirmed)"""
@@ -577,17 +801,19 @@ def data() -> Any:
     if not API_HASH:
         return jsonify({"success": False, "error": "NAVIXY_API_HASH is not set", "rows": []}), 500
 
-    trackers_resp = _api_call("tracker/list", {})
+    trackers_resp = _scheduled_call("tracker/list", {})
+    if trackers_resp is None:
+        return jsonify({"success": False, "error": "Navixy API budget exhausted", "rows": []}), 503
     if not trackers_resp.get("success"):
         return jsonify(
             {"success": False, "error": trackers_resp.get("status", {}).get("description"), "rows": []}
         ), 502
 
-    # Load BLE definitions from database (once per /data call)
+    # BLE definitions (cached; reloaded only when the System_Config stamp moves)
     ble_defs: Dict[str, Any] = {}
     if DB_ENABLED:
         try:
-            ble_defs = db_helper.get_ble_definitions()
+            ble_defs = db_helper.get_ble_definitions_cached()
         except Exception:
             pass
 
@@ -606,11 +832,17 @@ def data() -> Any:
         tracker_id = tracker.get("id")
         if not tracker_id:
             continue
-        state_resp = _api_call("tracker/get_state", {"tracker_id": tracker_id})
-        if not state_resp.get("success"):
+        state_resp = _scheduled_call(
+            "tracker/get_state", {"tracker_id": tracker_id},
+            key=tracker_id, movement_status=_cached_movement_status(tracker_id),
+        )
+        if not state_resp or not state_resp.get("success"):
             continue
-        readings_resp = _api_call("tracker/readings/list", {"tracker_id": tracker_id})
-        readings = readings_resp if readings_resp.get("success") else {}
+        readings_resp = _scheduled_call(
+            "tracker/readings/list", {"tracker_id": tracker_id},
+            key=tracker_id, movement_status=_safe_get(state_resp, "state", "movement_status"),
+        )
+        readings = readings_resp if readings_resp and readings_resp.get("success") else {}
         row = _build_row(tracker, state_resp.get("state", {}), readings)
 
         # Store tracker position in database
@@ -645,20 +877,10 @@ def data() -> Any:
                     "sn":         ble_defs[mac].get("sn"),
                 })
 
-            # Heartbeat: refresh last_update, battery, RSSI, last_seen on every detection
-            # (keeps popup "Last seen at" fresh even for non-paired beacons)
+            # Heartbeat: refresh last_update, battery, RSSI, last_seen on every new detection
+            # (keeps popup "Last seen at" fresh even for non-paired beacons; flushed in batches)
             if mac and DB_ENABLED:
-                try:
-                    db_helper.update_ble_heartbeat(
-                        mac=mac,
-                        battery_percent=beacon.get("battery"),
-                        rssi=beacon.get("rssi"),
-                        last_seen_navixy=beacon.get("last_seen"),
-                        tracker_id=tracker_id,
-                        tracker_label=tracker_lbl,
-                    )
-                except Exception:
-                    pass
+                _queue_heartbeat(mac, beacon, tracker_id, tracker_lbl)
 
             # Only track position for known beacons on a tracker with valid GPS
             if not (mac and mac in ble_defs and tracker_lat and tracker_lng):
@@ -677,7 +899,6 @@ def data() -> Any:
             )
 
         rows.append(row)
-        time.sleep(0.05)
 
     # Add stored BLE positions to response for persistence across page loads
     stored_ble_positions: Dict[str, Any] = {}
@@ -701,9 +922,10 @@ def data() -> Any:
                 if beacon.get("last_seen"):
                     pos["last_seen"] = beacon["last_seen"]
 
+    _row_fragments.retain(row.get("tracker_id") for row in rows)
     return jsonify({
         "success": True,
-        "rows": rows,
+        "rows": [_row_fragments.get(row.get("tracker_id"), row) for row in rows],
         "ble_positions": stored_ble_positions,
         "db_enabled": DB_ENABLED
     })
@@ -181,6 +181,23 @@ def create_schema():
         )
         """,
         
+        # Zone Events - Geofence enter/exit of trackers and BLE assets
+        """
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='Zone_Events' AND xtype='U')
+        CREATE TABLE Zone_Events (
+            id INT IDENTITY(1,1) PRIMARY KEY,
+            entity_type VARCHAR(20) NOT NULL,
+            entity_id VARCHAR(50) NOT NULL,
+            zone_id VARCHAR(100) NOT NULL,
+            zone_name VARCHAR(200),
+            zone_kind VARCHAR(50),
+            event_type VARCHAR(10) NOT NULL,
+            lat FLOAT,
+            lng FLOAT,
+            event_time DATETIME DEFAULT GETDATE()
+        )
+        """,
+        
         # System Config - Store configuration values
         """
         IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='System_Config' AND xtype='U')
@@ -245,6 +262,23 @@ def create_schema():
         except Exception as e:
             print(f"  [WARN] {key}: {e}")
     
+    # BLE definitions change stamp (db_helper.DEFS_VERSION_KEY): seed it, and
+    # repair a NULL / non-numeric value so the bump's +1 keeps working
+    try:
+        cursor.execute("""
+            MERGE System_Config AS target
+            USING (VALUES ('ble_definitions_version')) AS source (config_key)
+            ON target.config_key = source.config_key
+            WHEN MATCHED AND TRY_CAST(target.config_value AS BIGINT) IS NULL THEN UPDATE SET
+                config_value = '0', updated_at = GETDATE()
+            WHEN NOT MATCHED THEN INSERT (config_key, config_value, description)
+                VALUES (source.config_key, '0', 'Bumped whenever BLE_Definitions changes');
+        """)
+        conn.commit()
+        print("  [OK] ble_definitions_version")
+    except Exception as e:
+        print(f"  [WARN] ble_definitions_version: {e}")
+    
     # Create indexes for performance
     indexes = [
         "CREATE INDEX IF NOT EXISTS idx_ble_positions_mac ON BLE_Positions(mac)",
@@ -252,6 +286,8 @@ def create_schema():
         "CREATE INDEX IF NOT EXISTS idx_ble_movement_time ON BLE_Movement_Log(movement_time)",
         "CREATE INDEX IF NOT EXISTS idx_pairing_mac ON BLE_Pairing_History(mac)",
         "CREATE INDEX IF NOT EXISTS idx_pairing_tracker ON BLE_Pairing_History(tracker_id)",
+        "CREATE INDEX IF NOT EXISTS idx_zone_events_entity ON Zone_Events(entity_id)",
+        "CREATE INDEX IF NOT EXISTS idx_zone_events_time ON Zone_Events(event_time)",
     ]
     
     print("\nCreating indexes...")
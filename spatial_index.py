@@ -0,0 +1,126 @@
+"""
+Spatial Grid Index
+Uniform lat/lng grid over live positions so "what is near this point" and
+"what is in this viewport" don't scan every tracker and beacon.
+
+Cells are CELL_DEG on a side (~55 m N-S, ~47 m E-W at LLBG), about one
+stand / apron taxi lane, so a proximity query touches a handful of cells.
+Updates are incremental: update() moves a key between cells in O(1).
+"""
+
+import math
+import threading
+from typing import Container, Dict, Hashable, List, Optional, Set, Tuple
+
+from geo import EARTH_RADIUS_M, distances_from
+
+CELL_DEG = 0.0005
+
+Cell = Tuple[int, int]
+
+# Degrees of latitude per meter (constant on the sphere)
+_DEG_PER_M = 180.0 / (math.pi * EARTH_RADIUS_M)
+
+
+class GridIndex:
+    """
+    Thread-safe uniform grid of point keys (MACs, IMEIs, ...).
+
+    The internal lock is a leaf lock: callers may hold their own state locks
+    while calling update()/remove(), but nothing is acquired underneath it.
+    """
+
+    def __init__(self, cell_deg: float = CELL_DEG):
+        self.cell_deg = cell_deg
+        self._lock = threading.Lock()
+        self._points: Dict[Hashable, Tuple[float, float, Cell]] = {}
+        self._cells: Dict[Cell, Set[Hashable]] = {}
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def cell_of(self, lat: float, lng: float) -> Cell:
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def update(self, key: Hashable, lat: Optional[float], lng: Optional[float]) -> None:
+        """Set key's position; a missing coordinate removes it from the index"""
+        if lat is None or lng is None:
+            self.remove(key)
+            return
+        cell = self.cell_of(lat, lng)
+        with self._lock:
+            old = self._points.get(key)
+            if old is not None and old[2] != cell:
+                self._discard_from_cell(key, old[2])
+            self._points[key] = (lat, lng, cell)
+            if old is None or old[2] != cell:
+                self._cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key: Hashable) -> None:
+        with self._lock:
+            old = self._points.pop(key, None)
+            if old is not None:
+                self._discard_from_cell(key, old[2])
+
+    def _discard_from_cell(self, key: Hashable, cell: Cell) -> None:
+        keys = self._cells.get(cell)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._cells[cell]
+
+    def _candidates(self, min_lat: float, min_lng: float, max_lat: float, max_lng: float) -> List[Tuple[Hashable, float, float]]:
+        """(key, lat, lng) for every key in a cell overlapping the box (caller filters exactly)"""
+        r0, c0 = self.cell_of(min_lat, min_lng)
+        r1, c1 = self.cell_of(max_lat, max_lng)
+        out = []
+        with self._lock:
+            # A viewport wider than the populated area: walk occupied cells instead
+            if (r1 - r0 + 1) * (c1 - c0 + 1) > len(self._cells):
+                cells = [c for c in self._cells if r0 <= c[0] <= r1 and c0 <= c[1] <= c1]
+            else:
+                cells = [(r, c) for r in range(r0, r1 + 1) for c in range(c0, c1 + 1) if (r, c) in self._cells]
+            for cell in cells:
+                for key in self._cells[cell]:
+                    lat, lng, _ = self._points[key]
+                    out.append((key, lat, lng))
+        return out
+
+    def bbox(self, min_lng: float, min_lat: float, max_lng: float, max_lat: float) -> List[Tuple[Hashable, float, float]]:
+        """(key, lat, lng) of every point inside the box (GeoJSON order: minLng,minLat,maxLng,maxLat)"""
+        return [
+            (key, lat, lng)
+            for key, lat, lng in self._candidates(min_lat, min_lng, max_lat, max_lng)
+            if min_lat <= lat <= max_lat and min_lng <= lng <= max_lng
+        ]
+
+    def nearby(self, lat: float, lng: float, radius_m: float) -> List[Tuple[Hashable, float]]:
+        """(key, distance_m) of every point within radius_m of (lat, lng), nearest first"""
+        dlat = radius_m * _DEG_PER_M
+        dlng = dlat / max(math.cos(math.radians(lat)), 1e-6)
+        cands = self._candidates(lat - dlat, lng - dlng, lat + dlat, lng + dlng)
+        if not cands:
+            return []
+        dists = distances_from(lat, lng, [c[1] for c in cands], [c[2] for c in cands])
+        hits = [(c[0], d) for c, d in zip(cands, dists) if d <= radius_m]
+        hits.sort(key=lambda h: h[1])
+        return hits
+
+    def aggregate(self, min_lng: float, min_lat: float, max_lng: float, max_lat: float, cell_deg: float,
+                  only: Optional[Container] = None) -> List[Dict[str, float]]:
+        """
+        Point counts per cell_deg cell inside the box: [{lat, lng (centroid), count}, ...].
+        only, if given, limits the count to keys it contains.
+        """
+        buckets: Dict[Cell, List[float]] = {}
+        for key, lat, lng in self.bbox(min_lng, min_lat, max_lng, max_lat):
+            if only is not None and key not in only:
+                continue
+            acc = buckets.setdefault((math.floor(lat / cell_deg), math.floor(lng / cell_deg)), [0.0, 0.0, 0])
+            acc[0] += lat
+            acc[1] += lng
+            acc[2] += 1
+        return [
+            {"lat": slat / n, "lng": slng / n, "count": n}
+            for slat, slng, n in buckets.values()
+        ]
@@ -0,0 +1,89 @@
+"""
+Broker State Checkpoint
+Compact on-disk copy of the broker's in-memory state, so a restart resumes
+pairing timers and heartbeat throttles instead of rebuilding from SQL.
+
+File format: zlib-compressed JSON
+    {"version": 1, "written_at": <unix s>, "sections": {name: section}}
+Record sections store the field names once and one value list per key:
+    {"fields": ["lat", "lng", ...], "rows": {key: [v1, v2, ...]}}
+Monotonic timestamps are converted to unix seconds on the way out and back
+on the way in (monotonic time restarts with the process).
+
+Writes are atomic: a temp file in the same directory, fsync, os.replace().
+"""
+
+import json
+import os
+import tempfile
+import time
+import zlib
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from broker_state import epoch_to_mono, mono_to_epoch
+
+CHECKPOINT_VERSION = 1
+
+
+def pack_records(records: Dict[str, Any], fields: Iterable[str], time_fields: Iterable[str] = ()) -> Dict[str, Any]:
+    """Section for a {key: __slots__ record} dict"""
+    fields = list(fields)
+    times = set(time_fields)
+    rows = {}
+    for key, rec in records.items():
+        rows[key] = [
+            mono_to_epoch(getattr(rec, f)) if f in times else getattr(rec, f)
+            for f in fields
+        ]
+    return {"fields": fields, "rows": rows}
+
+
+def unpack_records(section: Dict[str, Any], make: Callable[[str], Any], time_fields: Iterable[str] = ()) -> Dict[str, Any]:
+    """Rebuild records: make(key) creates a default record, then stored fields are set
+    (fields the record no longer has are skipped, new ones keep their defaults)"""
+    fields = section.get("fields", [])
+    times = set(time_fields)
+    out = {}
+    for key, values in section.get("rows", {}).items():
+        rec = make(key)
+        for f, v in zip(fields, values):
+            if not hasattr(rec, f):
+                continue
+            setattr(rec, f, epoch_to_mono(v) if f in times else v)
+        out[key] = rec
+    return out
+
+
+def write(path: str, sections: Dict[str, Any]) -> int:
+    """Atomically replace the checkpoint at path; returns the file size"""
+    payload = {"version": CHECKPOINT_VERSION, "written_at": time.time(), "sections": sections}
+    data = zlib.compress(json.dumps(payload, separators=(",", ":"), default=str).encode("utf-8"), 1)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".ckpt-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return len(data)
+
+
+def read(path: str, max_age_sec: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """Sections of the checkpoint at path; None if missing, unreadable, other version or too old"""
+    try:
+        with open(path, "rb") as f:
+            payload = json.loads(zlib.decompress(f.read()))
+    except (OSError, ValueError, zlib.error):
+        return None
+    if not isinstance(payload, dict) or payload.get("version") != CHECKPOINT_VERSION:
+        return None
+    if max_age_sec is not None and time.time() - payload.get("written_at", 0) > max_age_sec:
+        return None
+    return payload.get("sections") or {}
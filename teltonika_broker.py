@@ -10,33 +10,71 @@ Ports:
 - HTTP 8768: API endpoint for map (/data)
 """
 
+import atexit
+import itertools
+import multiprocessing
+import os
 import socket
 import struct
 import threading
 import time
 import json
-from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Any, Optional, Set
 from collections import defaultdict
-from flask import Flask, jsonify
+from flask import Flask, Response, g, jsonify, request
 import logging
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    datefmt='%H:%M:%S'
+from broker_state import (
+    BleState, EventClock, LockStripes, PairingState, StateSnapshot, TrackerState,
+    epoch_to_mono, mono_now, mono_to_datetime, mono_to_epoch, utc_to_mono, wall_to_mono,
 )
-logger = logging.getLogger(__name__)
-
-# Import database helper
+from batch_writer import BatchWriter
+from ble_registry import BleDefinitions, DefinitionsRegistry, normalize_mac
+import broker_log
+from broker_log import Sampler, get_logger
+from fast_json import FastJSONProvider, FragmentCache
+from geo import distance_m, distances_from
+from geofence import GeofenceIndex, ZoneTracker, load_zones
+import metrics
+from metrics import REGISTRY, SIZE_BUCKETS, TimedLock, timed
+from multilateration import MultilaterationEngine
+from profiler import register_debug_routes
+from rssi_filter import RssiFilterBank, estimate_distance_m
+from spatial_index import GridIndex
+import state_checkpoint
+from state_checkpoint import pack_records, unpack_records
+
+# Configure logging: category loggers behind a background queue writer.
+# Per-packet / per-beacon detail is DEBUG; the busiest messages are also
+# sampled per IMEI (see broker_log).
+broker_log.configure()
+logger = get_logger("main")
+log_tcp = get_logger("tcp")
+log_codec = get_logger("codec")
+log_match = get_logger("match")
+log_ble = get_logger("ble")
+log_db = get_logger("db")
+log_zone = get_logger("zone")
+log_rutx11 = get_logger("rutx11")
+log_worker = get_logger("worker")
+_tcp_sampler = Sampler()
+_mac_sampler = Sampler()
+
+# Import database helper (pyodbc itself is only imported on first connect,
+# which happens in the background after the listeners are up)
 try:
     import db_helper
-    DB_ENABLED = True
-    logger.info("[DB] SQL Server integration enabled")
+    DB_ENABLED = db_helper.driver_available()
+    if DB_ENABLED:
+        log_db.info("[DB] SQL Server integration enabled")
+    else:
+        log_db.warning("[DB] SQL Server disabled: pyodbc not installed")
 except Exception as e:
     DB_ENABLED = False
-    logger.warning(f"[DB] SQL Server disabled: {e}")
+    log_db.warning("[DB] SQL Server disabled: %s", e)
 
 # ============================================================
 # CONFIGURATION
@@ -53,27 +91,173 @@ SIGNIFICANT_MOVE_M = 100        # Movement > 100m after gap = confirmed new plac
 MAX_SPEED_KMH = 5               # Only update position when speed < 5 km/h (stopped/slow)
 DB_HEARTBEAT_SYNC_SEC = 20      # Persist last-known BLE position heartbeat to SQL
 
+# Geofences: polygon features of these GeoJSON files (see geofence.py)
+GEOFENCE_FILES = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "llbg_layers.geojson"),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "geofences.geojson"),
+]
+ZONE_EVENT_FLUSH_SEC = 5        # Batch zone enter/exit events to SQL
+
+# Event time: the pairing clock runs on AVL record timestamps, not arrival time
+REORDER_MAX_LATENESS_SEC = 120  # Records older than watermark - this skip the state machine
+EVENT_TIME_MAX_AGE_SEC = 7 * 86400  # Older record timestamps = no RTC fix, use arrival time
+
 # STABILITY MODE: Only update position on VERY clear towing events
 STABILITY_MODE = True
 
+# ============================================================
+# METRICS (/metrics, Prometheus text format)
+# ============================================================
+# Created once here; hot paths only touch pre-resolved children (see metrics.py).
+# In multi-worker mode each process counts its own traffic; /metrics on the
+# HTTP port reports the front process.
+PACKETS = REGISTRY.counter("teltonika_packets_total", "CODEC8 packets received")
+PACKETS_FAILED = REGISTRY.counter("teltonika_packets_failed_total", "CODEC8 packets that failed to parse")
+RECORDS = REGISTRY.counter("teltonika_records_total", "AVL records parsed")
+_BEACONS = REGISTRY.counter("teltonika_beacon_detections_total", "Known-beacon detections processed", labels=("source",))
+BEACONS_TCP = _BEACONS.labels("tcp")
+BEACONS_RUTX11 = _BEACONS.labels("rutx11")
+PARSE_SECONDS = REGISTRY.histogram("teltonika_parse_seconds", "CODEC8 packet parse latency")
+PROCESS_BEACONS_SECONDS = REGISTRY.histogram("teltonika_process_beacons_seconds", "process_beacon_records latency per call")
+TCP_CONNECTIONS = REGISTRY.gauge("teltonika_tcp_connections", "Open device TCP connections")
+_LOCK_WAIT = REGISTRY.histogram("broker_lock_wait_seconds", "Time spent waiting for a state lock", labels=("lock",))
+_LOCK_HOLD = REGISTRY.histogram("broker_lock_hold_seconds", "Time a state lock was held", labels=("lock",))
+HTTP_SECONDS = REGISTRY.histogram("http_request_duration_seconds", "HTTP response build time", labels=("endpoint",))
+HTTP_BYTES = REGISTRY.histogram("http_response_bytes", "HTTP response payload size", labels=("endpoint",), buckets=SIZE_BUCKETS)
+
+
+def _timed_locks(name: str):
+    """Lock factory for LockStripes: every stripe reports into the same wait/hold histograms"""
+    wait, hold = _LOCK_WAIT.labels(name), _LOCK_HOLD.labels(name)
+    return lambda: TimedLock(wait, hold)
+
 # ============================================================
 # DATA STORAGE (In-memory + SQL Server)
 # ============================================================
-# Tracker data: { imei: { lat, lng, speed, timestamp, beacons: [...] } }
-trackers: Dict[str, Dict[str, Any]] = {}
+# Records are __slots__ classes from broker_state; all times are monotonic floats.
+# Tracker data: { imei: TrackerState }
+trackers: Dict[str, TrackerState] = {}
+
+# BLE positions: { mac: BleState }
+ble_positions: Dict[str, BleState] = {}
+
+# BLE pairing tracking: { mac: PairingState }
+ble_pairing: Dict[str, PairingState] = {}
+
+# Smoothed RSSI per (mac, receiver) link; BleState carries the latest link's value
+rssi_filters = RssiFilterBank()
+
+# Per-tracker event-time watermark, guarded by tracker_locks
+tracker_clocks: Dict[str, EventClock] = {}
+
+# Last SQL heartbeat sync per beacon, monotonic (throttle DB writes while stationary)
+ble_db_last_sync: Dict[str, float] = {}
+
+# Reverse index: { tracker_imei: {mac, ...} } of beacons currently attributed to
+# each tracker. Mirrors ble_positions[mac].tracker_imei; maintained by
+# _index_ble_tracker() wherever that field changes (caller holds the MAC stripe).
+# _index_lock is a leaf lock: never acquire another lock while holding it.
+tracker_beacons: Dict[str, Set[str]] = {}
+_ble_tracker_of: Dict[str, str] = {}
+_index_lock = threading.Lock()
+
+
+def _index_ble_tracker(mac: str, imei: Optional[str]) -> None:
+    """Move mac to imei's beacon set in tracker_beacons"""
+    with _index_lock:
+        old = _ble_tracker_of.get(mac)
+        if old == imei:
+            return
+        if old is not None:
+            macs = tracker_beacons.get(old)
+            if macs is not None:
+                macs.discard(mac)
+                if not macs:
+                    del tracker_beacons[old]
+        if imei is None:
+            _ble_tracker_of.pop(mac, None)
+            return
+        _ble_tracker_of[mac] = imei
+        tracker_beacons.setdefault(imei, set()).add(mac)
+
+
+# Spatial grid indexes over current positions (ble_positions[mac].lat/lng and
+# trackers[imei].lat/lng). Updated next to every position write; leaf locks.
+ble_grid = GridIndex()
+tracker_grid = GridIndex()
+
+# Geofence zones (immutable index, swapped whole on load) and the current zone of
+# every "tracker:<imei>" / "ble:<mac>"; transitions queue up for the SQL writer.
+geofences = GeofenceIndex()
+zone_tracker = ZoneTracker()
+_zone_events: List[Dict[str, Any]] = []
+_zone_events_lock = threading.Lock()
+
+
+def _tag_zone(entity_type: str, key: str, lat: Optional[float], lng: Optional[float],
+              event_time: Optional[float] = None, emit: bool = True) -> Optional[str]:
+    """
+    Zone at (lat, lng) for an entity; queues enter/exit events on change,
+    stamped with event_time (monotonic; arrival time if None). emit=False only
+    records the zone (state loaded from a checkpoint / SQL, not a movement).
+    """
+    zone = geofences.zone_at(lat, lng)
+    zone_id = zone.zone_id if zone else None
+    if not emit:
+        zone_tracker.seed(f"{entity_type}:{key}", zone_id)
+        return zone_id
+    exited, entered = zone_tracker.update(f"{entity_type}:{key}", zone_id)
+    if exited is None and entered is None:
+        return zone_id
+    now = mono_to_datetime(event_time) if event_time is not None else datetime.now()
+    events = []
+    for event_type, zid in (("exit", exited), ("enter", entered)):
+        if zid is None:
+            continue
+        z = geofences.zones.get(zid)
+        log_zone.info("[ZONE] %s %s %s %s", entity_type, key, event_type.upper(), z.name if z else zid)
+        events.append({
+            "entity_type": entity_type, "entity_id": key, "zone_id": zid,
+            "zone_name": z.name if z else None, "zone_kind": z.kind if z else None,
+            "event_type": event_type, "lat": lat, "lng": lng, "event_time": now,
+        })
+    if DB_ENABLED:
+        with _zone_events_lock:
+            _zone_events.extend(events)
+    return zone_id
+
 
-# BLE positions: { mac: { lat, lng, tracker_imei, last_update, is_paired } }
-ble_positions: Dict[str, Dict[str, Any]] = {}
+def _index_ble_position(mac: str, emit: bool = True) -> None:
+    """Sync ble_grid and the zone tag with ble_positions[mac] (caller holds its stripe)"""
+    pos = ble_positions[mac]
+    ble_grid.update(mac, pos.lat, pos.lng)
+    pos.zone = _tag_zone("ble", mac, pos.lat, pos.lng, pos.last_seen, emit)
 
-# BLE pairing tracking: { mac: { tracker_imei, start_time } }
-ble_pairing: Dict[str, Dict[str, Any]] = {}
 
-# Last SQL heartbeat sync per beacon (throttle DB writes while stationary)
-ble_db_last_sync: Dict[str, datetime] = {}
+def zone_event_writer():
+    """Background thread: flush queued zone events to SQL in batches"""
+    while True:
+        time.sleep(ZONE_EVENT_FLUSH_SEC)
+        with _zone_events_lock:
+            if not _zone_events:
+                continue
+            batch = _zone_events[:]
+            _zone_events.clear()
+        written = db_helper.log_zone_events(batch)
+        log_zone.debug("[ZONE] Wrote %d/%d zone events", written, len(batch))
+
+
+def beacons_for_tracker(imei: str) -> List[str]:
+    """MACs currently attributed to a tracker, sorted"""
+    with _index_lock:
+        return sorted(tracker_beacons.get(imei, ()))
 
-# Known BLE definitions - YOUR 5 BEACONS
-# Only these will be tracked, all others ignored
-ble_definitions: Dict[str, Dict[str, Any]] = {
+
+# Built-in BLE definitions - YOUR 5 BEACONS
+# Only known beacons are tracked, all others ignored. BLE_Definitions rows are
+# overlaid on these and hot-reloaded when the System_Config stamp moves (see
+# DEFINITIONS RELOAD); read them through ble_registry.current.
+BUILTIN_BLE_DEFINITIONS: Dict[str, Dict[str, Any]] = {
     # Full MACs (lowercase)
     "7cd9f407f95c": {"name": "Eybe2plus1", "category": "Towed Device", "type": "eye_beacon", "sn": "6204011070"},
     "7cd9f4003536": {"name": "Eybe2plus2", "category": "Equipment", "type": "eye_beacon", "sn": "6204011168"},
@@ -83,41 +267,52 @@ ble_definitions: Dict[str, Dict[str, Any]] = {
     "7cd9f407a2db": {"name": "EyeBe4", "category": "Equipment", "type": "eye_beacon", "sn": ""},
 }
 
-# Partial MAC patterns to match (for different CODEC8 formats)
-KNOWN_MAC_PATTERNS = [
-    "7cd9f407f95c", "7cd9f4003536", "7cd9f4116ee7", "7cd9f406427b", "7cd9f407a2db",  # Full
-    "7cd9f407", "7cd9f400", "7cd9f411", "7cd9f406",  # 8-char prefix
-    "f407f95c", "f4003536", "f4116ee7", "f406427b", "f407a2db",  # 8-char suffix
-]
+ble_registry = DefinitionsRegistry(BUILTIN_BLE_DEFINITIONS)
 
-def match_known_beacon(mac: str, debug: bool = True) -> Optional[str]:
-    """Match a detected MAC to a known beacon, return full MAC if matched"""
+
+def match_known_beacon(mac: str, debug: bool = True, defs: Optional[BleDefinitions] = None) -> Optional[str]:
+    """
+    Match a detected MAC to a known beacon, return full MAC if matched.
+    Exact / reversed / unique 8-char spellings hit the registry index; anything
+    else goes through the fuzzy rules once per definitions version (memoized).
+    """
+    if defs is None:
+        defs = ble_registry.current
     original_mac = mac
-    mac = mac.lower().replace(":", "").replace("-", "")
-    
+    mac = normalize_mac(mac)
+    hit = defs.lookup(mac)
+    if hit is not None:
+        return hit
+    known, result = defs.memo_get(mac)
+    if known:
+        return result
+    result = _match_fuzzy(original_mac, mac, defs, debug)
+    defs.memo_put(mac, result)
+    return result
+
+
+def _match_fuzzy(original_mac: str, mac: str, defs: BleDefinitions, debug: bool) -> Optional[str]:
     # Remove leading zeros (but keep at least 4 chars)
     mac_stripped = mac.lstrip("0")
     if len(mac_stripped) < 4:
         return None  # Too short, likely garbage data
     
     # Direct match
-    if mac in ble_definitions:
+    if mac in defs:
         return mac
-    
-    # Check ALL known beacons (5 total)
-    all_known_macs = list(ble_definitions.keys())
-    
-    for full_mac in all_known_macs:
+
+    # Check ALL known beacons
+    for full_mac in defs.keys():
         full_stripped = full_mac.lstrip("0")
         
         if mac in full_mac or full_mac in mac:
             if debug:
-                logger.info(f"MATCH: {original_mac} -> {full_mac} (contains)")
+                log_match.debug("MATCH: %s -> %s (contains)", original_mac, full_mac)
             return full_mac
         
         if mac_stripped in full_stripped or full_stripped in mac_stripped:
             if debug:
-                logger.info(f"MATCH: {original_mac} -> {full_mac} (stripped contains)")
+                log_match.debug("MATCH: %s -> %s (stripped contains)", original_mac, full_mac)
             return full_mac
         
         # Check if first 8 chars match (FMC003 truncates MACs)
@@ -125,14 +320,14 @@ def match_known_beacon(mac: str, debug: bool = True) -> Optional[str]:
         full_8 = full_mac[:8]
         if mac_8 == full_8:
             if debug:
-                logger.info(f"MATCH: {original_mac} -> {full_mac} (prefix 8)")
+                log_match.debug("MATCH: %s -> %s (prefix 8)", original_mac, full_mac)
             return full_mac
         
         # Reverse the MAC and check
         mac_reversed = ''.join(reversed([mac[i:i+2] for i in range(0, len(mac), 2)]))
         if mac_reversed in full_mac or full_mac in mac_reversed:
             if debug:
-                logger.info(f"MATCH: {original_mac} (rev: {mac_reversed}) -> {full_mac}")
+                log_match.debug("MATCH: %s (rev: %s) -> %s", original_mac, mac_reversed, full_mac)
             return full_mac
     
     # Special pattern matching for truncated/reversed MACs
@@ -140,17 +335,17 @@ def match_known_beacon(mac: str, debug: bool = True) -> Optional[str]:
     
     # Eybe2plus2 (7cd9f4003536) - look for "003536" or "f4003" specifically
     if "003536" in mac or "f40035" in mac or "3536" in mac[-6:]:
-        logger.info(f"MATCH: {original_mac} -> 7cd9f4003536 (strict 3536 pattern)")
+        log_match.debug("MATCH: %s -> 7cd9f4003536 (strict 3536 pattern)", original_mac)
         return "7cd9f4003536"
     
     # EyeBe3 (7cd9f406427b) - look for "f406" prefix (unique among our beacons)
     if "f406" in mac or "9f406" in mac or "d9f406" in mac:
-        logger.info(f"MATCH: {original_mac} -> 7cd9f406427b (f406 prefix)")
+        log_match.debug("MATCH: %s -> 7cd9f406427b (f406 prefix)", original_mac)
         return "7cd9f406427b"
     
     # EyeBe4 (7cd9f407a2db) - look for "07a2db" or "a2db" specifically  
     if "07a2db" in mac or "a2db" in mac or "f407a2" in mac:
-        logger.info(f"MATCH: {original_mac} -> 7cd9f407a2db (strict a2db pattern)")
+        log_match.debug("MATCH: %s -> 7cd9f407a2db (strict a2db pattern)", original_mac)
         return "7cd9f407a2db"
     
     # Note: 0bf400140300 is NOT Eybe2plus2 - it's a different beacon
@@ -158,17 +353,127 @@ def match_known_beacon(mac: str, debug: bool = True) -> Optional[str]:
     # Also check for 3536 pattern (for Eybe2plus2)
     if "3536" in mac or "0035" in mac:
         if debug:
-            logger.info(f"MATCH: {original_mac} -> 7cd9f4003536 (contains 3536)")
+            log_match.debug("MATCH: %s -> 7cd9f4003536 (contains 3536)", original_mac)
         return "7cd9f4003536"
     
     # Debug: log unmatched MACs that look interesting
     if debug and ("7cd9" in mac or "f407" in mac or "f400" in mac or "f411" in mac or "3536" in mac):
-        logger.info(f"NEAR-MATCH: {original_mac} - consider adding to known beacons")
+        n = _mac_sampler.hit(mac)
+        if n:
+            log_match.info("NEAR-MATCH: %s - consider adding to known beacons (%d seen)", original_mac, n)
     
     return None  # Not a known beacon
 
-# Thread lock for data access
-data_lock = threading.Lock()
+# ============================================================
+# STATE LOCKING
+# ============================================================
+# Lock striping instead of one global lock (ordering: see LockStripes):
+#   tracker_locks guard trackers[imei]
+#   ble_locks guard ble_positions[mac], ble_pairing[mac], ble_db_last_sync[mac]
+tracker_locks = LockStripes(16, _timed_locks("tracker"))
+ble_locks = LockStripes(64, _timed_locks("ble"))
+
+# Versioned copy-on-write snapshots: every mutation records the keys it touched
+# and bumps state_version while still holding its stripe. Readers reuse the last
+# snapshot until the version moves; a rebuild shallow-copies the previous one
+# and re-copies only the dirty records, each under its own stripe, so ingest
+# threads never wait for more than one record copy.
+_state_counter = itertools.count(1)
+state_version = 0
+_snapshot: Optional[StateSnapshot] = None
+_snapshot_lock = _timed_locks("snapshot")()   # taken before any stripe
+_dirty_lock = threading.Lock()                  # leaf lock
+_dirty_trackers: Set[str] = set()
+_dirty_macs: Set[str] = set()
+
+
+def _mark_state_changed(imeis: Iterable[str] = (), macs: Iterable[str] = ()) -> None:
+    """Record the changed trackers / BLE positions (caller holds their stripes) and bump the version"""
+    global state_version
+    with _dirty_lock:
+        _dirty_trackers.update(imeis)
+        _dirty_macs.update(macs)
+    state_version = next(_state_counter)
+
+
+def _copy_dirty(target: Dict[str, Any], source: Dict[str, Any], keys: Iterable[str], locks: LockStripes) -> None:
+    for key in keys:
+        with locks.lock_for(key):
+            record = source.get(key)
+            record = record.copy() if record is not None else None
+        if record is None:
+            target.pop(key, None)
+        else:
+            target[key] = record
+
+
+def _reindex_snapshot(index: Dict[str, frozenset], previous: Dict[str, BleState],
+                      current: Dict[str, BleState], macs: Iterable[str]) -> None:
+    """
+    Move the dirty MACs in a snapshot's tracker index from their previous
+    tracker_imei to the copied one, so the index never names a MAC the
+    snapshot has no record for (the live tracker_beacons can run ahead).
+    """
+    added: Dict[str, Set[str]] = {}
+    removed: Dict[str, Set[str]] = {}
+    for mac in macs:
+        old = previous.get(mac)
+        new = current.get(mac)
+        old_imei = old.tracker_imei if old is not None else None
+        new_imei = new.tracker_imei if new is not None else None
+        if old_imei == new_imei:
+            continue
+        if old_imei is not None:
+            removed.setdefault(old_imei, set()).add(mac)
+        if new_imei is not None:
+            added.setdefault(new_imei, set()).add(mac)
+    for imei in added.keys() | removed.keys():
+        macs_now = (index.get(imei, frozenset()) - removed.get(imei, set())) | added.get(imei, set())
+        if macs_now:
+            index[imei] = frozenset(macs_now)
+        else:
+            index.pop(imei, None)
+
+
+def state_snapshot() -> StateSnapshot:
+    """
+    Read-only view of trackers, BLE positions and the tracker index. Each record
+    is a consistent copy; records changed while the view is built may be from
+    either side of that change (the next version picks them up). The index is
+    derived from the copied records' tracker_imei, not the live tracker_beacons.
+    """
+    global _snapshot, _dirty_trackers, _dirty_macs
+    snap = _snapshot
+    if snap is not None and snap.version == state_version:
+        return snap
+    with _snapshot_lock:
+        snap = _snapshot
+        version = state_version
+        if snap is not None and snap.version == version:
+            return snap
+        # Version first, then the dirty keys: a change that lands after the
+        # swap bumps the version again and is copied on the next rebuild
+        with _dirty_lock:
+            dirty_trackers, _dirty_trackers = _dirty_trackers, set()
+            dirty_macs, _dirty_macs = _dirty_macs, set()
+        if snap is None:
+            tracker_copies: Dict[str, TrackerState] = {}
+            ble_copies: Dict[str, BleState] = {}
+            index: Dict[str, frozenset] = {}
+            previous: Dict[str, BleState] = {}
+            dirty_trackers = list(trackers)
+            dirty_macs = list(ble_positions)
+        else:
+            tracker_copies = dict(snap.trackers)
+            ble_copies = dict(snap.ble_positions)
+            index = dict(snap.tracker_beacons)
+            previous = snap.ble_positions
+        _copy_dirty(tracker_copies, trackers, dirty_trackers, tracker_locks)
+        _copy_dirty(ble_copies, ble_positions, dirty_macs, ble_locks)
+        _reindex_snapshot(index, previous, ble_copies, dirty_macs)
+        snap = StateSnapshot(version, tracker_copies, ble_copies, index)
+        _snapshot = snap
+    return snap
 
 # ============================================================
 # CODEC8 PARSER
@@ -209,7 +514,7 @@ class Codec8Parser:
             # Parse preamble
             preamble = struct.unpack(">I", data[0:4])[0]
             if preamble != 0:
-                logger.debug(f"Invalid preamble: {preamble}")
+                log_codec.debug("Invalid preamble: %s", preamble)
                 return result
             
             # Data length
@@ -218,7 +523,7 @@ class Codec8Parser:
             # Codec ID
             codec_id = data[8]
             if codec_id not in (0x08, 0x8E):  # CODEC8 or CODEC8 Extended
-                logger.debug(f"Unsupported codec: {codec_id}")
+                log_codec.debug("Unsupported codec: %s", codec_id)
                 return result
             
             # Number of records
@@ -241,7 +546,7 @@ class Codec8Parser:
             result["records"] = records
             
         except Exception as e:
-            logger.error(f"Parse error: {e}")
+            log_codec.error("Parse error: %s", e)
         
         return result
     
@@ -327,10 +632,10 @@ class Codec8Parser:
                 count = struct.unpack(">H", data[offset:offset+2])[0]
                 offset += 2
                 
-                # DEBUG: Log variable length element count
-                if count > 0:
-                    logger.info(f"[DEBUG] Variable length elements: {count}")
-                
+                trace = log_codec.isEnabledFor(logging.DEBUG)
+                if trace and count > 0:
+                    log_codec.debug("Variable length elements: %d", count)
+
                 for _ in range(count):
                     io_id = struct.unpack(">H", data[offset:offset+2])[0]
                     offset += 2
@@ -339,13 +644,12 @@ class Codec8Parser:
                     value = data[offset:offset+length]
                     offset += length
                     
-                    # DEBUG: Log ALL variable length elements
-                    if io_id in (385, 10828, 10829, 10831, 11317, 548):
-                        logger.info(f"[DEBUG] VarLen Element ID={io_id}, Len={length}, Data={value[:40].hex() if len(value) > 40 else value.hex()}")
-                    
+                    # Beacon-carrying elements (hex dump only built when codec DEBUG is on)
+                    if trace and io_id in (385, 10828, 10829, 10831, 11317, 548):
+                        log_codec.debug("VarLen Element ID=%d, Len=%d, Data=%s", io_id, length, value[:40].hex())
+
                     # Parse BLE beacon data - Element 385 (standard) or FMC003 custom elements
                     if io_id == 385:  # Standard BLE Beacons seen
-                        logger.info(f"[DEBUG] ELEMENT 385 FOUND! Length={length}")
                         beacons = Codec8Parser._parse_ble_beacons(value)
                         record["beacons"].extend(beacons)
                     elif io_id in (10828, 10829):  # FMC003 custom EYE beacon elements
@@ -363,7 +667,7 @@ class Codec8Parser:
             return record, offset
             
         except Exception as e:
-            logger.error(f"AVL record parse error: {e}")
+            log_codec.error("AVL record parse error: %s", e)
             return None, offset + 50  # Skip some bytes
     
     @staticmethod
@@ -378,36 +682,32 @@ class Codec8Parser:
             # Look for known MAC patterns in the raw data
             data_hex = data.hex().lower()
             
-            # Search for known beacon MAC patterns
-            known_macs = ["7cd9f407f95c", "7cd9f407a2db", "7cd9f4003536", "7cd9f4116ee7", "7cd9f406427b"]
-            
-            for mac in known_macs:
-                if mac in data_hex:
-                    # Found a beacon MAC!
-                    logger.info(f"[FMC003] Found beacon MAC in element {element_id}: {mac}")
-                    
-                    # Try to extract battery from nearby bytes
-                    mac_pos = data_hex.find(mac)
-                    battery = None
-                    if mac_pos >= 4:
-                        # Battery might be 2 bytes before MAC
-                        try:
-                            battery_hex = data_hex[mac_pos-4:mac_pos-2]
-                            battery = int(battery_hex, 16)
-                        except:
-                            pass
-                    
-                    beacon = {
-                        "mac": mac,
-                        "battery": battery,
-                        "rssi": None,
-                        "detected_at": datetime.now().isoformat(),
-                        "source": f"element_{element_id}",
-                    }
-                    beacons.append(beacon)
-            
+            # Search for known beacon MACs (one regex pass over the current definitions)
+            for mac, mac_pos in ble_registry.current.find_in_hex(data_hex):
+                # Found a beacon MAC!
+                log_codec.debug("[FMC003] Found beacon MAC in element %d: %s", element_id, mac)
+
+                # Try to extract battery from nearby bytes
+                battery = None
+                if mac_pos >= 4:
+                    # Battery might be 2 bytes before MAC
+                    try:
+                        battery_hex = data_hex[mac_pos-4:mac_pos-2]
+                        battery = int(battery_hex, 16)
+                    except:
+                        pass
+
+                beacon = {
+                    "mac": mac,
+                    "battery": battery,
+                    "rssi": None,
+                    "detected_at": datetime.now().isoformat(),
+                    "source": f"element_{element_id}",
+                }
+                beacons.append(beacon)
+
         except Exception as e:
-            logger.error(f"FMC003 beacon parse error: {e}")
+            log_codec.error("FMC003 beacon parse error: %s", e)
         
         return beacons
     
@@ -421,23 +721,20 @@ class Codec8Parser:
             
             data_hex = data.hex().lower()
             
-            # Search for known beacon MAC patterns
-            known_macs = ["7cd9f407f95c", "7cd9f407a2db", "7cd9f4003536", "7cd9f4116ee7", "7cd9f406427b"]
-            
-            for mac in known_macs:
-                if mac in data_hex:
-                    logger.info(f"[FMC003] Found beacon MAC in element 11317: {mac}")
-                    beacon = {
-                        "mac": mac,
-                        "battery": None,
-                        "rssi": None,
-                        "detected_at": datetime.now().isoformat(),
-                        "source": "element_11317",
-                    }
-                    beacons.append(beacon)
-                    
+            # Search for known beacon MACs (one regex pass over the current definitions)
+            for mac, _ in ble_registry.current.find_in_hex(data_hex):
+                log_codec.debug("[FMC003] Found beacon MAC in element 11317: %s", mac)
+                beacon = {
+                    "mac": mac,
+                    "battery": None,
+                    "rssi": None,
+                    "detected_at": datetime.now().isoformat(),
+                    "source": "element_11317",
+                }
+                beacons.append(beacon)
+
         except Exception as e:
-            logger.error(f"FMC003 beacon list parse error: {e}")
+            log_codec.error("FMC003 beacon list parse error: %s", e)
         
         return beacons
 
@@ -503,7 +800,7 @@ class Codec8Parser:
                 beacons.append(beacon)
                 
         except Exception as e:
-            logger.error(f"BLE beacon parse error: {e}")
+            log_codec.error("BLE beacon parse error: %s", e)
         
         return beacons
 
@@ -512,22 +809,12 @@ class Codec8Parser:
 # IMPROVED POSITIONING LOGIC
 # ============================================================
 def calculate_distance_meters(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
-    """Calculate distance between two points in meters using Haversine formula"""
-    import math
-    R = 6371000  # Earth's radius in meters
-    
-    lat1_rad = math.radians(lat1)
-    lat2_rad = math.radians(lat2)
-    delta_lat = math.radians(lat2 - lat1)
-    delta_lng = math.radians(lng2 - lng1)
-    
-    a = math.sin(delta_lat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lng/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    
-    return R * c
+    """Distance between two points in meters (see geo.distance_m)"""
+    return distance_m(lat1, lng1, lat2, lng2)
 
 
-def _sync_ble_position_sql(
+def _queue_ble_position_sql(
+    rows: Optional[Dict[str, Dict[str, Any]]],
     mac: str,
     lat: Any,
     lng: Any,
@@ -537,10 +824,15 @@ def _sync_ble_position_sql(
     pairing_duration_sec: int,
     battery_percent: Any = None,
     magnet_status: Any = None,
-    now: Optional[datetime] = None,
     force: bool = False,
 ) -> bool:
-    """Persist BLE last-known position to SQL, throttled unless forced."""
+    """
+    Add mac's last-known position to rows (one db_helper.upsert_ble_positions
+    batch per packet; the caller holds the MAC stripe and sends rows after
+    releasing it), throttled unless forced. The throttle runs on arrival time
+    (monotonic), not the record's event time, so a buffered backlog replayed in
+    one packet is not written record by record. rows=None writes right away.
+    """
     if not DB_ENABLED:
         return False
     try:
@@ -549,32 +841,57 @@ def _sync_ble_position_sql(
     except (TypeError, ValueError):
         return False
 
-    ts = now or datetime.now()
+    ts = mono_now()
     if not force:
         last_sync = ble_db_last_sync.get(mac)
-        if last_sync and (ts - last_sync).total_seconds() < DB_HEARTBEAT_SYNC_SEC:
+        if last_sync is not None and ts - last_sync < DB_HEARTBEAT_SYNC_SEC:
             return False
 
-    try:
-        db_helper.update_ble_position(
-            mac=mac,
-            lat=lat_f,
-            lng=lng_f,
-            tracker_id=tracker_id,
-            tracker_label=tracker_label,
-            is_paired=is_paired,
-            pairing_duration_sec=int(pairing_duration_sec or 0),
-            battery_percent=battery_percent,
-            magnet_status=str(magnet_status) if magnet_status is not None else None,
-        )
-        ble_db_last_sync[mac] = ts
-        return True
-    except Exception as e:
-        logger.error(f"[DB] BLE position sync error for {mac}: {e}")
-        return False
-
-
-def process_beacons(imei: str, tracker_lat: float, tracker_lng: float, beacons: List[Dict[str, Any]], tracker_speed: float = 0):
+    pos = ble_positions.get(mac)
+    row = {
+        "mac": mac, "lat": lat_f, "lng": lng_f,
+        "tracker_id": tracker_id, "tracker_label": tracker_label,
+        "is_paired": is_paired, "pairing_duration_sec": int(pairing_duration_sec or 0),
+        "battery_percent": battery_percent,
+        "magnet_status": str(magnet_status) if magnet_status is not None else None,
+        "rssi": pos.rssi_smoothed if pos is not None else None,
+    }
+    ble_db_last_sync[mac] = ts
+    if rows is None:
+        return db_helper.upsert_ble_positions([row]) > 0
+    rows[mac] = row
+    return True
+
+
+def _write_ble_positions_sql(rows: Dict[str, Dict[str, Any]]) -> None:
+    """Send queued position rows in one round trip; on failure clear their throttle stamps so the next detection retries"""
+    if not rows:
+        return
+    if db_helper.upsert_ble_positions(list(rows.values())):
+        return
+    log_db.error("[DB] BLE position batch failed (%d rows)", len(rows))
+    for mac in rows:
+        with ble_locks.lock_for(mac):
+            ble_db_last_sync.pop(mac, None)
+
+
+def _record_event_time(record: Dict[str, Any]) -> float:
+    """Monotonic-domain event time of an AVL record (arrival time if its timestamp is unusable)"""
+    arrival = mono_now()
+    ts = utc_to_mono(record.get("timestamp"))
+    if ts is None or ts < arrival - EVENT_TIME_MAX_AGE_SEC:
+        return arrival
+    return min(ts, arrival)     # device clock ahead of ours
+
+
+def process_beacons(
+    imei: str,
+    tracker_lat: float,
+    tracker_lng: float,
+    beacons: List[Dict[str, Any]],
+    tracker_speed: float = 0,
+    event_time: Optional[float] = None,
+):
     """
     Process BLE beacons with IMPROVED positioning logic:
     
@@ -588,320 +905,421 @@ def process_beacons(imei: str, tracker_lat: float, tracker_lng: float, beacons:
     - Beacons getting scattered positions while driving
     - Eyesensor shifting 20m while static (GPS drift)
     - Eyebecon1 not updating after driving home (gap detection)
+
+    event_time is the record's timestamp (monotonic domain, see _record_event_time);
+    pairing durations, gaps and last_seen run on it so a buffered backlog replays
+    with its real spacing. Defaults to now.
     """
-    global ble_positions, ble_pairing
-    
-    now = datetime.now()
-    known_detected = []  # Track which known beacons were detected
-    is_stopped = tracker_speed < MAX_SPEED_KMH  # Only update positions when stopped/slow
-    
-    # Log all raw MACs for debugging (first 10 only)
-    if beacons and len(beacons) > 0:
-        raw_macs = [b.get("mac", "?")[:12] for b in beacons[:10]]
-        logger.info(f"[DEBUG] ALL Raw MACs received: {raw_macs}, Speed: {tracker_speed:.1f} km/h, Stopped: {is_stopped}")
-    
-    with data_lock:
+    now = event_time if event_time is not None else mono_now()
+    touched = process_beacon_records(imei, [(now, tracker_lat, tracker_lng, tracker_speed, beacons)])
+    _publish_worker_state(imei, touched)
+
+
+@timed(PROCESS_BEACONS_SECONDS)
+def process_beacon_records(imei: str, records: List[tuple]) -> List[str]:
+    """
+    Batch form of process_beacons for all records of one packet.
+
+    records: [(event_time, lat, lng, speed, beacons), ...] in event-time order.
+    Beacons are grouped by MAC so each MAC stripe is taken once per packet and
+    the state machine replays that beacon's detections in order under it.
+    Returns the known MACs that were processed. The definitions version is
+    taken once, so a reload mid-packet does not mix two versions.
+    """
+    defs = ble_registry.current
+    tracker = trackers.get(imei)
+    tracker_label = tracker.label if tracker else imei
+
+    # { mac: [(event_time, lat, lng, speed, beacon), ...] }
+    by_mac: Dict[str, List[tuple]] = {}
+    for now, tracker_lat, tracker_lng, tracker_speed, beacons in records:
+        if not beacons:
+            continue
+        # Raw MACs (first 10), sampled per tracker
+        if log_match.isEnabledFor(logging.DEBUG) and _tcp_sampler.hit(("macs", imei)):
+            log_match.debug(
+                "Raw MACs from %s: %s, Speed: %.1f km/h, Stopped: %s",
+                imei, [b.get("mac", "?")[:12] for b in beacons[:10]], tracker_speed, tracker_speed < MAX_SPEED_KMH,
+            )
+
         for beacon in beacons:
             raw_mac = beacon.get("mac", "").lower()
             if not raw_mac:
                 continue
-            
+
             # Check if this is one of our known beacons
-            matched_mac = match_known_beacon(raw_mac, debug=True)
+            matched_mac = match_known_beacon(raw_mac, debug=True, defs=defs)
             if not matched_mac:
                 # Log unmatched MACs for debugging
-                if "f407" in raw_mac or "f400" in raw_mac or "f411" in raw_mac:
-                    logger.warning(f"[DEBUG] CLOSE BUT NO MATCH: {raw_mac} (contains known pattern)")
+                if ("f407" in raw_mac or "f400" in raw_mac or "f411" in raw_mac) and _mac_sampler.hit(raw_mac):
+                    log_match.warning("CLOSE BUT NO MATCH: %s (contains known pattern)", raw_mac)
                 continue  # Skip unknown beacons
-            
-            mac = matched_mac  # Use the full known MAC
-            known_detected.append(mac)
-            
-            # Get BLE definition info
-            ble_info = ble_definitions.get(mac, {})
-            beacon_name = ble_info.get("name", mac[:8])
-            beacon["name"] = beacon_name
-            beacon["category"] = ble_info.get("category", "Unknown")
-            beacon["type"] = ble_info.get("type", "eye_beacon")
-            beacon["sn"] = ble_info.get("sn", "")
-            
-            # ============================================================
-            # CASE 1: FIRST DETECTION - Set initial position (ONLY IF STOPPED)
-            # ============================================================
-            if mac not in ble_positions:
-                if is_stopped:
-                    # Tracker is stopped - set initial position
-                    ble_positions[mac] = {
-                        "lat": tracker_lat,
-                        "lng": tracker_lng,
-                        "tracker_imei": imei,
-                        "tracker_label": trackers.get(imei, {}).get("label", imei),
-                        "last_update": now.isoformat(),
-                        "last_seen": now,  # datetime object for calculations
-                        "is_paired": False,
-                        "pairing_duration": 0,
-                        "battery": beacon.get("battery"),
-                        "rssi": beacon.get("rssi"),
-                        "magnet_status": beacon.get("magnet_status"),
-                    }
-                    ble_pairing[mac] = {"tracker_imei": imei, "start_time": now}
-                    logger.info(f"BLE {mac} ({beacon_name}): FIRST DETECTION (STOPPED) at ({tracker_lat:.6f}, {tracker_lng:.6f})")
-                else:
-                    # Tracker is moving - DON'T set position yet, just track that we saw it
-                    ble_positions[mac] = {
-                        "lat": None,  # No position yet - waiting for stop
-                        "lng": None,
-                        "tracker_imei": imei,
-                        "tracker_label": trackers.get(imei, {}).get("label", imei),
-                        "last_update": now.isoformat(),
-                        "last_seen": now,
-                        "is_paired": False,
-                        "pairing_duration": 0,
-                        "battery": beacon.get("battery"),
-                        "rssi": beacon.get("rssi"),
-                        "magnet_status": beacon.get("magnet_status"),
-                    }
-                    ble_pairing[mac] = {"tracker_imei": imei, "start_time": now}
-                    logger.info(f"BLE {mac} ({beacon_name}): DETECTED WHILE MOVING ({tracker_speed:.1f} km/h) - waiting for stop")
-                
-                # Save to database only when we have a valid first position.
-                # For moving pass-by detections, keep SQL unchanged until stop/pairing logic confirms.
-                if is_stopped:
-                    _sync_ble_position_sql(
-                        mac=mac,
-                        lat=tracker_lat,
-                        lng=tracker_lng,
-                        tracker_id=imei,
-                        tracker_label=trackers.get(imei, {}).get("label", imei),
-                        is_paired=False,
-                        pairing_duration_sec=0,
-                        battery_percent=beacon.get("battery"),
-                        magnet_status=beacon.get("magnet_status"),
-                        now=now,
-                        force=True,
-                    )
-                continue
-            
-            # ============================================================
-            # EXISTING BEACON - Calculate distance and time since last seen
-            # ============================================================
-            old_lat = ble_positions[mac].get("lat", tracker_lat)
-            old_lng = ble_positions[mac].get("lng", tracker_lng)
-            distance_m = calculate_distance_meters(old_lat, old_lng, tracker_lat, tracker_lng)
-            
-            # Calculate time since last seen
-            last_seen = ble_positions[mac].get("last_seen")
-            if isinstance(last_seen, str):
-                try:
-                    last_seen = datetime.fromisoformat(last_seen)
-                except:
-                    last_seen = now
-            gap_seconds = (now - last_seen).total_seconds() if last_seen else 0
-            
-            # Always update metadata (runs every detection, regardless of distance)
-            ble_positions[mac]["last_seen"] = now
-            ble_positions[mac]["last_update"] = now.isoformat()
-            ble_positions[mac]["battery"] = beacon.get("battery") or ble_positions[mac].get("battery")
-            ble_positions[mac]["rssi"] = beacon.get("rssi") or ble_positions[mac].get("rssi")
-            ble_positions[mac]["tracker_imei"] = imei
-            if beacon.get("magnet_status") is not None:
-                ble_positions[mac]["magnet_status"] = beacon.get("magnet_status")
-            
-            # ============================================================
-            # CASE 1b: BEACON HAS NO POSITION YET (was detected while moving)
-            # ============================================================
-            if old_lat is None or old_lng is None:
-                if is_stopped:
-                    # Now stopped - set the position!
-                    ble_positions[mac]["lat"] = tracker_lat
-                    ble_positions[mac]["lng"] = tracker_lng
-                    logger.info(f"BLE {mac} ({beacon_name}): NOW STOPPED - setting position ({tracker_lat:.6f}, {tracker_lng:.6f})")
-                    _sync_ble_position_sql(
-                        mac=mac,
-                        lat=tracker_lat,
-                        lng=tracker_lng,
-                        tracker_id=imei,
-                        tracker_label=trackers.get(imei, {}).get("label", imei),
-                        is_paired=False,
-                        pairing_duration_sec=0,
-                        battery_percent=beacon.get("battery"),
-                        magnet_status=beacon.get("magnet_status"),
-                        now=now,
-                        force=True,
-                    )
-                else:
-                    logger.debug(f"BLE {mac}: Still moving ({tracker_speed:.1f} km/h), waiting for stop")
-                continue
-            
-            # ============================================================
-            # PAIRING STATUS - Always update regardless of distance
-            # Runs BEFORE the drift filter so map status is always current
-            # ============================================================
-            current_pairing = ble_pairing.get(mac)
-
-            if current_pairing is None or current_pairing.get("tracker_imei") != imei:
-                # New or different tracker - reset pairing timer
-                ble_pairing[mac] = {"tracker_imei": imei, "start_time": now}
-                logger.info(f"BLE {mac} ({beacon_name}): New tracker {imei}, starting 60s pairing timer")
-                ble_positions[mac]["is_paired"] = False
-                ble_positions[mac]["pairing_duration"] = 0
-                pairing_duration = 0
-                is_paired = False
-            else:
-                # Same tracker - accumulate pairing duration
-                pairing_duration = (now - ble_pairing[mac]["start_time"]).total_seconds()
-                ble_positions[mac]["pairing_duration"] = int(pairing_duration)
-                is_paired = pairing_duration >= PAIRING_THRESHOLD_SEC
-                ble_positions[mac]["is_paired"] = is_paired
-                if not is_paired:
-                    logger.debug(f"BLE {mac}: Pairing {pairing_duration:.0f}s / {PAIRING_THRESHOLD_SEC}s")
-
-            # ============================================================
-            # CASE 2: GPS DRIFT FILTER - Skip position update only
-            # Pairing status already updated above - map always stays current
-            # ============================================================
-            if distance_m < GPS_DRIFT_THRESHOLD_M:
-                # Keep SQL in sync with last-known position + fresh timestamps even without movement.
-                _sync_ble_position_sql(
-                    mac=mac,
-                    lat=ble_positions[mac].get("lat"),
-                    lng=ble_positions[mac].get("lng"),
-                    tracker_id=imei,
-                    tracker_label=trackers.get(imei, {}).get("label", imei),
-                    is_paired=is_paired,
-                    pairing_duration_sec=int(pairing_duration),
-                    battery_percent=beacon.get("battery"),
-                    magnet_status=beacon.get("magnet_status"),
-                    now=now,
-                    force=False,
+
+            # Use the full known MAC
+            by_mac.setdefault(matched_mac, []).append((now, tracker_lat, tracker_lng, tracker_speed, beacon))
+
+    # Distances from every matched beacon's stored position to its first detection,
+    # in one batched call. Read without the stripe; re-checked under it before use.
+    hints = []
+    for mac, events in by_mac.items():
+        pos = ble_positions.get(mac)
+        if pos is not None and pos.lat is not None and pos.lng is not None:
+            hints.append((mac, pos.lat, pos.lng, events[0][1], events[0][2]))
+    distance_hints = {}
+    for (first_lat, first_lng), group in itertools.groupby(
+        sorted(hints, key=lambda h: (h[3], h[4])), key=lambda h: (h[3], h[4])
+    ):
+        group = list(group)
+        dists = distances_from(first_lat, first_lng, [h[1] for h in group], [h[2] for h in group])
+        for h, d in zip(group, dists):
+            distance_hints[h[0]] = (h[1], h[2], d)
+
+    scans = []
+    sql_rows: Dict[str, Dict[str, Any]] = {}
+    for mac, events in by_mac.items():
+        # One beacon at a time under its MAC stripe: a handover between two
+        # trackers serializes here (lock order: tracker -> MAC stripes -> index).
+        with ble_locks.lock_for(mac):
+            for n, (now, tracker_lat, tracker_lng, tracker_speed, beacon) in enumerate(events):
+                beacon["rssi_smoothed"] = rssi_filters.update((mac, imei), beacon.get("rssi"), now)
+                beacon["distance_m"] = estimate_distance_m(beacon["rssi_smoothed"])
+                _process_known_beacon(
+                    mac, beacon, imei, tracker_label, tracker_lat, tracker_lng,
+                    tracker_speed, tracker_speed < MAX_SPEED_KMH, now,
+                    distance_hints.get(mac) if n == 0 else None, defs, sql_rows,
                 )
-                logger.debug(f"BLE {mac}: No movement ({distance_m:.1f}m), paired={is_paired}, duration={int(pairing_duration)}s")
-                continue
+                scans.append({
+                    "mac": mac,
+                    "lat": tracker_lat,
+                    "lng": tracker_lng,
+                    "tracker_imei": imei,
+                    "tracker_label": tracker_label,
+                    "rssi": beacon.get("rssi"),
+                    "battery_percent": beacon.get("battery"),
+                    "distance_meters": beacon.get("distance", 0),
+                    "magnet_status": beacon.get("magnet_status") or None,
+                    "is_known_beacon": True,
+                    "scan_time": mono_to_datetime(now),
+                })
+            _mark_state_changed(macs=(mac,))
+
+    # Position rows and EVERY scan (BLE_Scans history): one round trip each per
+    # packet, after the stripes are released
+    _write_ble_positions_sql(sql_rows)
+    if DB_ENABLED and scans:
+        db_helper.log_ble_scans(scans)
+    return list(by_mac)
+
+
+def _process_known_beacon(
+    mac: str,
+    beacon: Dict[str, Any],
+    imei: str,
+    tracker_label: str,
+    tracker_lat: float,
+    tracker_lng: float,
+    tracker_speed: float,
+    is_stopped: bool,
+    now: float,
+    distance_hint: Optional[tuple] = None,
+    defs: Optional[BleDefinitions] = None,
+    sql_rows: Optional[Dict[str, Dict[str, Any]]] = None,
+):
+    """
+    Positioning / pairing state machine for one known beacon (caller holds its MAC stripe).
+    distance_hint is (lat, lng, meters) precomputed by process_beacons; used only if the
+    stored position is still (lat, lng). defs is the caller's definitions version.
+    BLE_Positions rows are queued in sql_rows for the caller to write once per packet.
+    """
+    # Get BLE definition info
+    ble_info = (defs or ble_registry.current).get(mac, {})
+    beacon_name = ble_info.get("name", mac[:8])
+    beacon["name"] = beacon_name
+    beacon["category"] = ble_info.get("category", "Unknown")
+    beacon["type"] = ble_info.get("type", "eye_beacon")
+    beacon["sn"] = ble_info.get("sn", "")
+
+    # ============================================================
+    # CASE 1: FIRST DETECTION - Set initial position (ONLY IF STOPPED)
+    # ============================================================
+    pos = ble_positions.get(mac)
+    if pos is None:
+        # Tracker stopped: set initial position. Moving: no position yet - waiting for stop
+        ble_positions[mac] = BleState(
+            mac,
+            lat=tracker_lat if is_stopped else None,
+            lng=tracker_lng if is_stopped else None,
+            tracker_imei=imei,
+            tracker_label=tracker_label,
+            last_seen=now,
+            battery=beacon.get("battery"),
+            rssi=beacon.get("rssi"),
+            magnet_status=beacon.get("magnet_status"),
+        )
+        ble_positions[mac].rssi_smoothed = beacon.get("rssi_smoothed")
+        ble_positions[mac].distance_m = beacon.get("distance_m")
+        ble_pairing[mac] = PairingState(imei, now)
+        _index_ble_position(mac)
+        if is_stopped:
+            log_ble.info("BLE %s (%s): FIRST DETECTION (STOPPED) at (%.6f, %.6f)", mac, beacon_name, tracker_lat, tracker_lng)
+        else:
+            log_ble.info("BLE %s (%s): DETECTED WHILE MOVING (%.1f km/h) - waiting for stop", mac, beacon_name, tracker_speed)
+        _index_ble_tracker(mac, imei)
+
+        # Save to database only when we have a valid first position.
+        # For moving pass-by detections, keep SQL unchanged until stop/pairing logic confirms.
+        if is_stopped:
+            _queue_ble_position_sql(
+                sql_rows,
+                mac=mac,
+                lat=tracker_lat,
+                lng=tracker_lng,
+                tracker_id=imei,
+                tracker_label=tracker_label,
+                is_paired=False,
+                pairing_duration_sec=0,
+                battery_percent=beacon.get("battery"),
+                magnet_status=beacon.get("magnet_status"),
+                force=True,
+            )
+        return
+
+    # ============================================================
+    # EXISTING BEACON - Calculate distance and time since last seen
+    # ============================================================
+    old_lat = pos.lat
+    old_lng = pos.lng
+
+    # Calculate time since last seen (event time; another source may be ahead of us)
+    gap_seconds = max(0.0, now - pos.last_seen) if pos.last_seen is not None else 0
+
+    # Always update metadata (runs every detection, regardless of distance)
+    pos.last_seen = now if pos.last_seen is None else max(pos.last_seen, now)
+    pos.battery = beacon.get("battery") or pos.battery
+    pos.rssi = beacon.get("rssi") or pos.rssi
+    if beacon.get("rssi_smoothed") is not None:
+        pos.rssi_smoothed = beacon["rssi_smoothed"]
+        pos.distance_m = beacon.get("distance_m")
+    pos.tracker_imei = imei
+    _index_ble_tracker(mac, imei)
+    if beacon.get("magnet_status") is not None:
+        pos.magnet_status = beacon.get("magnet_status")
+
+    # ============================================================
+    # CASE 1b: BEACON HAS NO POSITION YET (was detected while moving)
+    # ============================================================
+    if old_lat is None or old_lng is None:
+        if is_stopped:
+            # Now stopped - set the position!
+            pos.lat = tracker_lat
+            pos.lng = tracker_lng
+            _index_ble_position(mac)
+            log_ble.info("BLE %s (%s): NOW STOPPED - setting position (%.6f, %.6f)", mac, beacon_name, tracker_lat, tracker_lng)
+            _queue_ble_position_sql(
+                sql_rows,
+                mac=mac,
+                lat=tracker_lat,
+                lng=tracker_lng,
+                tracker_id=imei,
+                tracker_label=tracker_label,
+                is_paired=False,
+                pairing_duration_sec=0,
+                battery_percent=beacon.get("battery"),
+                magnet_status=beacon.get("magnet_status"),
+                force=True,
+            )
+        else:
+            log_ble.debug("BLE %s: Still moving (%.1f km/h), waiting for stop", mac, tracker_speed)
+        return
 
-            # ============================================================
-            # CASE 3: GAP + SIGNIFICANT MOVE - Update immediately
-            # ============================================================
-            if gap_seconds > GAP_THRESHOLD_SEC and distance_m > SIGNIFICANT_MOVE_M:
-                logger.info(f"BLE {mac} ({beacon_name}): GAP ({gap_seconds:.0f}s) + MOVED {distance_m:.0f}m -> UPDATING")
-                ble_positions[mac]["lat"] = tracker_lat
-                ble_positions[mac]["lng"] = tracker_lng
-                ble_positions[mac]["is_paired"] = True
-                ble_pairing[mac] = {"tracker_imei": imei, "start_time": now}
-                pairing_duration = 0
-                is_paired = True
-                if _sync_ble_position_sql(
-                    mac=mac,
-                    lat=tracker_lat,
-                    lng=tracker_lng,
-                    tracker_id=imei,
-                    tracker_label=trackers.get(imei, {}).get("label", imei),
-                    is_paired=True,
-                    pairing_duration_sec=int(gap_seconds),
-                    battery_percent=beacon.get("battery"),
-                    magnet_status=beacon.get("magnet_status"),
-                    now=now,
-                    force=True,
-                ):
-                    logger.info(f"[DB] Updated BLE position after gap: {mac}")
-                continue
+    if distance_hint is not None and distance_hint[0] == old_lat and distance_hint[1] == old_lng:
+        distance_m = distance_hint[2]
+    else:
+        distance_m = calculate_distance_meters(old_lat, old_lng, tracker_lat, tracker_lng)
+
+    # ============================================================
+    # PAIRING STATUS - Always update regardless of distance
+    # Runs BEFORE the drift filter so map status is always current
+    # ============================================================
+    current_pairing = ble_pairing.get(mac)
+
+    if current_pairing is None or current_pairing.tracker_imei != imei:
+        # New or different tracker - reset pairing timer
+        ble_pairing[mac] = PairingState(imei, now)
+        log_ble.info("BLE %s (%s): New tracker %s, starting 60s pairing timer", mac, beacon_name, imei)
+        pos.is_paired = False
+        pos.pairing_duration = 0
+        pairing_duration = 0
+        is_paired = False
+    else:
+        # Same tracker - accumulate pairing duration
+        pairing_duration = max(0.0, now - current_pairing.start_time)
+        pos.pairing_duration = int(pairing_duration)
+        is_paired = pairing_duration >= PAIRING_THRESHOLD_SEC
+        pos.is_paired = is_paired
+        if not is_paired:
+            log_ble.debug("BLE %s: Pairing %.0fs / %ss", mac, pairing_duration, PAIRING_THRESHOLD_SEC)
+
+    # ============================================================
+    # CASE 2: GPS DRIFT FILTER - Skip position update only
+    # Pairing status already updated above - map always stays current
+    # ============================================================
+    if distance_m < GPS_DRIFT_THRESHOLD_M:
+        # Keep SQL in sync with last-known position + fresh timestamps even without movement.
+        _queue_ble_position_sql(
+            sql_rows,
+            mac=mac,
+            lat=pos.lat,
+            lng=pos.lng,
+            tracker_id=imei,
+            tracker_label=tracker_label,
+            is_paired=is_paired,
+            pairing_duration_sec=int(pairing_duration),
+            battery_percent=beacon.get("battery"),
+            magnet_status=beacon.get("magnet_status"),
+            force=False,
+        )
+        log_ble.debug("BLE %s: No movement (%.1fm), paired=%s, duration=%ss", mac, distance_m, is_paired, int(pairing_duration))
+        return
+
+    # ============================================================
+    # CASE 3: GAP + SIGNIFICANT MOVE - Update immediately
+    # ============================================================
+    if gap_seconds > GAP_THRESHOLD_SEC and distance_m > SIGNIFICANT_MOVE_M:
+        log_ble.info("BLE %s (%s): GAP (%.0fs) + MOVED %.0fm -> UPDATING", mac, beacon_name, gap_seconds, distance_m)
+        pos.lat = tracker_lat
+        pos.lng = tracker_lng
+        _index_ble_position(mac)
+        pos.is_paired = True
+        ble_pairing[mac] = PairingState(imei, now)
+        pairing_duration = 0
+        is_paired = True
+        if _queue_ble_position_sql(
+            sql_rows,
+            mac=mac,
+            lat=tracker_lat,
+            lng=tracker_lng,
+            tracker_id=imei,
+            tracker_label=tracker_label,
+            is_paired=True,
+            pairing_duration_sec=int(gap_seconds),
+            battery_percent=beacon.get("battery"),
+            magnet_status=beacon.get("magnet_status"),
+            force=True,
+        ):
+            log_db.info("[DB] Queued BLE position after gap: %s", mac)
+        return
+
+    # ============================================================
+    # CASE 4: TOWING CONFIRMED - Update position when paired (>60s)
+    # Only reached when distance > GPS_DRIFT_THRESHOLD (real movement)
+    # ============================================================
+    if is_paired:
+        log_ble.info("BLE %s (%s): TOWING (%.0fs), moved %.0fm -> UPDATING", mac, beacon_name, pairing_duration, distance_m)
+        pos.lat = tracker_lat
+        pos.lng = tracker_lng
+        _index_ble_position(mac)
+        if _queue_ble_position_sql(
+            sql_rows,
+            mac=mac,
+            lat=tracker_lat,
+            lng=tracker_lng,
+            tracker_id=imei,
+            tracker_label=tracker_label,
+            is_paired=True,
+            pairing_duration_sec=int(pairing_duration),
+            battery_percent=beacon.get("battery"),
+            magnet_status=beacon.get("magnet_status"),
+            force=True,
+        ):
+            log_db.info("[DB] Queued BLE position during towing: %s", mac)
+    else:
+        log_ble.debug("BLE %s: Waiting for 60s pairing (%.0fs so far)", mac, pairing_duration)
 
-            # ============================================================
-            # CASE 4: TOWING CONFIRMED - Update position when paired (>60s)
-            # Only reached when distance > GPS_DRIFT_THRESHOLD (real movement)
-            # ============================================================
-            if is_paired:
-                logger.info(f"BLE {mac} ({beacon_name}): TOWING ({pairing_duration:.0f}s), moved {distance_m:.0f}m -> UPDATING")
-                ble_positions[mac]["lat"] = tracker_lat
-                ble_positions[mac]["lng"] = tracker_lng
-                if _sync_ble_position_sql(
-                    mac=mac,
-                    lat=tracker_lat,
-                    lng=tracker_lng,
-                    tracker_id=imei,
-                    tracker_label=trackers.get(imei, {}).get("label", imei),
-                    is_paired=True,
-                    pairing_duration_sec=int(pairing_duration),
-                    battery_percent=beacon.get("battery"),
-                    magnet_status=beacon.get("magnet_status"),
-                    now=now,
-                    force=True,
-                ):
-                    logger.info(f"[DB] Updated BLE position during towing: {mac}")
-            else:
-                logger.debug(f"BLE {mac}: Waiting for 60s pairing ({pairing_duration:.0f}s so far)")
-            
-            # Update beacon with position info
-            pos = ble_positions[mac]
-            beacon["stored_lat"] = pos["lat"]
-            beacon["stored_lng"] = pos["lng"]
-            beacon["is_paired"] = is_paired
-            beacon["pairing_duration"] = int(pairing_duration)
-            beacon["last_tracker"] = pos.get("tracker_label", imei)
-            
-            # Log EVERY scan to BLE_Scans for historical analysis
-            if DB_ENABLED:
-                try:
-                    conn = db_helper.get_connection()
-                    cursor = conn.cursor()
-                    cursor.execute("""
-                        INSERT INTO BLE_Scans 
-                        (mac, lat, lng, tracker_imei, tracker_label, rssi, battery_percent, 
-                         distance_meters, magnet_status, is_known_beacon, scan_time)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1, GETDATE())
-                    """, mac, tracker_lat, tracker_lng, imei, imei, 
-                        beacon.get("rssi"), beacon.get("battery"), 
-                        beacon.get("distance", 0),
-                        str(beacon.get("magnet_status")) if beacon.get("magnet_status") else None)
-                    conn.commit()
-                    logger.debug(f"[DB] Scan logged: {mac}")
-                except Exception as e:
-                    logger.debug(f"[DB] Scan log error: {e}")
+    # Update beacon with position info
+    beacon["stored_lat"] = pos.lat
+    beacon["stored_lng"] = pos.lng
+    beacon["is_paired"] = is_paired
+    beacon["pairing_duration"] = int(pairing_duration)
+    beacon["last_tracker"] = pos.tracker_label or imei
 
 
 # ============================================================
 # TCP SERVER (Teltonika Devices)
 # ============================================================
-def handle_client(client_socket: socket.socket, address: tuple):
-    """Handle a Teltonika device connection"""
-    imei = None
-    logger.info(f"[TCP] Connection from {address}")
-    
+def _live_data_rows(imei: str, ordered: List[tuple]) -> List[Dict[str, Any]]:
+    """Tracker_Teltonika_Live_Antigravity rows (one per beacon, or one without) for a packet"""
+    rows = []
+    for _, record, _ in ordered:
+        lat = record.get("lat", 0)
+        lng = record.get("lng", 0)
+        speed = record.get("speed", 0)
+        beacons = record.get("beacons", [])
+        if record.get("timestamp"):
+            timestamp_dt = datetime.fromisoformat(record["timestamp"])
+        else:
+            timestamp_dt = datetime.now()
+        raw_log_line = f"{timestamp_dt.strftime('%Y-%m-%d %H:%M:%S')} [INFO] [TCP] {imei}: {len(beacons)} beacons at ({lat:.6f}, {lng:.6f}), Speed: {speed:.1f} km/h"
+        for b in beacons or [{}]:
+            rows.append({
+                "timestamp": timestamp_dt,
+                "imei": imei,
+                "beacon_mac": b.get("mac"),
+                "lat": lat,
+                "lng": lng,
+                "speed": speed,
+                "battery": b.get("battery"),
+                "rssi": b.get("rssi"),
+                "raw_log_line": raw_log_line,
+            })
+    return rows
+
+
+def _read_imei(client_socket: socket.socket, address: tuple) -> Optional[str]:
+    """Receive the IMEI handshake packet; None if it is malformed"""
+    imei_data = client_socket.recv(256)
+    if log_tcp.isEnabledFor(logging.DEBUG):
+        log_tcp.debug("[TCP] Received %d bytes for IMEI: %s", len(imei_data), imei_data[:50].hex())
+
+    if len(imei_data) < 2:
+        log_tcp.warning("[TCP] IMEI packet too short from %s: %d bytes", address, len(imei_data))
+        return None
+    imei_length = struct.unpack(">H", imei_data[0:2])[0]
+
+    if imei_length > 0 and len(imei_data) >= 2 + imei_length:
+        return imei_data[2:2+imei_length].decode('ascii')
+    log_tcp.warning("[TCP] Invalid IMEI from %s: length=%d, data_len=%d", address, imei_length, len(imei_data))
+    return None
+
+
+def handle_client(client_socket: socket.socket, address: tuple, imei: Optional[str] = None):
+    """
+    Handle a Teltonika device connection.
+    imei is set when a front acceptor already read the handshake (multi-worker mode).
+    """
+    log_tcp.info("[TCP] Connection from %s", address)
+    connected = False
+
     try:
         # First, receive IMEI (authentication)
-        imei_data = client_socket.recv(256)
-        logger.info(f"[TCP] Received {len(imei_data)} bytes for IMEI: {imei_data.hex()[:100]}")
-        
-        if len(imei_data) >= 2:
-            imei_length = struct.unpack(">H", imei_data[0:2])[0]
-            logger.info(f"[TCP] IMEI length field: {imei_length}, total bytes: {len(imei_data)}")
-            
-            if imei_length > 0 and len(imei_data) >= 2 + imei_length:
-                imei = imei_data[2:2+imei_length].decode('ascii')
-                logger.info(f"[TCP] Device authenticated: IMEI {imei}")
-                
-                # Send acknowledgment (accept)
-                client_socket.send(b'\x01')
-                
-                # Initialize tracker
-                with data_lock:
-                    if imei not in trackers:
-                        trackers[imei] = {
-                            "label": imei,
-                            "lat": 0,
-                            "lng": 0,
-                            "speed": 0,
-                            "last_update": None,
-                            "beacons": [],
-                        }
-            else:
-                logger.warning(f"[TCP] Invalid IMEI from {address}: length={imei_length}, data_len={len(imei_data)}")
+        if imei is None:
+            imei = _read_imei(client_socket, address)
+            if imei is None:
                 client_socket.send(b'\x00')
                 return
-        else:
-            logger.warning(f"[TCP] IMEI packet too short from {address}: {len(imei_data)} bytes")
-            client_socket.send(b'\x00')
-            return
+        log_tcp.info("[TCP] Device authenticated: IMEI %s", imei)
+        
+        # Send acknowledgment (accept)
+        client_socket.send(b'\x01')
         
+        # Initialize tracker
+        with tracker_locks.lock_for(imei):
+            if imei not in trackers:
+                trackers[imei] = TrackerState(imei)
+                _mark_state_changed(imeis=(imei,))
+        TCP_CONNECTIONS.inc()
+        connected = True
+
         # Receive data packets
         while True:
             try:
@@ -909,89 +1327,92 @@ def handle_client(client_socket: socket.socket, address: tuple):
                 if not data:
                     break
                 
-                # Log raw data for debugging
-                logger.info(f"[TCP] {imei}: Received {len(data)} bytes")
-                
+                trace = log_tcp.isEnabledFor(logging.DEBUG) and _tcp_sampler.hit(imei)
+                if trace:
+                    log_tcp.debug("[TCP] %s: Received %d bytes (1 of %d packets logged)", imei, len(data), trace)
+
                 # Parse CODEC8 packet
+                t0 = time.perf_counter()
                 result = Codec8Parser.parse_packet(data)
-                
+                PARSE_SECONDS.observe(time.perf_counter() - t0)
+                PACKETS.inc()
+                if not result["success"]:
+                    PACKETS_FAILED.inc()
+
                 if result["success"] and result["records"]:
                     num_records = len(result["records"])
-                    # Log IO elements for debugging
-                    for i, rec in enumerate(result["records"]):
-                        io_els = rec.get("io_elements", {})
-                        beacons_in_rec = rec.get("beacons", [])
-                        if io_els or beacons_in_rec:
-                            logger.info(f"[TCP] {imei} Record {i}: IOs={list(io_els.keys())[:10]}, Beacons={len(beacons_in_rec)}")
+                    RECORDS.inc(num_records)
+                    # IO keys per record, on the sampled packets only
+                    if trace:
+                        for i, rec in enumerate(result["records"]):
+                            io_els = rec.get("io_elements", {})
+                            beacons_in_rec = rec.get("beacons", [])
+                            if io_els or beacons_in_rec:
+                                log_tcp.debug("[TCP] %s Record %d: IOs=%s, Beacons=%d", imei, i, list(io_els)[:10], len(beacons_in_rec))
                     
-                    # Process each record
-                    for record in result["records"]:
-                        lat = record.get("lat", 0)
-                        lng = record.get("lng", 0)
-                        speed = record.get("speed", 0)
-                        beacons = record.get("beacons", [])
-                        
-                        # Update tracker data
-                        with data_lock:
-                            trackers[imei]["lat"] = lat
-                            trackers[imei]["lng"] = lng
-                            trackers[imei]["speed"] = speed
-                            trackers[imei]["last_update"] = record.get("timestamp")
-                            trackers[imei]["beacons"] = beacons
-                        
-                        # Process BLE beacons with 60-sec pairing logic
-                        if beacons:
-                            logger.info(f"[TCP] {imei}: {len(beacons)} beacons at ({lat:.6f}, {lng:.6f}), Speed: {speed} km/h")
-                            process_beacons(imei, lat, lng, beacons, tracker_speed=speed)
-                        
-                        # Save tracker to database
-                        if DB_ENABLED:
-                            try:
+                    # One pass per packet under the tracker lock, taken once:
+                    # sort the packet's records by event time through the tracker's
+                    # clock, then collapse them into a single live update (only the
+                    # newest record matters for the live view). A packet older than
+                    # the live state (late / replayed) leaves it, and SQL, alone.
+                    live_record = None
+                    with tracker_locks.lock_for(imei):
+                        clock = tracker_clocks.get(imei)
+                        if clock is None:
+                            clock = tracker_clocks[imei] = EventClock(REORDER_MAX_LATENESS_SEC)
+                        ordered = clock.order((_record_event_time(record), record) for record in result["records"])
+
+                        tracker = trackers[imei]
+                        event_time, record, _ = ordered[-1]
+                        if tracker.event_time is None or event_time >= tracker.event_time:
+                            live_record = record
+                            lat = record.get("lat", 0)
+                            lng = record.get("lng", 0)
+                            tracker.lat = lat
+                            tracker.lng = lng
+                            if lat or lng:  # 0,0 = no GPS fix
+                                tracker_grid.update(imei, lat, lng)
+                                tracker.zone = _tag_zone("tracker", imei, lat, lng, event_time)
+                            tracker.speed = record.get("speed", 0)
+                            tracker.last_update = record.get("timestamp")
+                            tracker.event_time = event_time
+                            tracker.beacons = record.get("beacons", [])
+                            _mark_state_changed(imeis=(imei,))
+
+                    late_count = sum(1 for _, _, late in ordered if late)
+                    if late_count:
+                        log_tcp.info("[TCP] %s: %d late records (behind watermark) -> history only", imei, late_count)
+
+                    # Pairing state machine still sees every (non-late) record, in order
+                    beacon_records = [
+                        (event_time, record.get("lat", 0), record.get("lng", 0), record.get("speed", 0), record.get("beacons"))
+                        for event_time, record, late in ordered
+                        if record.get("beacons") and not late
+                    ]
+                    touched_macs: List[str] = []
+                    if beacon_records:
+                        detections = sum(len(r[4]) for r in beacon_records)
+                        BEACONS_TCP.inc(detections)
+                        if trace:
+                            log_tcp.debug("[TCP] %s: %d beacon detections in %d records", imei, detections, len(beacon_records))
+                        _wait_hydrated()
+                        touched_macs = process_beacon_records(imei, beacon_records)
+                    _publish_worker_state(imei, touched_macs)
+
+                    # Live row only if the live state moved; history rows for every record
+                    if DB_ENABLED:
+                        try:
+                            if live_record is not None:
                                 db_helper.update_tracker(
                                     tracker_id=hash(imei) % 100000,
                                     label=imei,
-                                    lat=lat,
-                                    lng=lng,
-                                    speed=speed
+                                    lat=live_record.get("lat", 0),
+                                    lng=live_record.get("lng", 0),
+                                    speed=live_record.get("speed", 0),
                                 )
-                                
-                                # Insert direct live data
-                                timestamp_dt = None
-                                if record.get("timestamp"):
-                                    timestamp_dt = datetime.fromisoformat(record["timestamp"])
-                                else:
-                                    timestamp_dt = datetime.now()
-                                    
-                                raw_log_line = f"{timestamp_dt.strftime('%Y-%m-%d %H:%M:%S')} [INFO] [TCP] {imei}: {len(beacons)} beacons at ({lat:.6f}, {lng:.6f}), Speed: {speed:.1f} km/h"
-                                
-                                if beacons:
-                                    for b in beacons:
-                                        db_helper.insert_tracker_live_data(
-                                            timestamp=timestamp_dt,
-                                            imei=imei,
-                                            beacon_mac=b.get("mac"),
-                                            lat=lat,
-                                            lng=lng,
-                                            speed=speed,
-                                            battery=b.get("battery"),
-                                            rssi=b.get("rssi"),
-                                            raw_log_line=raw_log_line
-                                        )
-                                else:
-                                    db_helper.insert_tracker_live_data(
-                                        timestamp=timestamp_dt,
-                                        imei=imei,
-                                        beacon_mac=None,
-                                        lat=lat,
-                                        lng=lng,
-                                        speed=speed,
-                                        battery=None,
-                                        rssi=None,
-                                        raw_log_line=raw_log_line
-                                    )
-                                    
-                            except Exception as e:
-                                logger.error(f"DB tracker save error: {e}")
+                            db_helper.insert_tracker_live_data_batch(_live_data_rows(imei, ordered))
+                        except Exception as e:
+                            log_db.error("DB tracker save error: %s", e)
                     
                     # Send acknowledgment (number of records received)
                     ack = struct.pack(">I", num_records)
@@ -1000,40 +1421,288 @@ def handle_client(client_socket: socket.socket, address: tuple):
             except socket.timeout:
                 continue
             except Exception as e:
-                logger.error(f"[TCP] Error receiving data: {e}")
+                log_tcp.error("[TCP] Error receiving data: %s", e)
                 break
                 
     except Exception as e:
-        logger.error(f"[TCP] Client error: {e}")
+        log_tcp.error("[TCP] Client error: %s", e)
     finally:
+        if connected:
+            TCP_CONNECTIONS.dec()
         client_socket.close()
-        logger.info(f"[TCP] Connection closed: {imei or address}")
+        log_tcp.info("[TCP] Connection closed: %s", imei or address)
 
 
-def tcp_server():
+def tcp_server(reuse_port: bool = False):
     """Run TCP server for Teltonika devices"""
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # Several worker processes share the port; the kernel spreads connections
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     server.bind((TCP_HOST, TCP_PORT))
     server.listen(10)
     
-    logger.info(f"[TCP] Teltonika server listening on {TCP_HOST}:{TCP_PORT}")
+    log_tcp.info("[TCP] Teltonika server listening on %s:%d", TCP_HOST, TCP_PORT)
     
     while True:
         try:
             client, address = server.accept()
             client.settimeout(300)  # 5 minute timeout
-            thread = threading.Thread(target=handle_client, args=(client, address))
+            thread = threading.Thread(target=handle_client, args=(client, address), name=f"tcp-{address[0]}:{address[1]}")
             thread.daemon = True
             thread.start()
         except Exception as e:
-            logger.error(f"[TCP] Accept error: {e}")
+            log_tcp.error("[TCP] Accept error: %s", e)
+
+
+# ============================================================
+# MULTI-WORKER MODE
+# ============================================================
+# BROKER_WORKERS > 1 spreads device connections over worker processes so CODEC8
+# parsing and pairing use more than one core:
+#   - "imei" sharding (default, works everywhere): this process accepts on
+#     TCP_PORT, reads the IMEI handshake and hands the socket to worker
+#     crc32(imei) % N, so a tracker's state always lives in the same worker.
+#   - "reuseport" (Linux): every worker binds TCP_PORT with SO_REUSEPORT and the
+#     kernel balances connections; a reconnect may land on another worker.
+# Workers do their own SQL writes and publish every tracker / BLE record they
+# change to an outbox queue; this process merges them into its in-memory state
+# (newest last_seen wins per MAC), which is what /data and the other HTTP
+# endpoints read. BLE records changed here (manual set-position / set-all-home,
+# RUTX11 webhook and multilateration) go the other way over each worker's inbox
+# Pipe, so a worker never pairs against a position the operator has replaced.
+# Known limitation: pairing timers (ble_pairing) are per worker. A beacon handed
+# between trackers served by different workers has two independent timers, and
+# each worker applies its own pairing delay before publishing the handover.
+BROKER_WORKERS = max(1, int(os.environ.get("BROKER_WORKERS", "1")))
+BROKER_SHARDING = os.environ.get("BROKER_SHARDING", "imei").lower()
+
+# Set in worker processes only: queue of state updates for the HTTP process
+_state_outbox = None
+# Set in the HTTP process only: (lock, Pipe sender) per worker inbox
+_worker_inboxes: List[tuple] = []
+
+
+def _publish_worker_state(imei: str, macs: List[str]) -> None:
+    """Worker side: send copies of a tracker and the BLE records it just touched"""
+    if _state_outbox is None:
+        return
+    with tracker_locks.lock_for(imei):
+        tracker = trackers.get(imei)
+        tracker = tracker.copy() if tracker is not None else None
+    with ble_locks.hold(macs):
+        ble = [ble_positions[mac].copy() for mac in macs if mac in ble_positions]
+    _state_outbox.put((tracker, ble))
+
+
+def _merge_worker_state(tracker: Optional[TrackerState], ble: List[BleState]) -> None:
+    """HTTP side: apply one worker update to the aggregated state"""
+    if tracker is not None:
+        imei = tracker.imei
+        with tracker_locks.lock_for(imei):
+            current = trackers.get(imei)
+            if current is None or current.event_time is None or (
+                tracker.event_time is not None and tracker.event_time >= current.event_time
+            ):
+                trackers[imei] = tracker
+                if tracker.lat or tracker.lng:
+                    tracker_grid.update(imei, tracker.lat, tracker.lng)
+                _mark_state_changed(imeis=(imei,))
+    for pos in ble:
+        mac = pos.mac
+        with ble_locks.lock_for(mac):
+            current = ble_positions.get(mac)
+            if current is None or current.last_seen is None or (
+                pos.last_seen is not None and pos.last_seen >= current.last_seen
+            ):
+                ble_positions[mac] = pos
+                _index_ble_tracker(mac, pos.tracker_imei)
+                ble_grid.update(mac, pos.lat, pos.lng)   # zone already tagged by the worker
+                zone_tracker.seed(f"ble:{mac}", pos.zone)
+                _mark_state_changed(macs=(mac,))
+
+
+def _send_to_worker(worker: int, message: tuple) -> None:
+    """HTTP side: send one message to a worker inbox (request threads share the Pipe)"""
+    lock, sender = _worker_inboxes[worker]
+    with lock:
+        sender.send(message)
+
+
+def _push_to_workers(macs: Iterable[str]) -> None:
+    """HTTP side: send BLE records changed in this process to every worker"""
+    if not _worker_inboxes:
+        return
+    macs = list(macs)
+    with ble_locks.hold(macs):
+        ble = [ble_positions[mac].copy() for mac in macs if mac in ble_positions]
+    if not ble:
+        return
+    for worker in range(len(_worker_inboxes)):
+        try:
+            _send_to_worker(worker, ("ble", ble))
+        except Exception as e:
+            log_worker.error("[WORKER] Push to worker %s failed: %s", worker, e)
+
+
+def _apply_pushed_ble(ble: List[BleState]) -> None:
+    """Worker side: adopt BLE records set by the HTTP process (newest last_seen wins)"""
+    for pos in ble:
+        mac = pos.mac
+        with ble_locks.lock_for(mac):
+            current = ble_positions.get(mac)
+            if current is not None and current.last_seen is not None and (
+                pos.last_seen is None or pos.last_seen < current.last_seen
+            ):
+                continue
+            ble_positions[mac] = pos
+            _index_ble_tracker(mac, pos.tracker_imei)
+            _index_ble_position(mac, emit=False)   # the HTTP process logged the zone change
+            _mark_state_changed(macs=(mac,))
+
+
+def worker_state_merger(outbox) -> None:
+    """HTTP side background thread: drain the shared worker outbox"""
+    while True:
+        try:
+            tracker, ble = outbox.get()
+            _merge_worker_state(tracker, ble)
+        except Exception as e:
+            log_worker.error("[WORKER] State merge error: %s", e)
+
+
+def _worker_bootstrap(index: int, outbox) -> None:
+    global _state_outbox, _hydrate_deadline
+    _state_outbox = outbox
+    log_worker.info("[WORKER %s] Started (pid %s)", index, os.getpid())
+    # Pairing timers live in the workers: each keeps its own checkpoint
+    worker_checkpoint = f"{CHECKPOINT_PATH}.w{index}"
+    restore_checkpoint(worker_checkpoint)
+    start_checkpointing(worker_checkpoint)
+    # Same hydration as the single-process path (definitions, stored positions,
+    # scanners, then the definitions watcher); beacons wait for it in handle_client
+    _hydrate_deadline = time.monotonic() + HYDRATE_WAIT_SEC
+    threading.Thread(target=hydrate_in_background, daemon=True, name="sql-hydrate").start()
+    if DB_ENABLED:
+        threading.Thread(target=zone_event_writer, daemon=True).start()
+
+
+def worker_inbox_loop(index: int, inbox) -> None:
+    """Worker side: sockets handed over by the acceptor and BLE updates from the HTTP process"""
+    while True:
+        message = inbox.recv()
+        try:
+            if message[0] == "conn":
+                _, client, address, imei = message
+                client.settimeout(300)  # 5 minute timeout
+                thread = threading.Thread(target=handle_client, args=(client, address, imei), name=f"tcp-{address[0]}:{address[1]}")
+                thread.daemon = True
+                thread.start()
+            elif message[0] == "ble":
+                _apply_pushed_ble(message[1])
+        except Exception as e:
+            log_worker.error("[WORKER %s] Inbox error: %s", index, e)
+
+
+def worker_main(index: int, inbox, outbox, geofence_zones) -> None:
+    """Worker process ("imei" sharding): serve sockets handed over by the acceptor"""
+    global geofences
+    geofences = GeofenceIndex(geofence_zones)
+    _worker_bootstrap(index, outbox)
+    worker_inbox_loop(index, inbox)
+
+
+def reuseport_worker_main(index: int, inbox, outbox, geofence_zones) -> None:
+    """Worker process ("reuseport" sharding): accept on the shared port directly"""
+    global geofences
+    geofences = GeofenceIndex(geofence_zones)
+    _worker_bootstrap(index, outbox)
+    threading.Thread(target=worker_inbox_loop, args=(index, inbox), daemon=True).start()
+    tcp_server(reuse_port=True)
+
+
+def _hand_over(client: socket.socket, address: tuple) -> None:
+    """Acceptor thread per connection: read the IMEI, pass the socket to its worker"""
+    try:
+        client.settimeout(30)
+        imei = _read_imei(client, address)
+        if imei is None:
+            client.send(b'\x00')
+            return
+        # Pipe.send pickles here, duplicating the socket for the worker,
+        # so our copy can be closed right after
+        worker = zlib.crc32(imei.encode("ascii")) % len(_worker_inboxes)
+        _send_to_worker(worker, ("conn", client, address, imei))
+    except Exception as e:
+        log_tcp.error("[TCP] Handover error for %s: %s", address, e)
+    finally:
+        client.close()
+
+
+def tcp_acceptor() -> None:
+    """
+    Front acceptor ("imei" sharding): each connection's IMEI handshake runs on
+    its own short-lived thread, so a slow or silent client never stalls accept()
+    """
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((TCP_HOST, TCP_PORT))
+    server.listen(10)
+    log_tcp.info("[TCP] Acceptor listening on %s:%s for %s workers", TCP_HOST, TCP_PORT, len(_worker_inboxes))
+
+    while True:
+        try:
+            client, address = server.accept()
+            thread = threading.Thread(target=_hand_over, args=(client, address), name=f"imei-{address[0]}:{address[1]}")
+            thread.daemon = True
+            thread.start()
+        except Exception as e:
+            log_tcp.error("[TCP] Acceptor error: %s", e)
+
+
+def start_workers() -> None:
+    """Spawn BROKER_WORKERS worker processes and the threads that feed / drain them"""
+    ctx = multiprocessing.get_context("spawn")
+    outbox = ctx.Queue()
+    zones = list(geofences.zones.values())
+    reuseport = BROKER_SHARDING == "reuseport" and hasattr(socket, "SO_REUSEPORT")
+    target = reuseport_worker_main if reuseport else worker_main
+    for i in range(BROKER_WORKERS):
+        inbox, sender = ctx.Pipe(duplex=False)
+        ctx.Process(target=target, args=(i, inbox, outbox, zones), daemon=True).start()
+        _worker_inboxes.append((threading.Lock(), sender))
+    if not reuseport:
+        threading.Thread(target=tcp_acceptor, daemon=True).start()
+    threading.Thread(target=worker_state_merger, args=(outbox,), daemon=True).start()
+    log_worker.info("[WORKER] %s workers started (%s sharding)", BROKER_WORKERS, BROKER_SHARDING)
 
 
 # ============================================================
 # HTTP API (Flask)
 # ============================================================
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
+
+# Serialized /data entries, reused while a tracker row / BLE entry is unchanged
+row_fragments = FragmentCache()
+ble_fragments = FragmentCache()
+
+@app.before_request
+def _start_request_timer():
+    g.request_t0 = time.perf_counter()
+
+
+@app.after_request
+def _observe_request(response):
+    t0 = g.get("request_t0")
+    if t0 is not None and request.endpoint:
+        HTTP_SECONDS.labels(request.endpoint).observe(time.perf_counter() - t0)
+        size = response.calculate_content_length()
+        if size is not None:
+            HTTP_BYTES.labels(request.endpoint).observe(size)
+    return response
+
 
 @app.after_request
 def add_cors(response):
@@ -1057,202 +1726,453 @@ def index():
 
 @app.get("/health")
 def health():
-    return jsonify({"status": "ok", "db_enabled": DB_ENABLED})
+    """Liveness ("status") plus readiness: "ready" once SQL hydration has finished"""
+    return jsonify({
+        "status": "ok",
+        "db_enabled": DB_ENABLED,
+        "ready": startup_state["ready"],
+        "startup": startup_state,
+    })
+
+
+REGISTRY.gauge_callback("teltonika_trackers", "Trackers in memory", lambda: len(trackers))
+REGISTRY.gauge_callback("teltonika_ble_positions", "BLE positions in memory", lambda: len(ble_positions))
+REGISTRY.gauge_callback("teltonika_state_version", "State mutations since start", lambda: state_version)
+REGISTRY.gauge_callback("teltonika_ble_definitions", "Known BLE definitions (current version)", lambda: len(ble_registry.current))
+REGISTRY.gauge_callback("teltonika_ble_definitions_reloads", "BLE definitions swaps since start", lambda: ble_registry.reloads)
+REGISTRY.gauge_callback(
+    "db_write_queue_depth", "Items waiting for a background SQL writer",
+    lambda: {"rutx11": rutx11_writer.pending(), "zone_events": len(_zone_events)},
+    label="writer",
+)
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+# /debug/profile, /debug/threads, /debug/cprofile (only with DEBUG_ENDPOINTS=1)
+register_debug_routes(app)
+
+
+# Viewport-filtered /data: below this zoom, return counts per cell instead of markers
+CLUSTER_MAX_ZOOM = 15
+CLUSTER_CELL_PX = 64    # on-screen size of one aggregation cell
+
+
+def _cluster_cell_deg(zoom: float) -> float:
+    """Degrees of longitude spanned by CLUSTER_CELL_PX at a web-mercator zoom level"""
+    return 360.0 / (256 * 2 ** zoom) * CLUSTER_CELL_PX
+
+
+def _in_bbox(lat: Optional[float], lng: Optional[float], bbox: tuple) -> bool:
+    if lat is None or lng is None:
+        return False
+    return bbox[1] <= lat <= bbox[3] and bbox[0] <= lng <= bbox[2]
 
 
 @app.get("/data")
 def data():
-    """Return data in the same format as the Navixy API for map compatibility"""
-    with data_lock:
-        rows = []
-        
-        for imei, tracker in trackers.items():
-            # Get all beacons currently detected by this tracker
-            tracker_beacons = []
-            for mac, pos in ble_positions.items():
-                if pos.get("tracker_imei") == imei:
-                    ble_info = ble_definitions.get(mac, {})
-                    tracker_beacons.append({
-                        "mac": mac,
-                        "name": ble_info.get("name", mac[:8]),
-                        "category": ble_info.get("category", "Unknown"),
-                        "beaconType": ble_info.get("type", "eye_beacon"),
-                        "sn": ble_info.get("sn", ""),
-                        "battery": pos.get("battery"),
-                        "rssi": pos.get("rssi"),
-                        "magnet_sensors": {"status": pos.get("magnet_status")},
-                        "last_seen": pos.get("last_update"),
-                        "lat": pos.get("lat"),
-                        "lng": pos.get("lng"),
-                        "hostTrackerId": imei,
-                        "hostTrackerLabel": tracker.get("label", imei),
-                        "is_paired": pos.get("is_paired", False),
-                        "pairing_duration": pos.get("pairing_duration", 0),
-                    })
-            
-            row = {
-                "tracker_id": hash(imei) % 100000,
-                "label": tracker.get("label", imei),
-                "imei": imei,
-                "lat": tracker.get("lat"),
-                "lng": tracker.get("lng"),
-                "speed": tracker.get("speed"),
-                "last_update": tracker.get("last_update"),
-                "connection_status": "active" if tracker.get("last_update") else "unknown",
-                "beacons": tracker_beacons,
-            }
-            rows.append(row)
-        
-        # Return ALL known BLEs (from definitions + stored positions)
-        # This ensures beacons NEVER disappear from the map
-        all_ble = {}
-        
-        # First, add ALL known BLE definitions (even if no position yet)
-        for mac, ble_info in ble_definitions.items():
-            all_ble[mac] = {
-                "lat": None,  # Will be updated if we have a position
-                "lng": None,
-                "last_tracker_id": None,
-                "last_tracker_label": None,
-                "last_update": None,
-                "is_paired": False,
-                "pairing_duration": 0,
-                "battery": None,
-                "rssi": None,
+    """
+    Return data in the same format as the Navixy API for map compatibility.
+
+    Optional viewport: ?bbox=minLng,minLat,maxLng,maxLat[&zoom=N]
+    Only trackers / BLE positions inside the box are returned. Below
+    CLUSTER_MAX_ZOOM the response carries per-cell counts ("clusters")
+    instead of individual markers.
+    """
+    from flask import request
+    bbox = _parse_bbox(request.args.get("bbox"))
+    try:
+        zoom = float(request.args["zoom"]) if "zoom" in request.args else None
+    except ValueError:
+        zoom = None
+
+    if bbox is not None and zoom is not None and zoom < CLUSTER_MAX_ZOOM:
+        cell_deg = _cluster_cell_deg(zoom)
+        return jsonify({
+            "success": True,
+            "rows": [],
+            "ble_positions": {},
+            "clusters": {
+                "trackers": tracker_grid.aggregate(*bbox, cell_deg),
+                # Known beacons only, like the detailed view
+                "ble": ble_grid.aggregate(*bbox, cell_deg, only=ble_registry.current),
+            },
+            "bbox": list(bbox),
+            "zoom": zoom,
+            "source": "teltonika_direct",
+            "db_enabled": DB_ENABLED,
+        })
+
+    snap = state_snapshot()
+    defs = ble_registry.current
+    rows = []
+    if bbox is not None:
+        tracker_keys = [key for key, _, _ in tracker_grid.bbox(*bbox)]
+        ble_in_view = {key for key, _, _ in ble_grid.bbox(*bbox)}
+    else:
+        tracker_keys = snap.trackers.keys()
+        ble_in_view = None
+
+    for imei in tracker_keys:
+        tracker = snap.trackers.get(imei)
+        if tracker is None:
+            continue
+        # Get all beacons currently detected by this tracker
+        beacon_rows = []
+        for mac in sorted(snap.tracker_beacons.get(imei, ())):
+            pos = snap.ble_positions.get(mac)
+            if pos is None:
+                continue
+            ble_info = defs.get(mac, {})
+            beacon_rows.append({
+                "mac": mac,
                 "name": ble_info.get("name", mac[:8]),
                 "category": ble_info.get("category", "Unknown"),
-                "type": ble_info.get("type", "eye_beacon"),
+                "beaconType": ble_info.get("type", "eye_beacon"),
                 "sn": ble_info.get("sn", ""),
-            }
+                "battery": pos.battery,
+                "rssi": pos.rssi,
+                "rssi_smoothed": pos.rssi_smoothed,
+                "distance_m": pos.distance_m,
+                "magnet_sensors": {"status": pos.magnet_status},
+                "last_seen": pos.last_update,
+                "lat": pos.lat,
+                "lng": pos.lng,
+                "hostTrackerId": imei,
+                "hostTrackerLabel": tracker.label,
+                "is_paired": pos.is_paired,
+                "pairing_duration": pos.pairing_duration,
+            })
+            
+        row = {
+            "tracker_id": hash(imei) % 100000,
+            "label": tracker.label,
+            "imei": imei,
+            "lat": tracker.lat,
+            "lng": tracker.lng,
+            "speed": tracker.speed,
+            "last_update": tracker.last_update,
+            "connection_status": "active" if tracker.last_update else "unknown",
+            "zone": tracker.zone,
+            "beacons": beacon_rows,
+        }
+        rows.append(row)
         
-        # Then, update with stored positions (in-memory - most recent)
-        # Only include known BLE definitions — ignore WiFi APs and unknown devices
-        for mac, pos in ble_positions.items():
-            if mac not in ble_definitions:
-                continue  # Skip unknown MACs (WiFi APs, etc.)
-            ble_info = ble_definitions.get(mac, {})
-            all_ble[mac] = {
-                "lat": pos.get("lat"),  # Original position - no offset
-                "lng": pos.get("lng"),
-                "last_tracker_id": pos.get("tracker_imei"),
-                "last_tracker_label": pos.get("tracker_label"),
-                "last_update": pos.get("last_update"),
-                "is_paired": pos.get("is_paired", False),
-                "pairing_duration": pos.get("pairing_duration", 0),
-                "battery": pos.get("battery"),
-                "rssi": pos.get("rssi"),
-                "name": ble_info.get("name", pos.get("name", mac[:8])),
-                "category": ble_info.get("category", pos.get("category", "Unknown")),
-                "type": ble_info.get("type", pos.get("type", "eye_beacon")),
-                "sn": ble_info.get("sn", ""),
-            }
+    # Return ALL known BLEs (from definitions + stored positions)
+    # This ensures beacons NEVER disappear from the map
+    all_ble = {}
         
-        # Also fetch from database for any positions we might have missed in memory
-        if DB_ENABLED:
-            try:
-                db_positions = db_helper.get_all_ble_positions()
-                for mac, db_pos in db_positions.items():
-                    # Only use DB position for KNOWN beacons and only when memory has no position
-                    if mac not in ble_definitions:
-                        continue  # Skip WiFi APs and unknown MACs stored in DB
-                    if mac not in ble_positions or ble_positions[mac].get("lat") is None:
-                        ble_info = ble_definitions.get(mac, {})
-                        all_ble[mac] = {
-                            "lat": db_pos.get("lat"),
-                            "lng": db_pos.get("lng"),
-                            "last_tracker_id": db_pos.get("last_tracker_id"),
-                            "last_tracker_label": db_pos.get("last_tracker_label"),
-                            "last_update": db_pos.get("last_update"),
-                            "is_paired": db_pos.get("is_paired", False),
-                            "pairing_duration": db_pos.get("pairing_duration_sec", 0),
-                            "battery": db_pos.get("battery_percent"),
-                            "rssi": None,
-                            "name": ble_info.get("name", db_pos.get("name", mac[:8])),
-                            "category": ble_info.get("category", db_pos.get("category", "Unknown")),
-                            "type": ble_info.get("type", db_pos.get("type", "eye_beacon")),
-                            "sn": ble_info.get("sn", ""),
-                        }
-            except Exception as e:
-                logger.warning(f"[DB] Could not fetch positions: {e}")
+    # First, add ALL known BLE definitions (even if no position yet; not in viewport mode)
+    for mac, ble_info in (defs.items() if bbox is None else ()):
+        all_ble[mac] = {
+            "lat": None,  # Will be updated if we have a position
+            "lng": None,
+            "last_tracker_id": None,
+            "last_tracker_label": None,
+            "last_update": None,
+            "is_paired": False,
+            "pairing_duration": 0,
+            "battery": None,
+            "rssi": None,
+            "name": ble_info.get("name", mac[:8]),
+            "category": ble_info.get("category", "Unknown"),
+            "type": ble_info.get("type", "eye_beacon"),
+            "sn": ble_info.get("sn", ""),
+        }
         
-        # Log what we're returning
-        ble_with_pos = sum(1 for b in all_ble.values() if b.get("lat") is not None)
-        logger.debug(f"Returning {len(all_ble)} BLEs ({ble_with_pos} with positions)")
+    # Then, update with stored positions (in-memory - most recent)
+    # Only include known BLE definitions — ignore WiFi APs and unknown devices
+    for mac, pos in snap.ble_positions.items():
+        if mac not in defs:
+            continue  # Skip unknown MACs (WiFi APs, etc.)
+        if ble_in_view is not None and mac not in ble_in_view:
+            continue
+        ble_info = defs.get(mac, {})
+        all_ble[mac] = {
+            "lat": pos.lat,  # Original position - no offset
+            "lng": pos.lng,
+            "last_tracker_id": pos.tracker_imei,
+            "last_tracker_label": pos.tracker_label,
+            "last_update": pos.last_update,
+            "is_paired": pos.is_paired,
+            "pairing_duration": pos.pairing_duration,
+            "battery": pos.battery,
+            "rssi": pos.rssi,
+            "name": ble_info.get("name", pos.name or mac[:8]),
+            "category": ble_info.get("category", pos.category or "Unknown"),
+            "type": ble_info.get("type", "eye_beacon"),
+            "sn": ble_info.get("sn", ""),
+            "zone": pos.zone,
+            "uncertainty_m": pos.uncertainty_m,
+            "rssi_smoothed": pos.rssi_smoothed,
+            "distance_m": pos.distance_m,
+        }
         
-        return jsonify({
-            "success": True,
-            "rows": rows,
-            "ble_positions": all_ble,
-            "source": "teltonika_direct",
-            "db_enabled": DB_ENABLED,
-            "ble_count": len(all_ble),
-            "ble_with_position": ble_with_pos,
-        })
+    # Also fetch from database for any positions we might have missed in memory
+    if DB_ENABLED:
+        try:
+            db_positions = db_helper.get_all_ble_positions()
+            for mac, db_pos in db_positions.items():
+                # Only use DB position for KNOWN beacons and only when memory has no position
+                if mac not in defs:
+                    continue  # Skip WiFi APs and unknown MACs stored in DB
+                if mac not in snap.ble_positions or snap.ble_positions[mac].lat is None:
+                    if bbox is not None and not _in_bbox(db_pos.get("lat"), db_pos.get("lng"), bbox):
+                        continue
+                    ble_info = defs.get(mac, {})
+                    all_ble[mac] = {
+                        "lat": db_pos.get("lat"),
+                        "lng": db_pos.get("lng"),
+                        "last_tracker_id": db_pos.get("last_tracker_id"),
+                        "last_tracker_label": db_pos.get("last_tracker_label"),
+                        "last_update": db_pos.get("last_update"),
+                        "is_paired": db_pos.get("is_paired", False),
+                        "pairing_duration": db_pos.get("pairing_duration_sec", 0),
+                        "battery": db_pos.get("battery_percent"),
+                        "rssi": None,
+                        "name": ble_info.get("name", db_pos.get("name", mac[:8])),
+                        "category": ble_info.get("category", db_pos.get("category", "Unknown")),
+                        "type": ble_info.get("type", db_pos.get("type", "eye_beacon")),
+                        "sn": ble_info.get("sn", ""),
+                    }
+        except Exception as e:
+            log_db.warning("[DB] Could not fetch positions: %s", e)
+        
+    # Log what we're returning
+    ble_with_pos = sum(1 for b in all_ble.values() if b.get("lat") is not None)
+    logger.debug("Returning %s BLEs (%s with positions)", len(all_ble), ble_with_pos)
+        
+    row_fragments.retain(snap.trackers.keys())
+    if bbox is None:
+        ble_fragments.retain(all_ble.keys())
+    response = {
+        "success": True,
+        "rows": [row_fragments.get(row["imei"], row) for row in rows],
+        "ble_positions": {mac: ble_fragments.get(mac, entry) for mac, entry in all_ble.items()},
+        "source": "teltonika_direct",
+        "db_enabled": DB_ENABLED,
+        "ble_count": len(all_ble),
+        "ble_with_position": ble_with_pos,
+    }
+    if bbox is not None:
+        response["bbox"] = list(bbox)
+        response["zoom"] = zoom
+    return jsonify(response)
 
 
 @app.get("/ble/positions")
 def get_ble_positions():
     """Get all BLE positions"""
-    with data_lock:
-        return jsonify({
-            "success": True,
-            "positions": ble_positions,
-            "count": len(ble_positions),
-        })
+    snap = state_snapshot()
+    return jsonify({
+        "success": True,
+        "positions": snap.ble_positions,
+        "count": len(snap.ble_positions),
+    })
+
+
+@app.get("/ble/definitions")
+def get_ble_definitions():
+    """BLE definitions this process is matching against, with their version stamp"""
+    defs = ble_registry.current
+    return jsonify({
+        "success": True,
+        "version": defs.version,
+        "reloads": ble_registry.reloads,
+        "count": len(defs),
+        "definitions": defs.to_dict(),
+    })
+
+
+@app.route("/ble/definitions/reload", methods=["POST"])
+def reload_ble_definitions():
+    """Reload BLE definitions from SQL now instead of waiting for the next stamp poll"""
+    if not DB_ENABLED:
+        return jsonify({"success": False, "error": "Database not available"}), 503
+    ok = reload_definitions()
+    return jsonify({"success": ok, "version": ble_registry.version, "count": len(ble_registry.current)})
 
 
 @app.get("/trackers")
 def get_trackers():
     """Get all connected trackers"""
-    with data_lock:
-        return jsonify({
-            "success": True,
-            "trackers": trackers,
-            "count": len(trackers),
-        })
+    snap = state_snapshot()
+    return jsonify({
+        "success": True,
+        "trackers": snap.trackers,
+        "count": len(snap.trackers),
+    })
 
 
 @app.get("/api/trackers")
 def api_get_trackers():
     """Get all connected trackers (API endpoint for troubleshooting)"""
-    with data_lock:
-        tracker_list = []
-        for imei, data in trackers.items():
-            tracker_list.append({
-                "imei": imei,
-                "lat": data.get("lat"),
-                "lng": data.get("lng"),
-                "speed": data.get("speed", 0),
-                "heading": data.get("heading", 0),
-                "timestamp": data.get("timestamp"),
-                "beacons": data.get("beacons", [])
-            })
-        return jsonify(tracker_list)
+    snap = state_snapshot()
+    tracker_list = []
+    for imei, tracker in snap.trackers.items():
+        tracker_list.append({
+            "imei": imei,
+            "lat": tracker.lat,
+            "lng": tracker.lng,
+            "speed": tracker.speed,
+            "heading": 0,
+            "timestamp": tracker.last_update,
+            "beacons": tracker.beacons,
+        })
+    return jsonify(tracker_list)
 
 
 @app.get("/api/ble")
 def api_get_ble():
     """Get all BLE assets (API endpoint for troubleshooting)"""
-    with data_lock:
-        ble_list = []
+    snap = state_snapshot()
+    defs = ble_registry.current
+    ble_list = []
         
-        # Get all BLE positions
-        for mac, pos in ble_positions.items():
-            ble_info = ble_definitions.get(mac, {})
-            ble_list.append({
-                "mac": mac,
-                "name": ble_info.get("name", mac[:8]),
-                "category": ble_info.get("category", "Unknown"),
-                "lat": pos.get("lat"),
-                "lng": pos.get("lng"),
-                "tracker_imei": pos.get("tracker_imei"),
-                "last_update": pos.get("last_update"),
-                "is_paired": pos.get("is_paired", False),
-                "battery": pos.get("battery"),
-                "rssi": pos.get("rssi")
-            })
+    # Get all BLE positions
+    for mac, pos in snap.ble_positions.items():
+        ble_info = defs.get(mac, {})
+        ble_list.append({
+            "mac": mac,
+            "name": ble_info.get("name", mac[:8]),
+            "category": ble_info.get("category", "Unknown"),
+            "lat": pos.lat,
+            "lng": pos.lng,
+            "tracker_imei": pos.tracker_imei,
+            "last_update": pos.last_update,
+            "is_paired": pos.is_paired,
+            "battery": pos.battery,
+            "rssi": pos.rssi,
+        })
         
-        return jsonify({"ble_assets": ble_list})
+    return jsonify({"ble_assets": ble_list})
+
+
+def _nearby_entry(kind: str, key: str, snap: StateSnapshot) -> Optional[Dict[str, Any]]:
+    """Result row for a spatial query hit (None if it vanished since the index lookup)"""
+    if kind == "ble":
+        pos = snap.ble_positions.get(key)
+        if pos is None or pos.lat is None:
+            return None
+        ble_info = ble_registry.current.get(key, {})
+        return {
+            "type": "ble",
+            "mac": key,
+            "name": ble_info.get("name", pos.name or key[:8]),
+            "category": ble_info.get("category", pos.category or "Unknown"),
+            "lat": pos.lat,
+            "lng": pos.lng,
+            "tracker_imei": pos.tracker_imei,
+            "last_update": pos.last_update,
+            "is_paired": pos.is_paired,
+            "zone": pos.zone,
+        }
+    tracker = snap.trackers.get(key)
+    if tracker is None:
+        return None
+    return {
+        "type": "tracker",
+        "imei": key,
+        "label": tracker.label,
+        "lat": tracker.lat,
+        "lng": tracker.lng,
+        "speed": tracker.speed,
+        "last_update": tracker.last_update,
+        "zone": tracker.zone,
+    }
+
+
+def _spatial_grids(kind: str) -> List[tuple]:
+    """[(kind, grid), ...] selected by ?type=ble|tracker|all"""
+    grids = [("ble", ble_grid), ("tracker", tracker_grid)]
+    return [g for g in grids if kind in ("all", g[0])]
+
+
+@app.get("/api/nearby")
+def api_nearby():
+    """
+    Trackers and BLE assets within a radius of a point, nearest first.
+
+    GET /api/nearby?lat=32.0&lng=34.87&radius=100[&type=ble|tracker|all]
+    radius is in meters (default 100, max 5000).
+    """
+    from flask import request
+    try:
+        lat = float(request.args["lat"])
+        lng = float(request.args["lng"])
+        radius = min(float(request.args.get("radius", 100)), 5000.0)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"success": False, "error": "lat, lng (and optional radius) must be numbers"}), 400
+    kind = request.args.get("type", "all")
+
+    snap = state_snapshot()
+    results = []
+    for grid_kind, grid in _spatial_grids(kind):
+        for key, dist in grid.nearby(lat, lng, radius):
+            entry = _nearby_entry(grid_kind, key, snap)
+            if entry is not None:
+                entry["distance_m"] = round(dist, 1)
+                results.append(entry)
+    results.sort(key=lambda e: e["distance_m"])
+    return jsonify({"success": True, "lat": lat, "lng": lng, "radius": radius, "count": len(results), "results": results})
+
+
+def _parse_bbox(value: Optional[str]) -> Optional[tuple]:
+    """'minLng,minLat,maxLng,maxLat' -> tuple of floats (None if absent/invalid)"""
+    if not value:
+        return None
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(v) for v in value.split(","))
+    except ValueError:
+        return None
+    if min_lng > max_lng or min_lat > max_lat:
+        return None
+    return min_lng, min_lat, max_lng, max_lat
+
+
+@app.get("/api/zones")
+def api_zones():
+    """Loaded geofence zones with the trackers / BLE assets currently inside each"""
+    snap = state_snapshot()
+    occupants: Dict[str, Dict[str, List[str]]] = {}
+    for imei, tracker in snap.trackers.items():
+        if tracker.zone:
+            occupants.setdefault(tracker.zone, {"trackers": [], "ble": []})["trackers"].append(imei)
+    for mac, pos in snap.ble_positions.items():
+        if pos.zone:
+            occupants.setdefault(pos.zone, {"trackers": [], "ble": []})["ble"].append(mac)
+    zones = []
+    for zone in geofences.zones.values():
+        entry = zone.to_dict()
+        entry.update(occupants.get(zone.zone_id, {"trackers": [], "ble": []}))
+        zones.append(entry)
+    return jsonify({"success": True, "count": len(zones), "zones": zones})
+
+
+@app.get("/api/bbox")
+def api_bbox():
+    """
+    Trackers and BLE assets inside a bounding box.
+
+    GET /api/bbox?bbox=minLng,minLat,maxLng,maxLat[&type=ble|tracker|all]
+    """
+    from flask import request
+    bbox = _parse_bbox(request.args.get("bbox"))
+    if bbox is None:
+        return jsonify({"success": False, "error": "bbox must be minLng,minLat,maxLng,maxLat"}), 400
+    kind = request.args.get("type", "all")
+
+    snap = state_snapshot()
+    results = []
+    for grid_kind, grid in _spatial_grids(kind):
+        for key, _, _ in grid.bbox(*bbox):
+            entry = _nearby_entry(grid_kind, key, snap)
+            if entry is not None:
+                results.append(entry)
+    return jsonify({"success": True, "bbox": list(bbox), "count": len(results), "results": results})
 
 
 @app.route("/ble/set-position", methods=["POST"])
@@ -1269,24 +2189,25 @@ def set_ble_position():
         mac = data.get("mac", "").lower()
         lat = float(data.get("lat"))
         lng = float(data.get("lng"))
-        
-        if mac not in ble_definitions:
+
+        defs = ble_registry.current
+        if mac not in defs:
             return jsonify({"success": False, "error": f"Unknown beacon: {mac}"}), 400
         
-        with data_lock:
-            ble_info = ble_definitions[mac]
-            ble_positions[mac] = {
-                "lat": lat,
-                "lng": lng,
-                "tracker_imei": "manual",
-                "tracker_label": "Manual Set",
-                "last_update": datetime.now().isoformat(),
-                "last_seen": datetime.now(),
-                "is_paired": False,
-                "pairing_duration": 0,
-                "battery": ble_positions.get(mac, {}).get("battery"),
-                "rssi": ble_positions.get(mac, {}).get("rssi"),
-            }
+        with ble_locks.lock_for(mac):
+            ble_info = defs[mac]
+            prev = ble_positions.get(mac)
+            ble_positions[mac] = BleState(
+                mac, lat=lat, lng=lng,
+                tracker_imei="manual", tracker_label="Manual Set",
+                last_seen=mono_now(),
+                battery=prev.battery if prev else None,
+                rssi=prev.rssi if prev else None,
+            )
+            _index_ble_tracker(mac, "manual")
+            _index_ble_position(mac)
+            _mark_state_changed(macs=(mac,))
+        _push_to_workers((mac,))
         
         # Save to database
         if DB_ENABLED:
@@ -1296,9 +2217,9 @@ def set_ble_position():
                     tracker_id="manual", tracker_label="Manual Set",
                     is_paired=False, pairing_duration_sec=0,
                 )
-                logger.info(f"[MANUAL] Set {mac} ({ble_info.get('name')}) to ({lat}, {lng})")
+                logger.info("[MANUAL] Set %s (%s) to (%s, %s)", mac, ble_info.get("name"), lat, lng)
             except Exception as e:
-                logger.error(f"[MANUAL] DB error: {e}")
+                logger.error("[MANUAL] DB error: %s", e)
         
         return jsonify({
             "success": True, 
@@ -1323,20 +2244,22 @@ def set_all_home():
         lng = float(data.get("lng"))
         
         updated = []
-        with data_lock:
-            for mac, ble_info in ble_definitions.items():
-                ble_positions[mac] = {
-                    "lat": lat,
-                    "lng": lng,
-                    "tracker_imei": "manual",
-                    "tracker_label": "Home Reset",
-                    "last_update": datetime.now().isoformat(),
-                    "last_seen": datetime.now(),
-                    "is_paired": False,
-                    "pairing_duration": 0,
-                    "battery": ble_positions.get(mac, {}).get("battery"),
-                    "rssi": ble_positions.get(mac, {}).get("rssi"),
-                }
+        defs = ble_registry.current
+        home_macs = list(defs.keys())
+        with ble_locks.hold(home_macs):
+            for mac in home_macs:
+                ble_info = defs.get(mac, {})
+                prev = ble_positions.get(mac)
+                ble_positions[mac] = BleState(
+                    mac, lat=lat, lng=lng,
+                    tracker_imei="manual", tracker_label="Home Reset",
+                    last_seen=mono_now(),
+                    battery=prev.battery if prev else None,
+                    rssi=prev.rssi if prev else None,
+                )
+                _index_ble_tracker(mac, "manual")
+                _index_ble_position(mac)
+                _mark_state_changed(macs=(mac,))
                 updated.append(ble_info.get("name", mac))
                 
                 if DB_ENABLED:
@@ -1348,8 +2271,9 @@ def set_all_home():
                         )
                     except:
                         pass
+        _push_to_workers(home_macs)
         
-        logger.info(f"[MANUAL] Reset ALL {len(updated)} beacons to ({lat}, {lng})")
+        logger.info("[MANUAL] Reset ALL %d beacons to (%s, %s)", len(updated), lat, lng)
         return jsonify({
             "success": True,
             "message": f"Reset {len(updated)} beacons to home",
@@ -1458,19 +2382,142 @@ def _parse_rutx11_payload(payload: dict) -> tuple:
             "battery": b.get("battery") or b.get("battery_level"),
             "temp":    b.get("temperature") or b.get("temp"),
             "scan_ts": b.get("date_iso_8601") or b.get("timestamp"),
+            "scan_epoch": _scan_epoch(b.get("date_iso_8601") or b.get("timestamp")),
             "raw":     b,
         })
 
     return scanner_id, scanner_lat, scanner_lng, beacons
 
 
+def _scan_epoch(value: Any) -> Optional[float]:
+    """
+    RUTX11 scan time as epoch seconds: Unix seconds / milliseconds (number or
+    numeric string) or ISO-8601 with any offset (naive = UTC). None if unparseable.
+    """
+    if value is None or value == "" or isinstance(value, bool):
+        return None
+    try:
+        ts = float(value)
+        return ts / 1000.0 if ts > 1e11 else ts
+    except (TypeError, ValueError):
+        pass
+    try:
+        dt = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def _latest_per_mac(beacons: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Collapse a payload to one observation per MAC: the newest scan time, else the last one listed"""
+    latest: Dict[str, Dict[str, Any]] = {}
+    for b in beacons:
+        prev = latest.get(b["mac"])
+        if (prev is not None and prev["scan_epoch"] is not None and b["scan_epoch"] is not None
+                and b["scan_epoch"] < prev["scan_epoch"]):
+            continue
+        latest[b["mac"]] = b
+    return latest
+
+
+def _flush_rutx11_batch(items: List[Dict[str, Any]]) -> None:
+    """rutx11_writer flush: newest position per MAC across webhooks, all scans, one round trip each"""
+    positions: Dict[str, Dict[str, Any]] = {}
+    scans: List[Dict[str, Any]] = []
+    for item in items:
+        for pos in item["positions"]:
+            positions[pos["mac"]] = pos
+        scans.extend(item["scans"])
+    # db_helper reports errors by return value; raise so rutx11_writer retries the batch
+    if positions and not db_helper.upsert_ble_positions(list(positions.values())):
+        raise RuntimeError(f"BLE_Positions upsert failed ({len(positions)} positions)")
+    if scans and not db_helper.log_ble_scans(scans):
+        raise RuntimeError(f"BLE_Scans insert failed ({len(scans)} scans)")
+    log_rutx11.debug("[RUTX11] Flushed %s ingests: %s positions, %s scans", len(items), len(positions), len(scans))
+
+
+RUTX11_FLUSH_SEC = 1.0          # Webhook DB writes are batched this often
+rutx11_writer = BatchWriter("rutx11-db", _flush_rutx11_batch, interval=RUTX11_FLUSH_SEC)
+
+# Multilateration across RUTX11 scanners: the webhook only records observations,
+# rutx11_positioning_loop solves all beacons together every MULTILAT_TICK_SEC.
+MULTILAT_TICK_SEC = 2.0
+rutx11_locator = MultilaterationEngine()
+
+
+def _apply_multilateration(now: float) -> int:
+    """
+    One tick: place every defined beacon heard by >= 2 scanners; returns the
+    number placed. BLE_Positions rows go out on a move (> GPS_DRIFT_THRESHOLD_M)
+    or handover, else at the DB_HEARTBEAT_SYNC_SEC rate, like the webhook.
+    """
+    defs = ble_registry.current
+    fixes = {
+        mac: fix for mac, fix in rutx11_locator.tick(now).items()
+        if len(fix.scanners) >= 2 and mac in defs      # no randomized / unknown MACs
+    }
+    if not fixes:
+        return 0
+    positions: Dict[str, Dict[str, Any]] = {}
+    with ble_locks.hold(fixes.keys()):
+        for mac, fix in fixes.items():
+            pos = ble_positions.get(mac)
+            if pos is None:
+                bdef = defs.get(mac, {})
+                pos = ble_positions[mac] = BleState(
+                    mac, name=bdef.get("name", mac), category=bdef.get("category", "Unknown"),
+                    last_seen=now, is_paired=True,
+                )
+                moved = True
+            else:
+                moved = (
+                    pos.lat is None or pos.lng is None or pos.tracker_imei != "rutx11:multilat"
+                    or calculate_distance_meters(pos.lat, pos.lng, fix.lat, fix.lng) > GPS_DRIFT_THRESHOLD_M
+                )
+            label = "+".join(sorted(fix.scanners))
+            pos.lat = fix.lat
+            pos.lng = fix.lng
+            pos.last_seen = now if pos.last_seen is None else max(pos.last_seen, now)
+            pos.uncertainty_m = round(fix.uncertainty_m, 1)
+            pos.tracker_imei = "rutx11:multilat"
+            pos.tracker_label = label
+            pos.source = "rutx11_multilat"
+            _index_ble_tracker(mac, "rutx11:multilat")
+            _index_ble_position(mac)
+            _queue_ble_position_sql(
+                positions, mac, fix.lat, fix.lng, "rutx11:multilat", label[:100],
+                is_paired=True, pairing_duration_sec=0, battery_percent=pos.battery, force=moved,
+            )
+        _mark_state_changed(macs=fixes.keys())
+    _push_to_workers(fixes.keys())
+    if positions:
+        rutx11_writer.submit({"ingest_id": "multilat", "positions": list(positions.values()), "scans": []})
+    return len(fixes)
+
+
+def rutx11_positioning_loop():
+    """Background thread: periodic batched multilateration tick"""
+    while True:
+        time.sleep(MULTILAT_TICK_SEC)
+        try:
+            placed = _apply_multilateration(mono_now())
+            if placed:
+                log_rutx11.debug("[RUTX11] Multilateration placed %s beacons", placed)
+        except Exception as e:
+            log_rutx11.error("[RUTX11] Multilateration error: %s", e)
+
+
 @app.route("/api/rutx11", methods=["POST"])
 def rutx11_webhook():
     """
     RUTX11 BLE Webhook — receives live beacon detections from the fixed scanner.
     No 60-second pairing timer: if the RUTX11 sees a beacon, it IS there.
 
-    Stores every event to BLE_Scans (historical) and updates BLE_Positions (current).
+    The payload is collapsed to the latest observation per MAC and applied to
+    memory under one short lock; BLE_Positions / BLE_Scans writes are queued
+    for rutx11_writer. Returns 202 with an ingest_id.
 
     Expected JSON (flexible — handles multiple RUTX11 firmware formats):
       { "host": "RUTX11", "lat": 32.123, "lng": 34.456,
@@ -1487,84 +2534,117 @@ def rutx11_webhook():
         if not beacons:
             return jsonify({"success": True, "message": "No beacons in payload", "scanner": scanner_id})
 
-        now = datetime.now()
+        ingest_id = uuid.uuid4().hex
+        defs = ble_registry.current
+        latest = _latest_per_mac(beacons)
+        BEACONS_RUTX11.inc(len(beacons))
+        now = mono_now()
+        tracker_id = f"rutx11:{scanner_id}"
+        has_position = scanner_lat is not None and scanner_lng is not None
         updated = []
+        positions: Dict[str, Dict[str, Any]] = {}
+        scans = []
 
-        with data_lock:
-            for b in beacons:
-                mac = b["mac"]
+        if has_position:
+            rutx11_locator.set_scanner(scanner_id, scanner_lat, scanner_lng)
+            for mac, b in latest.items():
+                rutx11_locator.observe(mac, scanner_id, b["rssi"], now)
+
+        with ble_locks.hold(latest.keys()):
+            for mac, b in latest.items():
                 rssi = b["rssi"]
                 battery = b["battery"]
-                prev = ble_positions.get(mac, {})
+                prev = ble_positions.get(mac)
+                rssi_smoothed = rssi_filters.update((mac, tracker_id), rssi, now)
 
                 # Look up known beacon definition
-                bdef = ble_definitions.get(mac, {})
+                bdef = defs.get(mac, {})
                 beacon_name  = b["name"] or bdef.get("name") or mac
-                is_known     = mac in ble_definitions
+                is_known     = mac in defs
+
+                # Several scanners hear this beacon: its position comes from the
+                # multilateration tick, not from whichever scanner posted last
+                if has_position and prev is not None and rutx11_locator.has_fix(mac):
+                    prev.last_seen = now
+                    prev.rssi = rssi
+                    prev.rssi_smoothed = rssi_smoothed
+                    prev.distance_m = estimate_distance_m(rssi_smoothed)
+                    if battery is not None:
+                        prev.battery = battery
+                    updated.append({"mac": mac, "name": beacon_name, "rssi": rssi, "known": is_known, "multilat": True})
+                    scans.append({
+                        "mac": mac, "lat": prev.lat, "lng": prev.lng,
+                        "tracker_imei": tracker_id, "tracker_label": scanner_id,
+                        "rssi": rssi, "battery_percent": battery, "is_known_beacon": is_known,
+                    })
+                    continue
 
                 # Only update position when scanner coordinates are provided by the webhook.
-                if scanner_lat is not None and scanner_lng is not None:
-                    ble_positions[mac] = {
-                        "mac":          mac,
-                        "name":         beacon_name,
-                        "category":     bdef.get("category", "Unknown"),
-                        "lat":          scanner_lat,
-                        "lng":          scanner_lng,
-                        "tracker_imei": f"rutx11:{scanner_id}",
-                        "tracker_label": scanner_id,
-                        "last_update":  now.isoformat(),
-                        "last_seen":    now,
-                        "is_paired":    True,          # Fixed scanner = always "paired"
-                        "pairing_duration": 0,
-                        "battery":      battery if battery is not None else prev.get("battery"),
-                        "rssi":         rssi,
-                        "source":       "rutx11",
-                    }
-
-                    # Store to BLE_Positions in DB
-                    _sync_ble_position_sql(
-                        mac=mac,
+                if has_position:
+                    battery = battery if battery is not None else (prev.battery if prev else None)
+                    ble_positions[mac] = BleState(
+                        mac,
+                        name=beacon_name,
+                        category=bdef.get("category", "Unknown"),
                         lat=scanner_lat,
                         lng=scanner_lng,
-                        tracker_id=f"rutx11:{scanner_id}",
+                        tracker_imei=tracker_id,
                         tracker_label=scanner_id,
-                        is_paired=True,
-                        pairing_duration_sec=0,
-                        battery_percent=battery,
-                        now=now,
-                        force=True,
+                        last_seen=now,
+                        is_paired=True,          # Fixed scanner = always "paired"
+                        battery=battery,
+                        rssi=rssi,
+                        source="rutx11",
+                    )
+                    ble_positions[mac].rssi_smoothed = rssi_smoothed
+                    ble_positions[mac].distance_m = estimate_distance_m(rssi_smoothed)
+                    _index_ble_tracker(mac, tracker_id)
+                    _index_ble_position(mac)
+
+                    # BLE_Positions: on a move or handover, else at the heartbeat rate
+                    # (smoothed RSSI only, so noise alone never forces a write);
+                    # same throttle as the multilateration tick and the TCP path
+                    moved = prev is None or prev.lat != scanner_lat or prev.lng != scanner_lng or prev.tracker_imei != tracker_id
+                    _queue_ble_position_sql(
+                        positions, mac, scanner_lat, scanner_lng, tracker_id, scanner_id,
+                        is_paired=True, pairing_duration_sec=0, battery_percent=battery, force=moved,
                     )
 
                 # Always store raw scan event to BLE_Scans (historical log)
-                if DB_ENABLED:
-                    try:
-                        db_helper.log_ble_scan(
-                            mac=mac,
-                            lat=scanner_lat, lng=scanner_lng,
-                            tracker_imei=f"rutx11:{scanner_id}",
-                            tracker_label=scanner_id,
-                            rssi=rssi,
-                            battery_percent=battery,
-                            is_known_beacon=is_known,
-                        )
-                    except Exception as db_err:
-                        logger.warning(f"[RUTX11] DB BLE_Scans error: {db_err}")
-
+                scans.append({
+                    "mac": mac,
+                    "lat": scanner_lat,
+                    "lng": scanner_lng,
+                    "tracker_imei": tracker_id,
+                    "tracker_label": scanner_id,
+                    "rssi": rssi,
+                    "battery_percent": battery,
+                    "is_known_beacon": is_known,
+                })
                 updated.append({"mac": mac, "name": beacon_name, "rssi": rssi, "known": is_known})
-                logger.info(
-                    f"[RUTX11] {beacon_name} ({mac}) rssi={rssi} "
-                    f"at scanner={scanner_id} ({scanner_lat},{scanner_lng})"
-                )
+            if has_position:
+                _mark_state_changed(macs=latest.keys())
+        if has_position:
+            _push_to_workers(latest.keys())
+
+        if DB_ENABLED:
+            rutx11_writer.submit({"ingest_id": ingest_id, "positions": list(positions.values()), "scans": scans})
 
+        log_rutx11.debug(
+            "[RUTX11] %s: %d observations, %d beacons at scanner=%s (%s,%s)",
+            ingest_id, len(beacons), len(latest), scanner_id, scanner_lat, scanner_lng,
+        )
         return jsonify({
-            "success":  True,
-            "scanner":  scanner_id,
-            "received": len(beacons),
-            "updated":  updated,
-        })
+            "success":   True,
+            "ingest_id": ingest_id,
+            "scanner":   scanner_id,
+            "received":  len(beacons),
+            "unique":    len(latest),
+            "updated":   updated,
+        }), 202
 
     except Exception as e:
-        logger.error(f"[RUTX11] Webhook error: {e}")
+        log_rutx11.error("[RUTX11] Webhook error: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 
@@ -1585,6 +2665,7 @@ def rutx11_register():
         name = data.get("name", scanner_id)
 
         rutx11_scanners[scanner_id] = {"lat": lat, "lng": lng, "name": name}
+        rutx11_locator.set_scanner(scanner_id, lat, lng)
 
         # Persist to System_Config so it survives restarts
         if DB_ENABLED:
@@ -1603,9 +2684,9 @@ def rutx11_register():
                 """, key, val)
                 conn.commit()
             except Exception as db_err:
-                logger.warning(f"[RUTX11] DB register error: {db_err}")
+                log_rutx11.warning("[RUTX11] DB register error: %s", db_err)
 
-        logger.info(f"[RUTX11] Registered scanner '{scanner_id}' at ({lat}, {lng}) name='{name}'")
+        log_rutx11.info("[RUTX11] Registered scanner '%s' at (%s, %s) name='%s'", scanner_id, lat, lng, name)
         return jsonify({"success": True, "scanner_id": scanner_id, "lat": lat, "lng": lng})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 400
@@ -1617,6 +2698,311 @@ def rutx11_list_scanners():
     return jsonify({"scanners": rutx11_scanners})
 
 
+# ============================================================
+# STATE CHECKPOINT (warm restart)
+# ============================================================
+# Every CHECKPOINT_SEC the full in-memory state (trackers, positions, pairings,
+# SQL sync throttles, scanner registry) is written atomically to a local file.
+# On start it is loaded before the listeners open, and SQL is reconciled in the
+# background, so pairing timers survive a restart and SQL isn't hit with
+# forced re-writes. Worker processes keep their own file (<path>.w<index>).
+CHECKPOINT_PATH = os.environ.get(
+    "BROKER_CHECKPOINT_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "broker_state.ckpt"),
+)
+CHECKPOINT_SEC = float(os.environ.get("BROKER_CHECKPOINT_SEC", "30"))
+CHECKPOINT_MAX_AGE_SEC = 6 * 3600   # older checkpoints are ignored (cold start from SQL)
+
+_TRACKER_TIME_FIELDS = ("event_time",)
+_BLE_TIME_FIELDS = ("last_seen",)
+_PAIRING_TIME_FIELDS = ("start_time",)
+
+CHECKPOINT_SECONDS = REGISTRY.histogram("broker_checkpoint_seconds", "State checkpoint write time")
+CHECKPOINT_BYTES = REGISTRY.gauge("broker_checkpoint_bytes", "Size of the last state checkpoint")
+
+
+def save_checkpoint(path: str = CHECKPOINT_PATH) -> int:
+    """Write the current state to path (atomic replace); returns the file size"""
+    t0 = time.perf_counter()
+    snap = state_snapshot()
+    pairing = {}
+    last_sync = {}
+    for mac in list(ble_pairing):           # one stripe at a time, like state_snapshot
+        with ble_locks.lock_for(mac):
+            p = ble_pairing.get(mac)
+            if p is not None:
+                pairing[mac] = p.copy()
+            if mac in ble_db_last_sync:
+                last_sync[mac] = mono_to_epoch(ble_db_last_sync[mac])
+    for mac in list(ble_db_last_sync):
+        if mac not in last_sync:
+            with ble_locks.lock_for(mac):
+                t = ble_db_last_sync.get(mac)
+            if t is not None:
+                last_sync[mac] = mono_to_epoch(t)
+    size = state_checkpoint.write(path, {
+        "trackers": pack_records(snap.trackers, TrackerState.__slots__, _TRACKER_TIME_FIELDS),
+        "ble_positions": pack_records(snap.ble_positions, BleState.__slots__, _BLE_TIME_FIELDS),
+        "ble_pairing": pack_records(pairing, PairingState.__slots__, _PAIRING_TIME_FIELDS),
+        "ble_db_last_sync": last_sync,
+        "rutx11_scanners": dict(rutx11_scanners),
+    })
+    CHECKPOINT_SECONDS.observe(time.perf_counter() - t0)
+    CHECKPOINT_BYTES.set(size)
+    return size
+
+
+def restore_checkpoint(path: str = CHECKPOINT_PATH) -> bool:
+    """Load a checkpoint into the (empty) in-memory state; False if there is none usable"""
+    sections = state_checkpoint.read(path, CHECKPOINT_MAX_AGE_SEC)
+    if sections is None:
+        return False
+    restored_trackers = unpack_records(sections.get("trackers", {}), TrackerState, _TRACKER_TIME_FIELDS)
+    restored_ble = unpack_records(sections.get("ble_positions", {}), BleState, _BLE_TIME_FIELDS)
+    restored_pairing = unpack_records(
+        sections.get("ble_pairing", {}), lambda mac: PairingState("", 0.0), _PAIRING_TIME_FIELDS
+    )
+    with tracker_locks.hold_all(), ble_locks.hold_all():
+        # Zones are seeded from the restored tags, not re-derived: a restore is
+        # not a movement and must not queue "enter" events
+        for imei, tracker in restored_trackers.items():
+            trackers[imei] = tracker
+            if tracker.lat or tracker.lng:
+                tracker_grid.update(imei, tracker.lat, tracker.lng)
+            zone_tracker.seed(f"tracker:{imei}", tracker.zone)
+        for mac, pos in restored_ble.items():
+            ble_positions[mac] = pos
+            _index_ble_tracker(mac, pos.tracker_imei)
+            ble_grid.update(mac, pos.lat, pos.lng)
+            zone_tracker.seed(f"ble:{mac}", pos.zone)
+        ble_pairing.update(restored_pairing)
+        for mac, ts in sections.get("ble_db_last_sync", {}).items():
+            ble_db_last_sync[mac] = epoch_to_mono(ts)
+        _mark_state_changed(imeis=restored_trackers.keys(), macs=restored_ble.keys())
+    for sid, info in sections.get("rutx11_scanners", {}).items():
+        rutx11_scanners.setdefault(sid, info)
+        rutx11_locator.set_scanner(sid, info.get("lat"), info.get("lng"))
+    logger.info(
+        "[CHECKPOINT] Restored %d trackers, %d BLE positions, %d pairings from %s",
+        len(restored_trackers), len(restored_ble), len(restored_pairing), path,
+    )
+    return True
+
+
+def checkpoint_loop(path: str = CHECKPOINT_PATH) -> None:
+    """Background thread: checkpoint whenever the state changed since the last write"""
+    written_version = state_version
+    while True:
+        time.sleep(CHECKPOINT_SEC)
+        version = state_version
+        if version == written_version:
+            continue
+        try:
+            save_checkpoint(path)
+            written_version = version
+        except Exception as e:
+            logger.error("[CHECKPOINT] Write failed: %s", e)
+
+
+def start_checkpointing(path: str = CHECKPOINT_PATH) -> None:
+    threading.Thread(target=checkpoint_loop, args=(path,), daemon=True, name="checkpoint").start()
+    atexit.register(_final_checkpoint, path)
+
+
+def _final_checkpoint(path: str) -> None:
+    try:
+        save_checkpoint(path)
+    except Exception as e:
+        logger.error("[CHECKPOINT] Final write failed: %s", e)
+
+
+# ============================================================
+# DEFINITIONS RELOAD
+# ============================================================
+# BLE_Definitions writers bump the System_Config change stamp; every process
+# polls it and swaps a freshly built BleDefinitions into ble_registry, so new
+# beacons are matched without a restart.
+DEFINITIONS_POLL_SEC = 10
+
+
+def reload_definitions() -> bool:
+    """Load BLE_Definitions and swap them in as the current version; False if SQL failed"""
+    snapshot = db_helper.get_ble_definitions_snapshot()
+    if snapshot is None:
+        return False
+    version, db_defs = snapshot
+    previous = ble_registry.current
+    defs = ble_registry.swap(db_defs, version)
+    added = len(set(defs.keys()) - set(previous.keys()))
+    removed = len(set(previous.keys()) - set(defs.keys()))
+    log_db.info(
+        "[DEFS] Version %s -> %s: %d definitions (+%d / -%d)",
+        previous.version, version, len(defs), added, removed,
+    )
+    return True
+
+
+def definitions_watcher() -> None:
+    """Background thread: reload the definitions whenever the change stamp moves"""
+    while True:
+        time.sleep(DEFINITIONS_POLL_SEC)
+        try:
+            version = db_helper.get_ble_definitions_version()
+        except Exception as e:
+            log_db.warning("[DEFS] Version check failed: %s", e)
+            continue
+        if version is None or version != ble_registry.version:   # NULL stamp: always reload
+            reload_definitions()
+
+
+def start_definitions_watcher() -> None:
+    threading.Thread(target=definitions_watcher, daemon=True, name="defs-watcher").start()
+
+
+def _fill_from_sql(current: BleState, row: Dict[str, Any], sql_seen: Optional[float]) -> bool:
+    """Copy SQL values into the fields an in-memory record lacks (caller holds its stripe); True if the position was filled"""
+    for field, value in (
+        ("battery", row.get("battery")),
+        ("rssi", row.get("rssi")),
+        ("name", row.get("name")),
+        ("category", row.get("category")),
+    ):
+        if getattr(current, field) is None and value is not None:
+            setattr(current, field, value)
+    if current.last_seen is None:
+        current.last_seen = sql_seen
+    if current.lat is not None and current.lng is not None:
+        return False
+    if row.get("lat") is None or row.get("lng") is None:
+        return False
+    current.lat = row.get("lat")
+    current.lng = row.get("lng")
+    return True
+
+
+def hydrate_from_sql() -> None:
+    """
+    Load definitions, stored BLE positions and RUTX11 scanners from SQL.
+    Runs while devices are already connected (and possibly after a checkpoint
+    restore). SQL last_update is server local time, not our event-time clock,
+    so a record already in memory is never replaced: SQL only fills the fields
+    it is missing.
+    """
+    startup_state["phase"] = "definitions"
+    if not reload_definitions():
+        raise RuntimeError("could not load BLE definitions")
+    startup_state["definitions"] = len(ble_registry.current)
+
+    # Load stored BLE positions
+    startup_state["phase"] = "positions"
+    db_positions = db_helper.get_all_ble_positions()
+    adopted = 0
+    for mac, pos in db_positions.items():
+        sql_seen = wall_to_mono(pos.get("last_update"))
+        with ble_locks.lock_for(mac):
+            current = ble_positions.get(mac)
+            if current is not None:
+                if _fill_from_sql(current, pos, sql_seen):
+                    _index_ble_position(mac, emit=False)
+                    _mark_state_changed(macs=(mac,))
+                    adopted += 1
+                continue
+            ble_positions[mac] = BleState(
+                mac,
+                lat=pos.get("lat"),
+                lng=pos.get("lng"),
+                tracker_imei=str(pos.get("last_tracker_id", "")),
+                tracker_label=pos.get("last_tracker_label", ""),
+                last_seen=sql_seen,
+                is_paired=pos.get("is_paired", False),
+                battery=pos.get("battery"),
+                rssi=pos.get("rssi"),
+                name=pos.get("name"),
+                category=pos.get("category"),
+            )
+            _index_ble_tracker(mac, ble_positions[mac].tracker_imei)
+            # Loading state is not a movement: no zone events during hydration,
+            # so restore + hydrate is idempotent (the zone is only recorded)
+            _index_ble_position(mac, emit=False)
+            _mark_state_changed(macs=(mac,))
+            adopted += 1
+    startup_state["positions"] = adopted
+    log_db.info("[DB] Loaded %s stored BLE positions (%s applied)", len(db_positions), adopted)
+
+    # Load persisted RUTX11 scanner registrations
+    startup_state["phase"] = "scanners"
+    loaded_scanners = db_helper.get_rutx11_scanners()
+    rutx11_scanners.update(loaded_scanners)
+    for sid, info in loaded_scanners.items():
+        rutx11_locator.set_scanner(sid, info.get("lat"), info.get("lng"))
+        log_db.info("[DB] Loaded RUTX11 scanner '%s' at (%s,%s) — %s", sid, info.get('lat'), info.get('lng'), info.get('name',''))
+    startup_state["scanners"] = len(loaded_scanners)
+
+
+# ============================================================
+# STARTUP / READINESS
+# ============================================================
+# The TCP listener and HTTP API open first; SQL is connected (with retry) and
+# hydrated in the background. /health reports progress in "startup".
+HYDRATE_RETRY_SEC = 10
+# Worker processes hold beacon processing until hydrated, at most this long
+HYDRATE_WAIT_SEC = 30
+
+_hydrated = threading.Event()
+_hydrate_deadline: Optional[float] = None   # set in worker processes only
+
+startup_state: Dict[str, Any] = {
+    "ready": False,
+    "phase": "starting",        # starting -> connecting -> definitions -> positions -> scanners -> ready
+    "checkpoint_restored": False,
+    "db_connected": False,
+    "attempts": 0,
+    "definitions": 0,
+    "positions": 0,
+    "scanners": 0,
+    "error": None,
+    "started_at": time.time(),
+    "ready_after_sec": None,
+}
+
+
+def _mark_ready() -> None:
+    startup_state["phase"] = "ready"
+    startup_state["ready"] = True
+    startup_state["ready_after_sec"] = round(time.time() - startup_state["started_at"], 3)
+    _hydrated.set()
+
+
+def _wait_hydrated() -> None:
+    """Worker side: hold the first beacons until SQL positions are loaded (bounded)"""
+    if _hydrate_deadline is None or _hydrated.is_set():
+        return
+    _hydrated.wait(max(0.0, _hydrate_deadline - time.monotonic()))
+
+
+def hydrate_in_background() -> None:
+    """Background thread: wait for SQL Server, then hydrate; retries until it succeeds"""
+    if not DB_ENABLED:
+        _mark_ready()
+        return
+    while True:
+        startup_state["phase"] = "connecting"
+        startup_state["attempts"] += 1
+        try:
+            db_helper.wait_for_connection()
+            startup_state["db_connected"] = True
+            hydrate_from_sql()
+            startup_state["error"] = None
+            _mark_ready()
+            logger.info("[STARTUP] Ready after %.1fs", startup_state["ready_after_sec"])
+            start_definitions_watcher()
+            return
+        except Exception as e:
+            startup_state["error"] = str(e)
+            log_db.error("[DB] Hydration failed (attempt %d): %s", startup_state["attempts"], e)
+            time.sleep(HYDRATE_RETRY_SEC)
+
+
 # ============================================================
 # MAIN
 # ============================================================
@@ -1624,50 +3010,44 @@ def main():
     logger.info("=" * 60)
     logger.info("Teltonika Direct Broker Starting")
     logger.info("=" * 60)
-    logger.info(f"TCP Port (Devices): {TCP_PORT}")
-    logger.info(f"HTTP Port (API): {HTTP_PORT}")
-    logger.info(f"Database: {'Enabled' if DB_ENABLED else 'Disabled'}")
-    logger.info(f"Known BLE Definitions: {len(ble_definitions)}")
+    logger.info("TCP Port (Devices): %s", TCP_PORT)
+    logger.info("HTTP Port (API): %s", HTTP_PORT)
+    logger.info("Database: %s", "Enabled" if DB_ENABLED else "Disabled")
+    logger.info("Known BLE Definitions: %d built-in", len(ble_registry.current))
     logger.info("=" * 60)
+
+    # Load geofence polygons (before positions, so restored positions get tagged)
+    global geofences
+    try:
+        geofences = GeofenceIndex(load_zones(GEOFENCE_FILES))
+        log_zone.info("[ZONE] Loaded %s geofence zones", len(geofences))
+    except Exception as e:
+        log_zone.error("[ZONE] Geofence load error: %s", e)
     
-    # Load BLE definitions from database
+    # Warm start from the local checkpoint (milliseconds); SQL catches up in the
+    # background once the listeners are open
+    startup_state["checkpoint_restored"] = restore_checkpoint()
+    start_checkpointing()
+
+    threading.Thread(target=rutx11_positioning_loop, daemon=True).start()
+
+    if BROKER_WORKERS > 1:
+        # Device connections are served by worker processes (see MULTI-WORKER MODE)
+        start_workers()
+    else:
+        # Start TCP server in background thread
+        tcp_thread = threading.Thread(target=tcp_server)
+        tcp_thread.daemon = True
+        tcp_thread.start()
+
+    # Manual / RUTX11 moves are zone-tagged here in both modes
     if DB_ENABLED:
-        try:
-            db_defs = db_helper.get_ble_definitions()
-            ble_definitions.update(db_defs)
-            logger.info(f"[DB] Loaded {len(db_defs)} BLE definitions")
-            
-            # Load stored BLE positions
-            db_positions = db_helper.get_all_ble_positions()
-            for mac, pos in db_positions.items():
-                if mac not in ble_positions:
-                    ble_positions[mac] = {
-                        "lat": pos.get("lat"),
-                        "lng": pos.get("lng"),
-                        "tracker_imei": str(pos.get("last_tracker_id", "")),
-                        "tracker_label": pos.get("last_tracker_label", ""),
-                        "last_update": pos.get("last_update"),
-                        "is_paired": pos.get("is_paired", False),
-                        "battery": pos.get("battery_percent"),
-                    }
-            logger.info(f"[DB] Loaded {len(db_positions)} stored BLE positions")
-
-            # Load persisted RUTX11 scanner registrations
-            loaded_scanners = db_helper.get_rutx11_scanners()
-            rutx11_scanners.update(loaded_scanners)
-            if loaded_scanners:
-                for sid, info in loaded_scanners.items():
-                    logger.info(f"[DB] Loaded RUTX11 scanner '{sid}' at ({info.get('lat')},{info.get('lng')}) — {info.get('name','')}")
-        except Exception as e:
-            logger.error(f"[DB] Load error: {e}")
-    
-    # Start TCP server in background thread
-    tcp_thread = threading.Thread(target=tcp_server)
-    tcp_thread.daemon = True
-    tcp_thread.start()
-    
+        threading.Thread(target=zone_event_writer, daemon=True).start()
+
+    threading.Thread(target=hydrate_in_background, daemon=True, name="sql-hydrate").start()
+
     # Start HTTP server (Flask)
-    logger.info(f"[HTTP] API server starting on port {HTTP_PORT}")
+    logger.info("[HTTP] API server starting on port %s", HTTP_PORT)
     app.run(host="0.0.0.0", port=HTTP_PORT, debug=False, threaded=True)
 
 